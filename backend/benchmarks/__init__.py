@@ -0,0 +1,10 @@
+"""
+Throughput and latency benchmarks for the Llama veteran grouper.
+
+Run from backend/:
+
+    python -m benchmarks.run --profiles 2000 --concurrency 8 --output bench.json
+
+By default a local fake Ollama (``benchmarks.fake_ollama``) stands in for
+the model; pass ``--endpoint`` to benchmark a real server instead.
+"""
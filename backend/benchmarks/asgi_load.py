@@ -0,0 +1,182 @@
+"""
+Load test the async LLM endpoints on a single ASGI worker.
+
+Starts the fake Ollama server and one in-process uvicorn worker on a
+throwaway SQLite database, then fires ``--requests`` concurrent
+``POST /api/v1/users/{id}/analyze/`` calls, each for a different user,
+and reports status codes, latency percentiles and the number of threads
+the server used.
+
+    python -m benchmarks.asgi_load --requests 300 --latency-ms 2000
+
+Needs uvicorn and httpx.
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict
+
+from benchmarks.fake_ollama import FakeOllamaConfig, FakeOllamaServer
+from benchmarks.run import latency_summary
+
+
+def _serve_fake(config: FakeOllamaConfig, endpoint, stop, stats) -> None:
+    with FakeOllamaServer(config) as server:
+        endpoint.put(server.endpoint)
+        stop.wait()
+        stats.put(server.stats_dict())
+
+
+def _setup_django(args: argparse.Namespace, endpoint: str, db_path: str) -> None:
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+    os.environ.update(
+        LLAMA_ENDPOINT=endpoint,
+        LLAMA_CACHE_PATH="",   # 每个请求都真正到达模型
+        LLAMA_CONCURRENCY=str(args.llm_concurrency),
+        LLAMA_POOL_SIZE=str(max(args.llm_concurrency, args.requests)),
+        LLAMA_TIMEOUT=str(args.timeout),
+        ANALYSIS_AUTO_ENQUEUE="false",
+    )
+    import django
+    from django.conf import settings
+    django.setup()
+    settings.DATABASES["default"]["NAME"] = db_path
+    from django.core.management import call_command
+    call_command("migrate", verbosity=0)
+
+
+def _create_users(count: int) -> Dict[int, str]:
+    """user id -> JWT access token"""
+    from rest_framework_simplejwt.tokens import RefreshToken
+    from users.models import CustomUser
+
+    CustomUser.objects.bulk_create([
+        CustomUser(username=f"load{i}", email=f"load{i}@example.com",
+                   location="Austin", job=f"job {i}", hobby="fishing")
+        for i in range(count)
+    ])
+    return {user.pk: str(RefreshToken.for_user(user).access_token)
+            for user in CustomUser.objects.order_by("pk")}
+
+
+async def _fire(port: int, tokens: Dict[int, str], timeout: float):
+    import httpx
+
+    async def one(client, pk, token):
+        start = time.perf_counter()
+        response = await client.post(f"/api/v1/users/{pk}/analyze/",
+                                     headers={"Authorization": f"Bearer {token}"})
+        return response.status_code, time.perf_counter() - start
+
+    limits = httpx.Limits(max_connections=len(tokens) + 10)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=timeout,
+                                 limits=limits) as client:
+        start = time.perf_counter()
+        results = await asyncio.gather(*(one(client, pk, token) for pk, token in tokens.items()))
+        return results, time.perf_counter() - start
+
+
+def _run_clients(port: int, tokens: Dict[int, str], timeout: float, report) -> None:
+    report.put(asyncio.run(_fire(port, tokens, timeout)))
+
+
+def run_load_test(args: argparse.Namespace) -> Dict[str, Any]:
+    import uvicorn
+
+    # The fake server and the clients run in their own processes so they do
+    # not compete with the ASGI worker for the GIL
+    config = FakeOllamaConfig(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                              tokens_per_second=args.token_rate)
+    endpoint, stop, stats = multiprocessing.Queue(), multiprocessing.Event(), multiprocessing.Queue()
+    fake = multiprocessing.Process(target=_serve_fake, args=(config, endpoint, stop, stats), daemon=True)
+    fake.start()
+    with tempfile.TemporaryDirectory() as tmp:
+        _setup_django(args, endpoint.get(timeout=10), os.path.join(tmp, "load.sqlite3"))
+        tokens = _create_users(args.requests)
+
+        from config.asgi import application
+        asgi = uvicorn.Server(uvicorn.Config(application, host="127.0.0.1", port=args.port,
+                                             log_level="warning"))
+        thread = threading.Thread(target=asgi.run, daemon=True)
+        threads_before = threading.active_count()
+        thread.start()
+        while not asgi.started:
+            time.sleep(0.05)
+
+        peak_threads = threads_before
+        done = threading.Event()
+
+        def sample_threads():
+            nonlocal peak_threads
+            while not done.wait(0.1):
+                peak_threads = max(peak_threads, threading.active_count())
+
+        sampler = threading.Thread(target=sample_threads, daemon=True)
+        sampler.start()
+        report = multiprocessing.Queue()
+        clients = multiprocessing.Process(target=_run_clients,
+                                          args=(args.port, tokens, args.timeout, report))
+        cpu_before = resource.getrusage(resource.RUSAGE_SELF)
+        clients.start()
+        results, wall_s = report.get()
+        cpu_after = resource.getrusage(resource.RUSAGE_SELF)
+        clients.join()
+        done.set()
+        sampler.join()
+        asgi.should_exit = True
+        thread.join(timeout=5)
+        from django.db import connections
+        connections.close_all()
+    stop.set()
+    server_stats = stats.get(timeout=10)
+    fake.join(timeout=5)
+
+    return {
+        "config": vars(args),
+        "requests": len(results),
+        "wall_s": round(wall_s, 3),
+        "status_codes": dict(Counter(status for status, _ in results)),
+        "latency": latency_summary([seconds for _, seconds in results]),
+        "server_cpu_s": round(cpu_after.ru_utime + cpu_after.ru_stime
+                              - cpu_before.ru_utime - cpu_before.ru_stime, 3),
+        # uvicorn 线程 + 采样线程之外新增的线程（同步 ORM 调用等）
+        "server_threads": peak_threads - threads_before,
+        "server": server_stats,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Load test the async analyze endpoint over ASGI")
+    parser.add_argument("--requests", type=int, default=300, help="Concurrent requests")
+    parser.add_argument("--llm-concurrency", type=int, default=0,
+                        help="LLAMA_CONCURRENCY for the scheduler (0 = unscheduled)")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--output", help="Write the JSON report here (default: stdout)")
+    fake = parser.add_argument_group("fake server")
+    fake.add_argument("--latency-ms", type=float, default=2000.0)
+    fake.add_argument("--jitter-ms", type=float, default=100.0)
+    fake.add_argument("--token-rate", type=float, default=50.0, help="Tokens per second")
+    args = parser.parse_args(argv)
+
+    report = run_load_test(args)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0 if set(report["status_codes"]) == {200} else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,244 @@
+"""
+Local stand-in for the Ollama ``/api/generate`` endpoint.
+
+The server simulates model timing: a fixed first-token latency (with
+jitter) and then a steady token rate. Like ``OLLAMA_NUM_PARALLEL``,
+``max_parallel`` caps concurrent generations; further requests wait in
+arrival order. It also injects failures at
+configurable rates:
+
+- errors: HTTP 503 before any output
+- malformed: output that is not a valid analysis object
+
+Responses follow Ollama's wire format, for both streaming NDJSON and
+single JSON bodies, including ``prompt_eval_count`` and ``eval_count``.
+When the request carries a ``format`` schema, tags are drawn from that
+schema's enum, so structured output validates.
+"""
+
+import json
+import random
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+
+CHARS_PER_TOKEN = 4
+DEFAULT_TAGS = ["PTSD", "Job", "Anxiety", "Sleep issues", "Peer support", "Recently transitioned"]
+RISK_LEVELS = ["Low", "Medium", "High", "Critical"]
+TRAILING_CHATTER = "\n\nLet me know if you would like more detail on any of these recommendations."
+
+
+@dataclass
+class FakeOllamaConfig:
+    """Simulated model behaviour"""
+    latency_ms: float = 50.0
+    jitter_ms: float = 10.0
+    tokens_per_second: float = 400.0
+    error_rate: float = 0.0
+    malformed_rate: float = 0.0
+    trailing_chatter: bool = True
+    max_parallel: Optional[int] = None
+    seed: Optional[int] = None
+
+
+@dataclass
+class FakeOllamaStats:
+    requests: int = 0
+    errors: int = 0
+    malformed: int = 0
+    streamed: int = 0
+    disconnected: int = 0
+    tokens_sent: int = 0
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json(200, {"models": [{"name": "fake"}]})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/api/generate":
+            self._send_json(404, {"error": "not found"})
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        self.server.fake.handle_generate(self, body)
+
+    def _send_json(self, status: int, payload: Dict[str, Any]) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _write_chunk(self, payload: Dict[str, Any]) -> None:
+        line = (json.dumps(payload) + "\n").encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+        self.wfile.flush()
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024   # listen backlog; the default 5 refuses bursts of connections
+
+    def handle_error(self, request, client_address):
+        # Clients closing a stream early is expected, not an error
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+
+class FakeOllamaServer:
+    """Threaded fake Ollama server; use as a context manager or call start/stop"""
+
+    def __init__(self, config: Optional[FakeOllamaConfig] = None, host: str = "127.0.0.1",
+                 port: int = 0):
+        self.config = config or FakeOllamaConfig()
+        self.stats = FakeOllamaStats()
+        self._rng = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(self.config.max_parallel) if self.config.max_parallel else None
+        self._httpd = _HTTPServer((host, port), _Handler)
+        self._httpd.fake = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def endpoint(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeOllamaServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True,
+                                        name="fake-ollama")
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "FakeOllamaServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    # ---------- simulation ----------
+    def _roll(self, rate: float) -> bool:
+        with self._lock:
+            return self._rng.random() < rate
+
+    def _analysis_text(self, body: Dict[str, Any], malformed: bool) -> str:
+        schema = body.get("format") if isinstance(body.get("format"), dict) else None
+        tags = DEFAULT_TAGS
+        if schema:
+            tags = schema["properties"]["primary_tags"]["items"].get("enum", DEFAULT_TAGS)
+        with self._lock:
+            picked = self._rng.sample(tags, min(6, len(tags)))
+            risk = self._rng.choice(RISK_LEVELS)
+            score = self._rng.randint(1, 20)
+        analysis = {
+            "primary_tags": picked[:4],
+            "secondary_tags": picked[4:],
+            "risk_level": risk,
+            "priority_score": score,
+            "intervention_needed": risk == "Critical",
+            "recommended_groups": ["Peer Support Circle", "Veterans Career Network"],
+            "resource_priorities": ["VA mental health services", "VA employment services",
+                                    "Vet Center counseling"],
+            "reasoning": "Synthetic assessment generated by the benchmark fake server.",
+        }
+        text = json.dumps(analysis)
+        if malformed:
+            # Schema violation part-way through, then a truncated object
+            text = text.replace(f'"risk_level": "{risk}"', '"risk_level": "Unclear"')
+            text = text[:int(len(text) * 0.8)]
+        elif self.config.trailing_chatter and not schema:
+            text += TRAILING_CHATTER
+        return text
+
+    def _prompt_tokens(self, body: Dict[str, Any]) -> int:
+        chars = len(body.get("system") or "") + len(body.get("prompt") or "")
+        return max(1, chars // CHARS_PER_TOKEN)
+
+    def handle_generate(self, handler: _Handler, body: Dict[str, Any]) -> None:
+        if self._slots is None:
+            self._generate(handler, body)
+            return
+        with self._slots:
+            self._generate(handler, body)
+
+    def _generate(self, handler: _Handler, body: Dict[str, Any]) -> None:
+        config = self.config
+        with self._lock:
+            self.stats.requests += 1
+            delay = max(0.0, config.latency_ms + self._rng.uniform(-1, 1) * config.jitter_ms)
+
+        if self._roll(config.error_rate):
+            with self._lock:
+                self.stats.errors += 1
+            handler._send_json(503, {"error": "model overloaded"})
+            return
+
+        malformed = self._roll(config.malformed_rate)
+        if malformed:
+            with self._lock:
+                self.stats.malformed += 1
+        text = self._analysis_text(body, malformed)
+        tokens = [text[i:i + CHARS_PER_TOKEN] for i in range(0, len(text), CHARS_PER_TOKEN)]
+        num_predict = (body.get("options") or {}).get("num_predict")
+        if num_predict:
+            tokens = tokens[:num_predict]
+        per_token = 1 / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+        final = {
+            "model": body.get("model", "fake"), "response": "", "done": True,
+            "prompt_eval_count": self._prompt_tokens(body),
+            "prompt_eval_duration": int(delay * 1e6),
+            "eval_count": len(tokens),
+            "eval_duration": int(len(tokens) * per_token * 1e9),
+        }
+
+        time.sleep(delay / 1000)
+        if not body.get("stream", True):
+            time.sleep(len(tokens) * per_token)
+            with self._lock:
+                self.stats.tokens_sent += len(tokens)
+            handler._send_json(200, dict(final, response="".join(tokens)))
+            return
+
+        with self._lock:
+            self.stats.streamed += 1
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/x-ndjson")
+        handler.send_header("Transfer-Encoding", "chunked")
+        handler.end_headers()
+        sent = 0
+        try:
+            for token in tokens:
+                handler._write_chunk({"model": final["model"], "response": token, "done": False})
+                sent += 1
+                time.sleep(per_token)
+            handler._write_chunk(final)
+            handler.wfile.write(b"0\r\n\r\n")
+            handler.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped the generation early
+            with self._lock:
+                self.stats.disconnected += 1
+            handler.close_connection = True
+        finally:
+            with self._lock:
+                self.stats.tokens_sent += sent
+
+    def stats_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return asdict(self.stats)
@@ -0,0 +1,99 @@
+"""
+Synthetic ``VeteranProfile`` generation for benchmarks.
+
+Profiles are variations of ``create_sample_veterans``. Service details,
+dates, flags and interests are perturbed with a seeded RNG, so a run is
+reproducible. A configurable share of profiles carries crisis signals,
+which exercises the pre-triage crisis route.
+"""
+
+import dataclasses
+import random
+from datetime import date, timedelta
+from typing import List
+
+from models.DynamicGrouping_Llama2B import VeteranProfile, create_sample_veterans
+
+BRANCHES = ["Army", "Navy", "Air Force", "Marine Corps", "Coast Guard", "Space Force"]
+RANKS = ["E-3", "E-4", "E-5", "E-6", "E-7", "O-2", "O-3", "O-4", "W-2"]
+JOBS = ["Infantry", "Logistics", "Intelligence Officer", "Medic", "Mechanic", "Signals",
+        "Military Police", "Aviation Maintenance", "Cyber Operations"]
+DISCHARGES = ["Honorable", "Honorable", "Honorable", "General", "Medical", "Other Than Honorable"]
+CITIES = ["Washington", "Arlington", "San Diego", "Austin", "Tampa", "Norfolk", "Denver",
+          "Fayetteville", "Colorado Springs", "Seattle", ""]
+HOUSING = ["Rent", "Own", "Own", "With family", "Transitional", "Homeless"]
+LOOKING_FOR = ["Jobs", "Therapy", "Peer support", "Education", "Housing help", "Mentorship",
+               "Community events", "All"]
+CAREERS = ["Technology", "Leadership", "Consulting", "Healthcare", "Skilled trades",
+           "Law enforcement", "Logistics", "Education"]
+TOPICS = ["PTSD", "resume help", "anxiety", "community events", "volunteer", "mentoring",
+          "fitness", "benefits claims", "depression", "family", "sleep"]
+DEPLOYMENTS = ["Iraq 2005-2006", "Afghanistan 2010-2011", "Kuwait 2015", "Horn of Africa 2018",
+               "Pacific fleet 2012-2014", "Germany 2016-2019", "Syria 2019"]
+CRISIS_TOPICS = ["feeling hopeless", "thoughts of self-harm", "in crisis"]
+
+
+def generate_profiles(n: int, seed: int = 0, crisis_rate: float = 0.03,
+                      routine_rate: float = 0.3) -> List[VeteranProfile]:
+    """
+    Build ``n`` profiles scaled from the sample veterans
+
+    Args:
+        n: Number of profiles
+        seed: RNG seed
+        crisis_rate: Share of profiles with crisis wording in their interests
+        routine_rate: Share of fully engaged, low-risk profiles that the
+            pre-triage can answer without the LLM
+    """
+    rng = random.Random(seed)
+    samples = create_sample_veterans()
+    today = date.today()
+    profiles = []
+    for i in range(n):
+        base = samples[i % len(samples)]
+        discharged = today - timedelta(days=rng.randint(20, 365 * 25))
+        years = rng.randint(2, 24)
+        profile = dataclasses.replace(
+            base,
+            full_name=f"Bench Veteran {i}",
+            email=f"bench{i}@example.com",
+            username=f"bench{i}",
+            branch_of_service=rng.choice(BRANCHES),
+            rank_at_discharge=rng.choice(RANKS),
+            mos_job_title=rng.choice(JOBS),
+            years_of_service=years,
+            discharge_status=rng.choice(DISCHARGES),
+            discharge_date=discharged.isoformat(),
+            deployment_history="; ".join(rng.sample(DEPLOYMENTS, rng.randint(0, 3))),
+            city=rng.choice(CITIES),
+            zip_code=f"{rng.randint(10000, 99999)}",
+            housing_status=rng.choice(HOUSING),
+            receiving_mental_health_support=rng.random() < 0.35,
+            sleep_issues=rng.random() < 0.3,
+            substance_use=rng.random() < 0.1,
+            comfort_level_peer_support=rng.randint(1, 5),
+            daily_wellness_checkins=rng.random() < 0.4,
+            mood_tracker_optin=rng.random() < 0.3,
+            looking_for=rng.sample(LOOKING_FOR, rng.randint(1, 3)),
+            career_interests=rng.sample(CAREERS, rng.randint(0, 3)),
+            willing_to_mentor=rng.random() < 0.25,
+            topics_of_interest=rng.sample(TOPICS, rng.randint(1, 4)),
+            emergency_contact="on file" if rng.random() < 0.6 else "",
+            dd214_uploaded=rng.random() < 0.5,
+            resume_uploaded=rng.random() < 0.4,
+        )
+        roll = rng.random()
+        if roll < crisis_rate:
+            profile.topics_of_interest = profile.topics_of_interest + [rng.choice(CRISIS_TOPICS)]
+        elif roll < crisis_rate + routine_rate:
+            profile = dataclasses.replace(
+                profile, housing_status="Own", substance_use=False, sleep_issues=False,
+                receiving_mental_health_support=False, discharge_status="Honorable",
+                discharge_date=(today - timedelta(days=rng.randint(400, 3000))).isoformat(),
+                deployment_history="", looking_for=["Community events"],
+                topics_of_interest=["volunteer", "fitness"], comfort_level_peer_support=3,
+                daily_wellness_checkins=True, mood_tracker_optin=True, dd214_uploaded=True,
+                resume_uploaded=True, emergency_contact="on file", willing_to_mentor=True,
+            )
+        profiles.append(profile)
+    return profiles
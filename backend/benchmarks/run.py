@@ -0,0 +1,225 @@
+"""
+Benchmark ``LlamaVeteranGrouper.iter_analyses`` end to end.
+
+Writes a JSON report with:
+- throughput and per-profile latency percentiles
+- pre-triage routes and analysis sources, including the fallback rate
+- time spent in each pipeline stage
+- token usage and what the fake server saw
+
+Pass ``--baseline`` with an earlier report to fail the run when
+throughput or p95 latency regresses by more than ``--max-regression``.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from benchmarks.fake_ollama import FakeOllamaConfig, FakeOllamaServer
+from benchmarks.profiles import generate_profiles
+from models.DynamicGrouping_Llama2B import PROMPT_COMPACT, PROMPT_VERBOSE, LlamaVeteranGrouper
+
+REPORT_VERSION = 1
+
+
+class StageRecorder:
+    """Thread-safe collection of durations per named stage"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.durations: Dict[str, List[float]] = defaultdict(list)
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.durations[stage].append(seconds)
+
+    def wrap(self, stage: str, fn: Callable) -> Callable:
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+        return timed
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {stage: dict(latency_summary(values), total_s=round(sum(values), 4))
+                    for stage, values in sorted(self.durations.items())}
+
+
+def latency_summary(seconds: List[float]) -> Dict[str, float]:
+    """Count, mean, p50/p95/p99 and max of ``seconds``, reported in milliseconds"""
+    if not seconds:
+        return {"count": 0}
+    ms = np.asarray(seconds) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        "count": int(ms.size),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+
+def instrument(grouper: LlamaVeteranGrouper, recorder: StageRecorder) -> None:
+    """Time the grouper's pipeline stages by wrapping them on this instance"""
+    grouper.pretriage_engine.triage = recorder.wrap("pretriage", grouper.pretriage_engine.triage)
+    for stage, name in (
+        ("prompt_build", "_build_analysis_prompts"),
+        ("llm_structured", "generate_structured"),
+        ("llm_text", "call_llama"),
+        ("parse", "_parse_llama_analysis"),
+        ("fallback", "_fallback_analysis"),
+        ("enhance", "_enhance_llama_analysis"),
+        # One end-to-end entry per profile, by route
+        ("profile_llm", "_analyze_triaged"),
+        ("profile_rules", "_rules_only_analysis"),
+    ):
+        setattr(grouper, name, recorder.wrap(stage, getattr(grouper, name)))
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    server = None
+    endpoint = args.endpoint
+    if not endpoint:
+        server = FakeOllamaServer(FakeOllamaConfig(
+            latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+            tokens_per_second=args.token_rate, error_rate=args.error_rate,
+            malformed_rate=args.malformed_rate, max_parallel=args.max_parallel, seed=args.seed,
+        )).start()
+        endpoint = server.endpoint
+
+    grouper = LlamaVeteranGrouper(
+        endpoint, model_name=args.model, pool_size=max(args.concurrency, 1),
+        timeout=args.timeout, prompt_style=args.prompt_style,
+        structured_output=not args.no_structured,
+    )
+    recorder = StageRecorder()
+    instrument(grouper, recorder)
+
+    start = time.perf_counter()
+    profiles = generate_profiles(args.profiles, seed=args.seed, crisis_rate=args.crisis_rate,
+                                 routine_rate=args.routine_rate)
+    generate_s = time.perf_counter() - start
+
+    routes, sources = Counter(), Counter()
+    start = time.perf_counter()
+    for _, analysis in grouper.iter_analyses(profiles, max_concurrency=args.concurrency,
+                                             pretriage=not args.no_pretriage):
+        routes[analysis.get("triage_route", "none")] += 1
+        sources[analysis.get("analysis_source", "unknown")] += 1
+    wall_s = time.perf_counter() - start
+    grouper.close()
+    if server is not None:
+        server.stop()
+
+    stages = recorder.summary()
+    per_profile = recorder.durations.get("profile_llm", []) + recorder.durations.get("profile_rules", [])
+    llm_attempts = sources["llm"] + sources["fallback"]
+    return {
+        "report_version": REPORT_VERSION,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "git_commit": _git_commit(),
+        },
+        "config": {key: value for key, value in vars(args).items()
+                   if key not in ("output", "baseline")},
+        "profiles": len(profiles),
+        "profile_generation_s": round(generate_s, 4),
+        "wall_s": round(wall_s, 4),
+        "throughput_per_s": round(len(profiles) / wall_s, 2) if wall_s else None,
+        "latency": latency_summary(per_profile),
+        "routes": dict(routes),
+        "sources": dict(sources),
+        "fallback_rate": round(sources["fallback"] / llm_attempts, 4) if llm_attempts else 0.0,
+        "stages": stages,
+        "token_usage": grouper.token_usage.as_dict(),
+        "structured_outcomes": dict(grouper.structured_outcomes),
+        "server": server.stats_dict() if server is not None else None,
+    }
+
+
+def compare_to_baseline(report: Dict[str, Any], baseline: Dict[str, Any],
+                        max_regression: float) -> List[str]:
+    """Regressions beyond ``max_regression`` (a fraction) relative to ``baseline``"""
+    problems = []
+    old, new = baseline.get("throughput_per_s"), report.get("throughput_per_s")
+    if old and new is not None and new < old * (1 - max_regression):
+        problems.append(f"throughput {new}/s vs baseline {old}/s")
+    old, new = baseline.get("latency", {}).get("p95_ms"), report["latency"].get("p95_ms")
+    if old and new is not None and new > old * (1 + max_regression):
+        problems.append(f"p95 latency {new} ms vs baseline {old} ms")
+    return problems
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the Llama veteran grouper")
+    parser.add_argument("--profiles", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--crisis-rate", type=float, default=0.03)
+    parser.add_argument("--routine-rate", type=float, default=0.3)
+    parser.add_argument("--no-pretriage", action="store_true")
+    parser.add_argument("--no-structured", action="store_true",
+                        help="Use free-text JSON extraction instead of the format schema")
+    parser.add_argument("--prompt-style", choices=[PROMPT_COMPACT, PROMPT_VERBOSE],
+                        default=PROMPT_COMPACT)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--model", default="llama2")
+    parser.add_argument("--endpoint", help="Benchmark a real Ollama instead of the fake server")
+
+    fake = parser.add_argument_group("fake server")
+    fake.add_argument("--latency-ms", type=float, default=50.0)
+    fake.add_argument("--jitter-ms", type=float, default=10.0)
+    fake.add_argument("--token-rate", type=float, default=400.0, help="Tokens per second")
+    fake.add_argument("--error-rate", type=float, default=0.0)
+    fake.add_argument("--malformed-rate", type=float, default=0.0)
+    fake.add_argument("--max-parallel", type=int, help="Concurrent generations (default unlimited)")
+
+    parser.add_argument("--output", help="Write the JSON report here (default: stdout)")
+    parser.add_argument("--baseline", help="Earlier report to check for regressions")
+    parser.add_argument("--max-regression", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(args)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = compare_to_baseline(report, json.load(f), args.max_regression)
+        for problem in problems:
+            print(f"REGRESSION: {problem}", file=sys.stderr)
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -33,6 +33,8 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # 写事务一开始就拿写锁并排队等待，避免并发写入时 "database is locked"
+        "OPTIONS": {"transaction_mode": "IMMEDIATE", "timeout": 20},
     }
 }
 
@@ -98,3 +100,35 @@ SPECTACULAR_SETTINGS = {
 # -- 静态文件 --
 STATIC_URL = "/static/"
 STATIC_ROOT = BASE_DIR / "staticfiles"
+
+# -- Llama / Ollama --
+LLAMA_ENDPOINT = env("LLAMA_ENDPOINT", default="http://localhost:11434")
+LLAMA_MODEL = env("LLAMA_MODEL", default="llama2")
+LLAMA_TIMEOUT = env.float("LLAMA_TIMEOUT", default=30.0)
+LLAMA_POOL_SIZE = env.int("LLAMA_POOL_SIZE", default=10)
+LLAMA_CACHE_PATH = env("LLAMA_CACHE_PATH", default=str(BASE_DIR / "llm_cache.sqlite3"))
+# 优先级调度：同时发往 Ollama 的请求数（与 OLLAMA_NUM_PARALLEL 一致），0 = 不调度
+LLAMA_CONCURRENCY = env.int("LLAMA_CONCURRENCY", default=4)
+LLAMA_SCHEDULER_AGING = env.float("LLAMA_SCHEDULER_AGING", default=30.0)      # 秒，每级优先级的老化时间
+LLAMA_SCHEDULER_MAX_WAIT = env.float("LLAMA_SCHEDULER_MAX_WAIT", default=120.0)  # 秒，0 = 无限等待
+
+# -- 缓存 --
+# CACHE_URL 例：locmemcache://、filecache:///var/tmp/wellness_cache、redis://127.0.0.1:6379/1
+# 多进程部署时请用共享后端，否则失效通知只作用于当前进程
+CACHES = {"default": env.cache("CACHE_URL", default="locmemcache://")}
+API_CACHE_ALIAS = env("API_CACHE_ALIAS", default="default")
+API_CACHE_TIMEOUT = env.int("API_CACHE_TIMEOUT", default=600)   # 秒，用户/连接响应缓存时间
+
+# -- 同伴推荐索引 --
+SIMILARITY_INDEX_TTL = env.int("SIMILARITY_INDEX_TTL", default=300)   # 秒；0 = 从不重建
+
+# -- 监控指标 --
+METRICS_TOKEN = env("METRICS_TOKEN", default="")   # 非空时 /metrics 需要 Bearer token
+
+# -- 后台分析任务 --
+ANALYSIS_AUTO_ENQUEUE = env.bool("ANALYSIS_AUTO_ENQUEUE", default=True)   # 注册/资料更新时自动入队
+ANALYSIS_WORKER_THREADS = env.int("ANALYSIS_WORKER_THREADS", default=4)
+ANALYSIS_JOB_MAX_ATTEMPTS = env.int("ANALYSIS_JOB_MAX_ATTEMPTS", default=5)
+ANALYSIS_JOB_BACKOFF = env.float("ANALYSIS_JOB_BACKOFF", default=30.0)         # 秒，每次重试翻倍
+ANALYSIS_JOB_MAX_BACKOFF = env.float("ANALYSIS_JOB_MAX_BACKOFF", default=1800.0)
+ANALYSIS_JOB_LEASE = env.float("ANALYSIS_JOB_LEASE", default=300.0)            # 秒，超时视为 worker 已退出
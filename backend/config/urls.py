@@ -3,6 +3,8 @@ from django.urls import path, include
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
 
+from config.views import metrics_view
+
 urlpatterns = [
     path("admin/", admin.site.urls),
 
@@ -16,4 +18,7 @@ urlpatterns = [
     # Docs
     path("api/schema/", SpectacularAPIView.as_view(), name="schema"),
     path("api/docs/", SpectacularSwaggerView.as_view(url_name="schema")),
+
+    # Prometheus
+    path("metrics", metrics_view, name="metrics"),
 ]
@@ -1,11 +1,52 @@
+import asyncio
+import copy
+import hashlib
 import json
+import logging
+import os
 import re
-from typing import Dict, List, Set, Any, Optional
+import sys
+import threading
+from collections import Counter
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, List, Set, Any, Optional, Iterable, Iterator, Tuple, AsyncIterator
 from dataclasses import dataclass, asdict
 from datetime import datetime, timedelta
-import requests
 import numpy as np
 
+if __package__ in (None, ""):
+    # Run as a script (python models/DynamicGrouping_Llama2B.py): make backend/
+    # importable, as `python -m models.DynamicGrouping_Llama2B` would
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import metrics
+from models.llm_cache import TwoTierCache, make_cache_key
+from models.group_formation import GroupFormationEngine
+from models.llm_scheduler import (
+    BACKGROUND, CRISIS, OUTREACH, LLMScheduler, current_priority, priority_scope,
+)
+from models.pretriage import (
+    PreTriageEngine, TriageResult, ROUTE_CRISIS, ROUTE_RULES, has_crisis_signals,
+)
+from models.tag_index import TagIndex, TagVocabulary, analysis_tags
+from models.llm_transport import (
+    AsyncTransport, LlamaTransportError, RetryPolicy, SyncTransport, ThreadedAsyncTransport,
+    TokenUsage,
+)
+from models.structured_output import COMPLETE, INVALID, IncrementalJSONValidator, analysis_schema
+
+logger = logging.getLogger(__name__)
+
+PROMPT_COMPACT = "compact"
+PROMPT_VERBOSE = "verbose"
+
+# Rough size of one Llama token, used to cap free-text fields without a tokenizer
+CHARS_PER_TOKEN = 4
+
+# Tags weighted this high in priority_weights make LLM work crisis priority
+CRISIS_TAG_WEIGHT = 10
+
 @dataclass
 class VeteranProfile:
     """Veteran profile data structure"""
@@ -15,6 +56,7 @@ class VeteranProfile:
     phone: str = ""
     username: str = ""
     profile_photo: str = ""
+    age: int = 0
     
     # Military History
     branch_of_service: str = ""
@@ -52,20 +94,112 @@ class VeteranProfile:
     dd214_uploaded: bool = False
     resume_uploaded: bool = False
     mood_tracker_optin: bool = False
+    
+    def analysis_fingerprint(self, *context: Any) -> str:
+        """
+        Hash of the fields that feed the LLM prompt and the fallback analysis
+        
+        ``context`` adds settings outside the profile that change the
+        analysis, such as the model and prompt style of the grouper.
+        """
+        values = [getattr(self, name) for name in ANALYSIS_FIELDS]
+        # The prompt only says whether an emergency contact exists, and reports
+        # discharge timing in coarse buckets rather than as an exact date
+        values.append(bool(self.emergency_contact))
+        values.append(LlamaVeteranGrouper._discharge_recency(self.discharge_date))
+        values.extend(context)
+        return _fingerprint(values)
+    
+    def enhancement_fingerprint(self) -> str:
+        """Hash of the fields only used by ``_enhance_llama_analysis``"""
+        return _fingerprint([getattr(self, name) for name in ENHANCEMENT_FIELDS])
+
+
+# Profile fields used by _format_compact_profile and _fallback_analysis.
+# Name and email are left out: the compact prompt does not send them and they
+# do not bear on the assessment. City is left out too: it only drives the local
+# group added in _enhance_llama_analysis, so a move re-runs that step instead
+# of the LLM.
+ANALYSIS_FIELDS = (
+    'age', 'branch_of_service', 'rank_at_discharge', 'mos_job_title',
+    'years_of_service', 'discharge_status', 'discharge_date', 'deployment_history',
+    'zip_code', 'housing_status', 'willing_to_relocate',
+    'receiving_mental_health_support', 'sleep_issues', 'substance_use',
+    'comfort_level_peer_support', 'daily_wellness_checkins', 'mood_tracker_optin',
+    'looking_for', 'career_interests', 'willing_to_mentor', 'topics_of_interest',
+    'privacy_settings', 'dd214_uploaded', 'resume_uploaded', 'consent_anonymized_data',
+)
+
+# Profile fields only used by _enhance_llama_analysis
+ENHANCEMENT_FIELDS = ('city',)
+
+# Analysis sources a re-analysis may keep when nothing changed; a fallback
+# analysis only stands in while the LLM is unavailable
+REUSABLE_SOURCES = ('llm', 'rules')
+
+
+def _fingerprint(values: List[Any]) -> str:
+    material = json.dumps(values, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha1(material.encode('utf-8')).hexdigest()
 
 class LlamaVeteranGrouper:
     """Dynamic veteran grouping system using Llama LLM"""
     
-    def __init__(self, llama_endpoint: str = "http://localhost:11434", model_name: str = "llama2"):
+    def __init__(self, llama_endpoint: str = "http://localhost:11434", model_name: str = "llama2",
+                 transport: Optional[SyncTransport] = None, async_transport=None,
+                 pool_size: int = 10, timeout: float = 30.0,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 cache: Optional[TwoTierCache] = None,
+                 prompt_style: str = PROMPT_COMPACT, keep_alive: Optional[str] = "30m",
+                 free_text_token_budget: int = 120, structured_output: bool = True,
+                 scheduler: Optional[LLMScheduler] = None):
         """
         Initialize with Llama connection
         
         Args:
             llama_endpoint: Ollama API endpoint (default local installation)
             model_name: Llama model to use (llama2, llama2:13b, codellama, etc.)
+            transport: Sync HTTP transport (defaults to a pooled SyncTransport)
+            async_transport: Async HTTP transport (created lazily on first async call)
+            pool_size: Keep-alive connection pool size for the default transports
+            timeout: Default per-call deadline in seconds, including retries
+            retry_policy: Backoff settings for the default transports
+            cache: Response cache consulted before every generation (disabled if None)
+            prompt_style: "compact" (default) or the original "verbose" analysis prompt
+            keep_alive: How long Ollama keeps the model, and with it the evaluated
+                system prefix, loaded between calls (None uses the server default)
+            free_text_token_budget: Approximate token cap for free-text profile
+                fields in the compact prompt
+            structured_output: Constrain analyses to a JSON schema via Ollama's
+                ``format`` and validate them while they stream (needs Ollama
+                0.5+); False keeps the free-text JSON extraction
+            scheduler: Priority scheduler that every LLM request waits on for
+                a slot (requests are not scheduled if None)
         """
+        if prompt_style not in (PROMPT_COMPACT, PROMPT_VERBOSE):
+            raise ValueError(f"Unknown prompt style: {prompt_style}")
         self.llama_endpoint = llama_endpoint
         self.model_name = model_name
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.transport = transport or SyncTransport(
+            llama_endpoint, pool_size=pool_size, timeout=timeout, retry_policy=self.retry_policy
+        )
+        self._async_transport = async_transport
+        self._owns_async_transport = async_transport is None
+        # event loop -> (owned transport, task closing it when the loop shuts down)
+        self._async_transports: Dict[asyncio.AbstractEventLoop, Tuple[Any, asyncio.Task]] = {}
+        self._async_transports_lock = threading.Lock()
+        self.cache = cache
+        self.prompt_style = prompt_style
+        self.keep_alive = keep_alive
+        self.free_text_token_budget = free_text_token_budget
+        self.structured_output = structured_output
+        self.scheduler = scheduler
+        self.token_usage = TokenUsage()
+        # complete / invalid / error counts of structured generations
+        self.structured_outcomes: Counter = Counter()
         self.available_tags = [
             # Employment
             'Job', 'Unemployed', 'Employed', 'Underemployed', 'Job training', 'In education',
@@ -96,6 +230,9 @@ class LlamaVeteranGrouper:
             'Rural isolated', 'Urban underserved', 'No internet', 'Digital user', 'Online only',
             'Low health literacy', 'Low trust', 'Isolation',
             
+            # Housing
+            'Homeless',
+            
             # Care
             'Regular checkups', 'Missed appointments', 'Medication noncompliant', 'Crisis risk',
             'Holistic care user', 'Preventive care gap', 'Faith-based'
@@ -106,54 +243,464 @@ class LlamaVeteranGrouper:
             'PTSD': 7, 'Unemployed': 7, 'Recently transitioned': 6, 'Depression': 6,
             'Anxiety': 5, 'Disabled': 5, 'Job training': 4, 'Seeking therapy': 4
         }
+        self.refresh_tag_vocabulary()
+        self.pretriage_engine = PreTriageEngine()
+    
+    def refresh_tag_vocabulary(self) -> None:
+        """Recompile the tag vocabulary; call after editing available_tags or priority_weights"""
+        unknown = set(self.priority_weights) - set(self.available_tags)
+        if unknown:
+            logger.warning("Priority weights for tags not in available_tags: %s", ", ".join(sorted(unknown)))
+        self.tag_vocabulary = TagVocabulary(self.available_tags, self.priority_weights)
+        # The tags are listed in the system prompt and the output schema
+        self._tags_fingerprint = _fingerprint(list(self.available_tags))
+        self._compact_system_prompt: Optional[str] = None
+        self.analysis_schema = analysis_schema(self.available_tags)
+        self.crisis_tags = {tag for tag, weight in self.priority_weights.items()
+                            if weight >= CRISIS_TAG_WEIGHT}
+    
+    def score_analyses(self, analyses: List[Dict[str, Any]]) -> np.ndarray:
+        """
+        Set ``calculated_priority_score`` on a batch of analyses in one pass
+        
+        Returns:
+            The scores as an array aligned with ``analyses``
+        """
+        scores = self.tag_vocabulary.score_batch([analysis_tags(a) for a in analyses])
+        for analysis, score in zip(analyses, scores.astype(int).tolist()):
+            analysis['calculated_priority_score'] = score
+        return scores
+    
+    def build_tag_index(self, analyses: List[Dict[str, Any]]) -> TagIndex:
+        """Bitset index over a batch of analyses for fast tag set queries"""
+        return TagIndex(self.tag_vocabulary, analyses)
+    
+    def create_group_engine(self, capacity: int = 12, **kwargs) -> GroupFormationEngine:
+        """Peer group formation engine sharing this grouper's tag vocabulary"""
+        return GroupFormationEngine(self.tag_vocabulary, capacity=capacity, **kwargs)
     
-    def call_llama(self, prompt: str, system_prompt: str = "") -> str:
+    @property
+    def async_transport(self):
+        """
+        Async transport, falling back to a threaded adapter when httpx is missing
+        
+        An httpx client belongs to the event loop it was created on, so a
+        transport built here is kept per loop (async Django views served
+        over WSGI run each request on a fresh loop) and closed on that loop
+        when it shuts down.
+        """
+        if not self._owns_async_transport:
+            return self._async_transport
+        loop = asyncio.get_running_loop()
+        with self._async_transports_lock:
+            entry = self._async_transports.get(loop)
+            if entry is None:
+                # Loops closed without cancelling their tasks never ran their closer
+                for stale in [other for other in self._async_transports if other.is_closed()]:
+                    del self._async_transports[stale]
+                try:
+                    transport = AsyncTransport(
+                        self.llama_endpoint, pool_size=self.pool_size,
+                        timeout=self.timeout, retry_policy=self.retry_policy
+                    )
+                except ImportError:
+                    transport = ThreadedAsyncTransport(self.transport)
+                entry = (transport, loop.create_task(self._close_with_loop(loop, transport)))
+                self._async_transports[loop] = entry
+        return entry[0]
+    
+    async def _close_with_loop(self, loop: asyncio.AbstractEventLoop, transport) -> None:
+        """
+        Close ``transport`` once ``loop`` shuts down
+        
+        ``asyncio.run`` (used by uvicorn and by Django for async views under
+        WSGI) cancels every pending task before closing its loop, which
+        ends this wait while the loop can still run the close.
+        """
+        try:
+            await loop.create_future()
+        finally:
+            with self._async_transports_lock:
+                owned = self._async_transports.get(loop, (None,))[0] is transport
+                if owned:
+                    del self._async_transports[loop]
+            if owned:
+                await transport.aclose()
+    
+    def _build_payload(self, prompt: str, system_prompt: str, stream: bool = False,
+                       output_format: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        payload = {
+            "model": self.model_name,
+            "prompt": prompt,
+            "system": system_prompt,
+            "stream": stream,
+            "options": {
+                "temperature": 0.1,  # Low temperature for consistent analysis
+                "top_p": 0.9,
+                "max_tokens": 1000
+            }
+        }
+        # Keeping the model loaded lets Ollama reuse the KV cache of the
+        # identical system prefix instead of re-evaluating it on every call
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        if output_format is not None:
+            payload["format"] = output_format
+        return payload
+    
+    def _cache_key(self, payload: Dict[str, Any]) -> str:
+        return make_cache_key(payload["model"], payload["system"], payload["prompt"], payload["options"],
+                              payload.get("format"))
+    
+    def _llm_slot(self, priority: Optional[str] = None):
+        """Scheduler slot for one request; a no-op without a scheduler"""
+        return self.scheduler.slot(priority) if self.scheduler is not None else nullcontext()
+    
+    def _llm_slot_async(self, priority: Optional[str] = None):
+        return self.scheduler.aslot(priority) if self.scheduler is not None else nullcontext()
+    
+    def is_crisis(self, profile: VeteranProfile, analysis: Optional[Dict[str, Any]] = None) -> bool:
+        """Crisis signals in the profile, or crisis-weight tags in an earlier analysis"""
+        if analysis and self.crisis_tags.intersection(analysis_tags(analysis)):
+            return True
+        return has_crisis_signals(profile)
+    
+    def _analysis_priority(self, profile: VeteranProfile,
+                           analysis: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """CRISIS for crisis-flagged work, else None to keep the current ``priority_scope``"""
+        if self.scheduler is None:
+            return None
+        if current_priority() == CRISIS or self.is_crisis(profile, analysis):
+            return CRISIS
+        return None
+    
+    def call_llama(self, prompt: str, system_prompt: str = "", timeout: Optional[float] = None,
+                   priority: Optional[str] = None) -> str:
         """
         Make API call to Llama model via Ollama
         
         Args:
             prompt: User prompt
             system_prompt: System instruction
+            timeout: Deadline in seconds for this call, including retries
+            priority: Scheduler class (default: the current ``priority_scope``)
             
         Returns:
-            Llama's response text
+            Llama's response text, or "" if the call failed
         """
+        payload = self._build_payload(prompt, system_prompt)
+        key = self._cache_key(payload) if self.cache is not None else None
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+        
         try:
-            payload = {
-                "model": self.model_name,
-                "prompt": prompt,
-                "system": system_prompt,
-                "stream": False,
-                "options": {
-                    "temperature": 0.1,  # Low temperature for consistent analysis
-                    "top_p": 0.9,
-                    "max_tokens": 1000
-                }
-            }
-            
-            response = requests.post(
-                f"{self.llama_endpoint}/api/generate",
-                json=payload,
-                headers={"Content-Type": "application/json"},
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                return response.json().get("response", "")
-            else:
-                print(f"Llama API error: {response.status_code}")
-                return ""
-                
-        except requests.exceptions.RequestException as e:
-            print(f"Error connecting to Llama: {e}")
+            with self._llm_slot(priority), metrics.span("llm_request"):
+                data = self.transport.post_json("/api/generate", payload, timeout=timeout)
+        except LlamaTransportError as e:
+            logger.error("Error calling Llama: %s", e)
+            metrics.increment("llama_request_errors_total")
+            return ""
+        
+        self._record_generation(data)
+        text = data.get("response", "")
+        if key is not None and text:
+            self.cache.set(key, text)
+        return text
+    
+    async def call_llama_async(self, prompt: str, system_prompt: str = "",
+                               timeout: Optional[float] = None, priority: Optional[str] = None) -> str:
+        """Async counterpart of ``call_llama``"""
+        payload = self._build_payload(prompt, system_prompt)
+        key = self._cache_key(payload) if self.cache is not None else None
+        if key is not None:
+            cached = await self.cache.aget(key)
+            if cached is not None:
+                return cached
+        
+        try:
+            async with self._llm_slot_async(priority):
+                with metrics.span("llm_request"):
+                    data = await self.async_transport.post_json("/api/generate", payload,
+                                                                timeout=timeout)
+        except LlamaTransportError as e:
+            logger.error("Error calling Llama: %s", e)
+            metrics.increment("llama_request_errors_total")
             return ""
+        
+        self._record_generation(data)
+        text = data.get("response", "")
+        if key is not None and text:
+            await self.cache.aset(key, text)
+        return text
+    
+    def stream_llama(self, prompt: str, system_prompt: str = "",
+                     timeout: Optional[float] = None, priority: Optional[str] = None) -> Iterator[str]:
+        """
+        Stream Llama's response token by token via Ollama's NDJSON stream
+        
+        Yields:
+            Response text fragments as the model generates them. Nothing more
+            is yielded after an error; the error is logged.
+        """
+        payload = self._build_payload(prompt, system_prompt, stream=True)
+        key = self._cache_key(payload) if self.cache is not None else None
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+        
+        chunks = []
+        try:
+            with self._llm_slot(priority):
+                for data in self.transport.stream_json_lines("/api/generate", payload, timeout=timeout):
+                    token = data.get("response", "")
+                    if token:
+                        chunks.append(token)
+                        yield token
+                    if data.get("done"):
+                        self._record_generation(data)
+                        break
+        except LlamaTransportError as e:
+            logger.error("Error streaming from Llama: %s", e)
+            metrics.increment("llama_request_errors_total")
+            return
+        
+        text = "".join(chunks)
+        if key is not None and text:
+            self.cache.set(key, text)
+    
+    async def stream_llama_async(self, prompt: str, system_prompt: str = "",
+                                 timeout: Optional[float] = None,
+                                 priority: Optional[str] = None) -> AsyncIterator[str]:
+        """
+        Async counterpart of ``stream_llama``
+        
+        Closing the generator early, or cancelling the task consuming it,
+        closes the stream, which stops the generation on the Ollama side.
+        """
+        payload = self._build_payload(prompt, system_prompt, stream=True)
+        key = self._cache_key(payload) if self.cache is not None else None
+        if key is not None:
+            cached = await self.cache.aget(key)
+            if cached is not None:
+                yield cached
+                return
+        
+        chunks = []
+        lines = self.async_transport.stream_json_lines("/api/generate", payload, timeout=timeout)
+        try:
+            async with self._llm_slot_async(priority):
+                async for data in lines:
+                    token = data.get("response", "")
+                    if token:
+                        chunks.append(token)
+                        yield token
+                    if data.get("done"):
+                        self._record_generation(data)
+                        break
+        except LlamaTransportError as e:
+            logger.error("Error streaming from Llama: %s", e)
+            metrics.increment("llama_request_errors_total")
+            return
+        finally:
+            await lines.aclose()
+        
+        text = "".join(chunks)
+        if key is not None and text:
+            await self.cache.aset(key, text)
+    
+    def generate_structured(self, prompt: str, system_prompt: str = "", timeout: Optional[float] = None,
+                            priority: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Generate an analysis constrained to ``analysis_schema``
+        
+        The response is streamed through an ``IncrementalJSONValidator`` and
+        the stream is closed, which stops the generation on the Ollama side,
+        as soon as the object is complete or a field violates the schema.
+        
+        Returns:
+            The validated analysis object, or None if the output was invalid
+            or the call failed
+        """
+        payload = self._build_payload(prompt, system_prompt, stream=True,
+                                      output_format=self.analysis_schema)
+        key = self._cache_key(payload) if self.cache is not None else None
+        if key is not None:
+            cached = self._validate_cached(self.cache.get(key))
+            if cached is not None:
+                return cached
+        
+        validator = IncrementalJSONValidator(self.analysis_schema)
+        lines = self.transport.stream_json_lines("/api/generate", payload, timeout=timeout)
+        try:
+            with self._llm_slot(priority), metrics.span("llm_request", mode="structured"):
+                for data in lines:
+                    if self._structured_step(validator, data):
+                        break
+        except LlamaTransportError as e:
+            logger.error("Error streaming from Llama: %s", e)
+            metrics.increment("llama_request_errors_total")
+            self.structured_outcomes["error"] += 1
+            return None
+        finally:
+            lines.close()
+        result = self._structured_result(validator)
+        if result is not None and key is not None:
+            self.cache.set(key, validator.text)
+        return result
+    
+    async def generate_structured_async(self, prompt: str, system_prompt: str = "",
+                                        timeout: Optional[float] = None,
+                                        priority: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Async counterpart of ``generate_structured``"""
+        payload = self._build_payload(prompt, system_prompt, stream=True,
+                                      output_format=self.analysis_schema)
+        key = self._cache_key(payload) if self.cache is not None else None
+        if key is not None:
+            cached = self._validate_cached(await self.cache.aget(key))
+            if cached is not None:
+                return cached
+        
+        validator = IncrementalJSONValidator(self.analysis_schema)
+        lines = self.async_transport.stream_json_lines("/api/generate", payload, timeout=timeout)
+        try:
+            async with self._llm_slot_async(priority):
+                with metrics.span("llm_request", mode="structured"):
+                    async for data in lines:
+                        if self._structured_step(validator, data):
+                            break
+        except LlamaTransportError as e:
+            logger.error("Error streaming from Llama: %s", e)
+            metrics.increment("llama_request_errors_total")
+            self.structured_outcomes["error"] += 1
+            return None
+        finally:
+            await lines.aclose()
+        result = self._structured_result(validator)
+        if result is not None and key is not None:
+            await self.cache.aset(key, validator.text)
+        return result
+    
+    def _record_generation(self, data: Dict[str, Any]) -> None:
+        """Account for the stats on a finished (``done``) Ollama response"""
+        self.token_usage.record(data)
+        metrics.record_generation(data)
+    
+    def _structured_step(self, validator: IncrementalJSONValidator, data: Dict[str, Any]) -> bool:
+        """Feed one stream line to the validator; True once the stream should be closed"""
+        if data.get("done"):
+            self._record_generation(data)
+            validator.feed(data.get("response", ""))
+            return True
+        chunk = data.get("response", "")
+        if validator.status == COMPLETE:
+            # Under a format schema the model ends right after the object;
+            # wait through trailing whitespace for the final stats line, but
+            # stop at the first sign of any other trailing output
+            return bool(chunk.strip())
+        return validator.feed(chunk) == INVALID
+    
+    def _validate_cached(self, cached: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Cached structured output as an analysis, if it still validates against the schema"""
+        if cached is None:
+            return None
+        validator = IncrementalJSONValidator(self.analysis_schema)
+        validator.feed(cached)
+        return validator.result if validator.finalize() == COMPLETE else None
+    
+    def _structured_result(self, validator: IncrementalJSONValidator) -> Optional[Dict[str, Any]]:
+        status = validator.finalize()
+        self.structured_outcomes[status] += 1
+        if status != COMPLETE:
+            logger.warning("Discarding structured Llama output: %s", validator.error)
+            metrics.increment("llama_parse_failures_total", labels={"reason": "schema"})
+            return None
+        return validator.result
+    
+    def close(self) -> None:
+        """Release pooled connections held by the sync transport"""
+        self.transport.close()
+    
+    async def aclose(self) -> None:
+        """Release pooled connections held by the async transport of the running loop"""
+        if not self._owns_async_transport:
+            await self._async_transport.aclose()
+            return
+        with self._async_transports_lock:
+            entry = self._async_transports.pop(asyncio.get_running_loop(), None)
+        if entry is not None:
+            transport, closer = entry
+            closer.cancel()
+            await transport.aclose()
     
     def analyze_veteran_with_llama(self, profile: VeteranProfile) -> Dict[str, Any]:
         """
         Use Llama to analyze veteran profile and generate groupings
         """
+        analysis_prompt, system_prompt = self._build_analysis_prompts(profile)
+        priority = self._analysis_priority(profile)
+        
+        if self.structured_output:
+            analysis = self.generate_structured(analysis_prompt, system_prompt, priority=priority)
+            return self._finish_structured_analysis(analysis, profile)
+        
+        # Get Llama's analysis
+        llama_response = self.call_llama(analysis_prompt, system_prompt, priority=priority)
+        
+        return self._parse_llama_analysis(llama_response, profile)
+    
+    async def analyze_veteran_with_llama_async(self, profile: VeteranProfile) -> Dict[str, Any]:
+        """Async counterpart of ``analyze_veteran_with_llama``"""
+        analysis_prompt, system_prompt = self._build_analysis_prompts(profile)
+        priority = self._analysis_priority(profile)
+        if self.structured_output:
+            analysis = await self.generate_structured_async(analysis_prompt, system_prompt,
+                                                            priority=priority)
+            return self._finish_structured_analysis(analysis, profile)
+        llama_response = await self.call_llama_async(analysis_prompt, system_prompt, priority=priority)
+        return self._parse_llama_analysis(llama_response, profile)
+    
+    def _finish_structured_analysis(self, analysis: Optional[Dict[str, Any]],
+                                    profile: VeteranProfile) -> Dict[str, Any]:
+        """Enhance a validated structured analysis, or fall back if there is none"""
+        if analysis is None:
+            analysis = self._fallback_analysis(profile)
+        else:
+            analysis['analysis_source'] = 'llm'
+        return self._enhance_llama_analysis(analysis, profile)
+    
+    def _build_analysis_prompts(self, profile: VeteranProfile) -> Tuple[str, str]:
+        """Build the (analysis prompt, system prompt) pair for a profile"""
+        with metrics.span("prompt_build"):
+            if self.prompt_style == PROMPT_VERBOSE:
+                return self._build_verbose_analysis_prompts(profile)
+            return self._format_compact_profile(profile), self._compact_analysis_system_prompt()
+    
+    def _compact_analysis_system_prompt(self) -> str:
+        """
+        System prompt for the compact style
+        
+        Every constant instruction lives here and the text is identical for
+        all profiles, so Ollama can reuse its evaluation as a shared prefix;
+        the per-profile prompt carries only the profile itself.
+        """
+        if self._compact_system_prompt is None:
+            self._compact_system_prompt = f"""You are a veteran services specialist (mental health, careers, peer support). Assess the veteran profile in the user message.
+
+Tags (use only these): {', '.join(self.available_tags)}
+
+Reply with one JSON object only:
+{{"primary_tags": [3-5 tags for the most urgent needs], "secondary_tags": [2-4 tags], "risk_level": "Critical"|"High"|"Medium"|"Low", "priority_score": 1-20, "intervention_needed": true|false, "recommended_groups": [2-4 support group names], "resource_priorities": [3-5 resources, most important first], "reasoning": "1-2 sentences"}}
+
+Weigh crisis risk, mental health, employment and transition, social support, housing, discharge timing and stated goals. Fields missing from the profile are unknown; flags not listed are false."""
+        return self._compact_system_prompt
+    
+    def _build_verbose_analysis_prompts(self, profile: VeteranProfile) -> Tuple[str, str]:
+        """The original full-template prompts, kept for comparison"""
         
-        # Prepare profile data for Llama
         profile_text = self._format_profile_for_llama(profile)
         
         # System prompt for Llama
@@ -188,24 +735,30 @@ Consider:
 
 Provide your analysis as a valid JSON object only."""
 
-        # Get Llama's analysis
-        llama_response = self.call_llama(analysis_prompt, system_prompt)
+        return analysis_prompt, system_prompt
+    
+    def _parse_llama_analysis(self, llama_response: str, profile: VeteranProfile) -> Dict[str, Any]:
+        """Extract the JSON analysis from Llama's response and enhance it"""
         
         # Parse Llama's response
         try:
-            # Clean response to extract JSON
-            json_start = llama_response.find('{')
-            json_end = llama_response.rfind('}') + 1
-            
-            if json_start != -1 and json_end > json_start:
-                json_str = llama_response[json_start:json_end]
-                analysis = json.loads(json_str)
-            else:
-                # Fallback if JSON parsing fails
-                analysis = self._fallback_analysis(profile)
+            with metrics.span("parse"):
+                # Clean response to extract JSON
+                json_start = llama_response.find('{')
+                json_end = llama_response.rfind('}') + 1
+                
+                if json_start != -1 and json_end > json_start:
+                    json_str = llama_response[json_start:json_end]
+                    analysis = json.loads(json_str)
+                    analysis['analysis_source'] = 'llm'
+                else:
+                    # Fallback if JSON parsing fails
+                    metrics.increment("llama_parse_failures_total", labels={"reason": "no_json"})
+                    analysis = self._fallback_analysis(profile)
             
         except (json.JSONDecodeError, ValueError):
-            print("Failed to parse Llama response, using fallback analysis")
+            logger.warning("Failed to parse Llama response, using fallback analysis")
+            metrics.increment("llama_parse_failures_total", labels={"reason": "invalid_json"})
             analysis = self._fallback_analysis(profile)
         
         # Enhance analysis with additional processing
@@ -213,21 +766,285 @@ Provide your analysis as a valid JSON object only."""
         
         return analysis
     
+    def _analyze_safely(self, profile: VeteranProfile) -> Dict[str, Any]:
+        """Analyze one profile, falling back to rule-based analysis on any error"""
+        try:
+            with metrics.span("analyze"):
+                return self.analyze_veteran_with_llama(profile)
+        except Exception as e:
+            logger.exception("Analysis failed for %s: %s", profile.email or profile.full_name, e)
+            return self._enhance_llama_analysis(self._fallback_analysis(profile), profile)
+    
+    async def _analyze_safely_async(self, profile: VeteranProfile) -> Dict[str, Any]:
+        """Async counterpart of ``_analyze_safely``"""
+        try:
+            with metrics.span("analyze"):
+                return await self.analyze_veteran_with_llama_async(profile)
+        except Exception as e:
+            logger.exception("Analysis failed for %s: %s", profile.email or profile.full_name, e)
+            return self._enhance_llama_analysis(self._fallback_analysis(profile), profile)
+    
+    def _triage_plan(self, profiles: Iterable[VeteranProfile], pretriage: bool,
+                     chunk_size: int = 256) -> Iterator[Tuple[int, VeteranProfile, Optional[TriageResult]]]:
+        """
+        Yield (index, profile, triage) work items
+        
+        Profiles are pre-triaged a chunk at a time; within each chunk, crisis
+        profiles are moved to the front so they reach the LLM first.
+        """
+        chunk: List[Tuple[int, VeteranProfile]] = []
+        
+        def flush():
+            if not pretriage:
+                return [(index, profile, None) for index, profile in chunk]
+            with metrics.span("pretriage"):
+                triaged = self.pretriage_engine.triage([profile for _, profile in chunk])
+            items = [(index, profile, result) for (index, profile), result in zip(chunk, triaged)]
+            return sorted(items, key=lambda item: item[2].route != ROUTE_CRISIS)
+        
+        for item in enumerate(profiles):
+            chunk.append(item)
+            if len(chunk) >= chunk_size:
+                yield from flush()
+                chunk = []
+        if chunk:
+            yield from flush()
+    
+    def _pretriage_one(self, profile: VeteranProfile) -> TriageResult:
+        with metrics.span("pretriage"):
+            return self.pretriage_engine.triage([profile])[0]
+    
+    def _rules_only_analysis(self, profile: VeteranProfile, triage: TriageResult) -> Dict[str, Any]:
+        return self._enhance_llama_analysis(triage.analysis, profile)
+    
+    def _merge_triage(self, analysis: Dict[str, Any], triage: Optional[TriageResult]) -> Dict[str, Any]:
+        """Record the pre-triage route; crisis signals always keep the intervention flag"""
+        if triage is not None:
+            analysis['triage_route'] = triage.route
+            if triage.route == ROUTE_CRISIS:
+                analysis['intervention_needed'] = True
+        return analysis
+    
+    @staticmethod
+    def _triaged_priority(triage: Optional[TriageResult], default: str) -> str:
+        return CRISIS if triage is not None and triage.route == ROUTE_CRISIS else default
+    
+    def _analyze_triaged(self, profile: VeteranProfile, triage: Optional[TriageResult],
+                         priority: str = BACKGROUND) -> Dict[str, Any]:
+        with priority_scope(self._triaged_priority(triage, priority)):
+            return self._merge_triage(self._analyze_safely(profile), triage)
+    
+    async def _analyze_triaged_async(self, profile: VeteranProfile, triage: Optional[TriageResult],
+                                     priority: str = BACKGROUND) -> Dict[str, Any]:
+        with priority_scope(self._triaged_priority(triage, priority)):
+            return self._merge_triage(await self._analyze_safely_async(profile), triage)
+    
+    def iter_analyses(self, profiles: Iterable[VeteranProfile], max_concurrency: int = 4,
+                      pretriage: bool = True) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """
+        Analyze profiles on a thread pool, yielding results as they complete
+        
+        At most ``max_concurrency`` requests are in flight against Ollama at any
+        time, and ``profiles`` is consumed lazily so large cohorts can be streamed.
+        Keep ``max_concurrency`` at or below ``pool_size`` so every in-flight
+        request can reuse a pooled connection.
+        
+        With ``pretriage`` enabled, routine profiles the rule engine classifies
+        with high confidence are answered without the LLM, and profiles with
+        crisis signals are sent to the LLM ahead of the rest.
+        
+        With a scheduler, batch requests run at ``background`` priority unless
+        the caller is inside a ``priority_scope``; crisis profiles always run
+        at ``crisis`` priority.
+        
+        Args:
+            profiles: Veteran profiles to analyze
+            max_concurrency: Maximum number of concurrent Llama requests
+            pretriage: Run the rule-based pre-triage first
+            
+        Yields:
+            (input index, analysis) tuples in completion order
+        """
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        
+        # Context variables do not reach the pool threads, so pass the class along
+        priority = current_priority(BACKGROUND)
+        pending = {}
+        with ThreadPoolExecutor(max_workers=max_concurrency,
+                                thread_name_prefix="llama-analysis") as executor:
+            for index, profile, triage in self._triage_plan(profiles, pretriage):
+                if triage is not None and triage.route == ROUTE_RULES:
+                    yield index, self._merge_triage(self._rules_only_analysis(profile, triage), triage)
+                    continue
+                pending[executor.submit(self._analyze_triaged, profile, triage, priority)] = index
+                if len(pending) < max_concurrency:
+                    continue
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
+            
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
+    
+    def analyze_many(self, profiles: Iterable[VeteranProfile], max_concurrency: int = 4,
+                     pretriage: bool = True) -> List[Dict[str, Any]]:
+        """
+        Analyze a batch of profiles concurrently
+        
+        A failure on one profile only affects that profile, which falls back
+        to ``_fallback_analysis``; the rest of the batch is unaffected.
+        
+        Returns:
+            Analyses in the same order as ``profiles``
+        """
+        results: Dict[int, Dict[str, Any]] = {}
+        for index, analysis in self.iter_analyses(profiles, max_concurrency, pretriage):
+            results[index] = analysis
+        return [results[i] for i in range(len(results))]
+    
+    async def iter_analyses_async(self, profiles: Iterable[VeteranProfile], max_concurrency: int = 4,
+                                  pretriage: bool = True) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+        """Asyncio counterpart of ``iter_analyses``, yielding (index, analysis) as completed"""
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        
+        pending = set()
+        priority = current_priority(BACKGROUND)
+        
+        async def run(index: int, profile: VeteranProfile,
+                      triage: Optional[TriageResult]) -> Tuple[int, Dict[str, Any]]:
+            return index, await self._analyze_triaged_async(profile, triage, priority)
+        
+        try:
+            for index, profile, triage in self._triage_plan(profiles, pretriage):
+                if triage is not None and triage.route == ROUTE_RULES:
+                    yield index, self._merge_triage(self._rules_only_analysis(profile, triage), triage)
+                    continue
+                pending.add(asyncio.ensure_future(run(index, profile, triage)))
+                if len(pending) < max_concurrency:
+                    continue
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+            
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+    
+    async def analyze_many_async(self, profiles: Iterable[VeteranProfile], max_concurrency: int = 4,
+                                 pretriage: bool = True) -> List[Dict[str, Any]]:
+        """Asyncio counterpart of ``analyze_many``; results are in input order"""
+        results: Dict[int, Dict[str, Any]] = {}
+        async for index, analysis in self.iter_analyses_async(profiles, max_concurrency, pretriage):
+            results[index] = analysis
+        return [results[i] for i in range(len(results))]
+    
+    def _truncate_tokens(self, text: str, budget: Optional[int] = None) -> str:
+        """Cut ``text`` at a word boundary to roughly ``budget`` tokens"""
+        text = " ".join((text or "").split())
+        max_chars = (budget or self.free_text_token_budget) * CHARS_PER_TOKEN
+        if len(text) <= max_chars:
+            return text
+        cut = text.rfind(" ", 0, max_chars)
+        return text[:cut if cut > 0 else max_chars].rstrip(" ,;.") + " ..."
+    
+    def _format_compact_profile(self, profile: VeteranProfile) -> str:
+        """
+        One line per known fact, omitting empty fields
+        
+        Name, contact and city are left out (none of them bear on the
+        assessment; city only drives the local group), yes/no answers are
+        collapsed into a single list of the flags that are set, and free
+        text is capped at ``free_text_token_budget``.
+        """
+        def joined(items: Optional[List[str]]) -> str:
+            return self._truncate_tokens(", ".join(i for i in items or [] if i))
+        
+        service = ", ".join(str(part) for part in (
+            profile.branch_of_service, profile.rank_at_discharge, profile.mos_job_title,
+            f"{profile.years_of_service} yrs" if profile.years_of_service else "",
+            profile.discharge_status and f"{profile.discharge_status} discharge",
+            profile.discharge_date and
+            f"{profile.discharge_date} {self._discharge_recency(profile.discharge_date)}".strip(),
+        ) if part)
+        
+        flags = [label for label, value in (
+            ("receiving mental health support", profile.receiving_mental_health_support),
+            ("sleep issues", profile.sleep_issues),
+            ("substance use issues", profile.substance_use),
+            ("daily wellness check-ins", profile.daily_wellness_checkins),
+            ("mood tracker", profile.mood_tracker_optin),
+            ("willing to mentor", profile.willing_to_mentor),
+            ("willing to relocate", profile.willing_to_relocate),
+            ("DD-214 uploaded", profile.dd214_uploaded),
+            ("resume uploaded", profile.resume_uploaded),
+            ("consents to data sharing", profile.consent_anonymized_data),
+            ("emergency contact on file", profile.emergency_contact),
+        ) if value]
+        
+        lines = (
+            ("Age", profile.age),
+            ("Service", service),
+            ("Deployments", self._truncate_tokens(profile.deployment_history)),
+            ("ZIP", profile.zip_code),
+            ("Housing", profile.housing_status),
+            ("Peer support comfort", profile.comfort_level_peer_support and
+             f"{profile.comfort_level_peer_support}/5"),
+            ("Flags", ", ".join(flags)),
+            ("Looking for", joined(profile.looking_for)),
+            ("Career interests", joined(profile.career_interests)),
+            ("Topics", joined(profile.topics_of_interest)),
+            ("Privacy", profile.privacy_settings),
+        )
+        return "\n".join(f"{label}: {value}" for label, value in lines
+                         if value and str(value).strip().lower() != "not specified"
+                         ) or "No profile details provided."
+    
+    def prompt_token_report(self, profiles: Iterable[VeteranProfile]) -> Dict[str, Dict[str, Any]]:
+        """
+        Compare prompt sizes of the compact and verbose styles using the
+        ``prompt_eval_count`` Ollama reports
+        
+        Each profile's analysis prompt is sent in both styles with
+        generation limited to one token and the response cache bypassed.
+        
+        Returns:
+            Per style: prompts sent, Ollama's prompt token totals and
+            means, and the mean prompt length in characters
+        """
+        profiles = list(profiles)
+        report = {}
+        original_style = self.prompt_style
+        try:
+            for style in (PROMPT_VERBOSE, PROMPT_COMPACT):
+                self.prompt_style = style
+                usage, chars = TokenUsage(), 0
+                for profile in profiles:
+                    prompt, system_prompt = self._build_analysis_prompts(profile)
+                    chars += len(prompt) + len(system_prompt)
+                    payload = self._build_payload(prompt, system_prompt)
+                    payload["options"] = dict(payload["options"], num_predict=1)
+                    try:
+                        usage.record(self.transport.post_json("/api/generate", payload))
+                    except LlamaTransportError as e:
+                        logger.error("Error calling Llama: %s", e)
+                report[style] = dict(usage.as_dict(),
+                                     mean_prompt_chars=round(chars / len(profiles), 1) if profiles else 0)
+        finally:
+            self.prompt_style = original_style
+        return report
+    
     def _format_profile_for_llama(self, profile: VeteranProfile) -> str:
         """Format veteran profile for Llama analysis"""
         
-        # Calculate time since discharge
-        discharge_recency = ""
-        if profile.discharge_date:
-            try:
-                discharge_date = datetime.strptime(profile.discharge_date, '%Y-%m-%d')
-                days_since = (datetime.now() - discharge_date).days
-                if days_since < 365:
-                    discharge_recency = f"Recently discharged ({days_since} days ago)"
-                else:
-                    discharge_recency = f"Discharged {days_since // 365} years ago"
-            except:
-                pass
+        discharge_recency = self._discharge_recency(profile.discharge_date)
         
         profile_text = f"""
 VETERAN PROFILE ANALYSIS REQUEST
@@ -235,6 +1052,7 @@ VETERAN PROFILE ANALYSIS REQUEST
 === BASIC INFORMATION ===
 Name: {profile.full_name}
 Contact: {profile.email}
+Age: {profile.age or 'Not specified'}
 
 === MILITARY SERVICE ===
 Branch: {profile.branch_of_service}
@@ -273,64 +1091,153 @@ Emergency Contact Provided: {'Yes' if profile.emergency_contact else 'No'}
 """
         return profile_text.strip()
     
+    @staticmethod
+    def _discharge_recency(discharge_date: str) -> str:
+        """
+        Describe time since discharge in coarse buckets
+        
+        Exact day counts would change the prompt every day and defeat the
+        response cache, so recency is reported at month/year granularity.
+        """
+        if not discharge_date:
+            return ""
+        try:
+            days_since = (datetime.now() - datetime.strptime(discharge_date, '%Y-%m-%d')).days
+        except ValueError:
+            return ""
+        
+        if days_since < 0:
+            return ""
+        if days_since < 90:
+            return "(Recently discharged, under 3 months ago)"
+        if days_since < 180:
+            return "(Recently discharged, 3-6 months ago)"
+        if days_since < 365:
+            return "(Recently discharged, 6-12 months ago)"
+        return f"(Discharged {days_since // 365} years ago)"
+    
     def _fallback_analysis(self, profile: VeteranProfile) -> Dict[str, Any]:
-        """Fallback analysis if Llama fails"""
-        tags = []
-        
-        # Basic rule-based analysis
-        if profile.looking_for and 'Jobs' in profile.looking_for:
-            tags.append('Job')
-        if profile.substance_use:
-            tags.append('Substance use')
-        if profile.sleep_issues:
-            tags.append('Sleep issues')
-        if profile.receiving_mental_health_support:
-            tags.append('In therapy')
-        
-        return {
-            'primary_tags': tags[:3],
-            'secondary_tags': tags[3:],
-            'risk_level': 'Medium',
-            'priority_score': 5,
-            'intervention_needed': False,
-            'recommended_groups': ['General Support Group'],
-            'resource_priorities': ['Basic Services'],
-            'reasoning': 'Fallback analysis - Llama unavailable'
-        }
+        """Fallback analysis if Llama fails, using the rule-based pre-triage"""
+        metrics.increment("llama_fallbacks_total")
+        analysis = self.pretriage_engine.triage([profile])[0].analysis
+        analysis['reasoning'] = 'Fallback analysis - Llama unavailable'
+        analysis['analysis_source'] = 'fallback'
+        return analysis
     
     def _enhance_llama_analysis(self, analysis: Dict, profile: VeteranProfile) -> Dict[str, Any]:
         """Enhance Llama's analysis with additional logic"""
+        with metrics.span("enhance"):
+            # Validate and clean tags
+            if 'primary_tags' in analysis:
+                analysis['primary_tags'] = self.tag_vocabulary.validate(analysis['primary_tags'])
+            
+            if 'secondary_tags' in analysis:
+                analysis['secondary_tags'] = self.tag_vocabulary.validate(analysis['secondary_tags'])
+            
+            # Recalculate priority score based on tags
+            self.score_analyses([analysis])
+            
+            # Add geographic grouping, replacing the one from a previous enhancement
+            if 'recommended_groups' in analysis:
+                previous_local = analysis.pop('local_group', None)
+                if previous_local in analysis['recommended_groups']:
+                    analysis['recommended_groups'].remove(previous_local)
+                if profile.city:
+                    analysis['local_group'] = f"{profile.city} Local Veterans"
+                    analysis['recommended_groups'].append(analysis['local_group'])
+            
+            # Add metadata
+            analysis['analysis_timestamp'] = datetime.now().isoformat()
+            analysis['llama_model_used'] = self.model_name
+            analysis['analysis_fingerprint'] = self.analysis_fingerprint(profile)
+            analysis['enhancement_fingerprint'] = profile.enhancement_fingerprint()
+            
+            return analysis
+    
+    def reanalyze(self, profile: VeteranProfile,
+                  previous: Optional[Dict[str, Any]] = None) -> Tuple[Dict[str, Any], str]:
+        """
+        Bring a previous analysis up to date with as little work as possible
         
-        # Validate and clean tags
-        if 'primary_tags' in analysis:
-            analysis['primary_tags'] = [tag for tag in analysis['primary_tags'] 
-                                      if tag in self.available_tags]
-        
-        if 'secondary_tags' in analysis:
-            analysis['secondary_tags'] = [tag for tag in analysis['secondary_tags'] 
-                                        if tag in self.available_tags]
-        
-        # Recalculate priority score based on tags
-        priority_score = 0
-        all_tags = analysis.get('primary_tags', []) + analysis.get('secondary_tags', [])
-        for tag in all_tags:
-            priority_score += self.priority_weights.get(tag, 1)
-        
-        analysis['calculated_priority_score'] = priority_score
-        
-        # Add geographic grouping
-        if profile.city and 'recommended_groups' in analysis:
-            analysis['recommended_groups'].append(f"{profile.city} Local Veterans")
+        Args:
+            profile: Current veteran profile
+            previous: Analysis returned by an earlier run, if any
+            
+        Returns:
+            (analysis, action) where action is "skipped" (nothing relevant
+            changed), "enhanced" (only enhancement inputs such as city changed,
+            so just ``_enhance_llama_analysis`` re-ran) or "analyzed" (full run,
+            also when ``previous`` is a fallback analysis). A full run goes
+            through the pre-triage like ``iter_analyses``: routine profiles
+            are answered by the rules and crisis profiles are flagged and
+            analysed at crisis priority.
+        """
+        action = self._reanalysis_action(profile, previous)
+        if action == "skipped":
+            return previous, action
+        if action == "enhanced":
+            return self._enhance_llama_analysis(copy.deepcopy(previous), profile), action
+        triage = self._pretriage_one(profile)
+        if triage.route == ROUTE_RULES:
+            return self._merge_triage(self._rules_only_analysis(profile, triage), triage), action
+        # Crisis tags from the previous analysis also put the re-run in the fast lane
+        priority = self._analysis_priority(profile, previous) or current_priority(BACKGROUND)
+        return self._analyze_triaged(profile, triage, priority), action
+    
+    async def reanalyze_async(self, profile: VeteranProfile,
+                              previous: Optional[Dict[str, Any]] = None) -> Tuple[Dict[str, Any], str]:
+        """Async counterpart of ``reanalyze``"""
+        action = self._reanalysis_action(profile, previous)
+        if action == "skipped":
+            return previous, action
+        if action == "enhanced":
+            return self._enhance_llama_analysis(copy.deepcopy(previous), profile), action
+        triage = self._pretriage_one(profile)
+        if triage.route == ROUTE_RULES:
+            return self._merge_triage(self._rules_only_analysis(profile, triage), triage), action
+        priority = self._analysis_priority(profile, previous) or current_priority(BACKGROUND)
+        return await self._analyze_triaged_async(profile, triage, priority), action
+    
+    def reanalyze_many(self, items: Iterable[Tuple[VeteranProfile, Optional[Dict[str, Any]]]],
+                       max_concurrency: int = 4) -> List[Tuple[Dict[str, Any], str]]:
+        """
+        Batch ``reanalyze`` where only profiles with meaningful changes hit the LLM
         
-        # Add metadata
-        analysis['analysis_timestamp'] = datetime.now().isoformat()
-        analysis['llama_model_used'] = self.model_name
+        Returns:
+            (analysis, action) tuples in input order
+        """
+        results: List[Optional[Tuple[Dict[str, Any], str]]] = []
+        stale: List[Tuple[int, VeteranProfile]] = []
+        for profile, previous in items:
+            action = self._reanalysis_action(profile, previous)
+            if action == "analyzed":
+                stale.append((len(results), profile))
+                results.append(None)
+            elif action == "enhanced":
+                results.append((self._enhance_llama_analysis(copy.deepcopy(previous), profile), action))
+            else:
+                results.append((previous, action))
         
-        return analysis
+        analyses = self.iter_analyses((profile for _, profile in stale), max_concurrency)
+        for stale_index, analysis in analyses:
+            results[stale[stale_index][0]] = (analysis, "analyzed")
+        return results
     
-    def generate_personalized_outreach(self, profile: VeteranProfile, analysis: Dict) -> str:
-        """Use Llama to generate personalized outreach message"""
-        
+    def analysis_fingerprint(self, profile: VeteranProfile) -> str:
+        """Fingerprint of ``profile`` under this grouper's model, prompt style, output mode and tags"""
+        return profile.analysis_fingerprint(self.model_name, self.prompt_style, self.structured_output,
+                                            self._tags_fingerprint)
+    
+    def _reanalysis_action(self, profile: VeteranProfile, previous: Optional[Dict[str, Any]]) -> str:
+        if (not previous or previous.get('analysis_source') not in REUSABLE_SOURCES
+                or previous.get('analysis_fingerprint') != self.analysis_fingerprint(profile)):
+            return "analyzed"
+        if previous.get('enhancement_fingerprint') != profile.enhancement_fingerprint():
+            return "enhanced"
+        return "skipped"
+    
+    def _build_outreach_prompts(self, profile: VeteranProfile, analysis: Dict) -> Tuple[str, str]:
+        """Build the (outreach prompt, system prompt) pair for a profile"""
         system_prompt = """You are a veteran peer support specialist writing personalized, empathetic outreach messages. Write in a warm, respectful, veteran-to-veteran tone. Keep messages concise (2-3 paragraphs) and actionable."""
         
         outreach_prompt = f"""Write a personalized welcome message for this veteran based on their profile and needs assessment:
@@ -350,7 +1257,32 @@ The message should:
 
 Write the message directly without quotes or formatting."""
 
-        return self.call_llama(outreach_prompt, system_prompt)
+        return outreach_prompt, system_prompt
+    
+    def generate_personalized_outreach(self, profile: VeteranProfile, analysis: Dict) -> str:
+        """Use Llama to generate personalized outreach message"""
+        outreach_prompt, system_prompt = self._build_outreach_prompts(profile, analysis)
+        return self.call_llama(outreach_prompt, system_prompt,
+                               priority=self._analysis_priority(profile, analysis) or OUTREACH)
+    
+    def stream_personalized_outreach(self, profile: VeteranProfile, analysis: Dict) -> Iterator[str]:
+        """Streaming variant of ``generate_personalized_outreach`` that yields tokens"""
+        outreach_prompt, system_prompt = self._build_outreach_prompts(profile, analysis)
+        return self.stream_llama(outreach_prompt, system_prompt,
+                                 priority=self._analysis_priority(profile, analysis) or OUTREACH)
+    
+    async def generate_personalized_outreach_async(self, profile: VeteranProfile, analysis: Dict) -> str:
+        """Async counterpart of ``generate_personalized_outreach``"""
+        outreach_prompt, system_prompt = self._build_outreach_prompts(profile, analysis)
+        return await self.call_llama_async(outreach_prompt, system_prompt,
+                                           priority=self._analysis_priority(profile, analysis) or OUTREACH)
+    
+    def stream_personalized_outreach_async(self, profile: VeteranProfile,
+                                           analysis: Dict) -> AsyncIterator[str]:
+        """Async counterpart of ``stream_personalized_outreach``"""
+        outreach_prompt, system_prompt = self._build_outreach_prompts(profile, analysis)
+        return self.stream_llama_async(outreach_prompt, system_prompt,
+                                       priority=self._analysis_priority(profile, analysis) or OUTREACH)
 
 def setup_llama_instructions():
     """Instructions for setting up Llama locally"""
@@ -444,7 +1376,12 @@ def create_sample_veterans() -> List[VeteranProfile]:
     ]
 
 def main():
-    """Main demonstration function"""
+    """Main demonstration function
+
+    Run from backend/ as ``python -m models.DynamicGrouping_Llama2B``
+    (or ``python models/DynamicGrouping_Llama2B.py``); add
+    ``--prompt-report`` for prompt token counts.
+    """
     
     print(setup_llama_instructions())
     
@@ -516,4 +1453,9 @@ def main():
     print("✓ Nuanced risk assessment considering multiple factors")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if "--prompt-report" in sys.argv:
+        # Prompt tokens per analysis call, verbose vs compact, as counted by Ollama
+        report = LlamaVeteranGrouper().prompt_token_report(create_sample_veterans())
+        print(json.dumps(report, indent=2))
+    else:
+        main()
\ No newline at end of file
@@ -0,0 +1,123 @@
+"""
+Dynamic micro-batching for single-item inference calls.
+
+Callers submit one item at a time and get a ``Future`` back. A background
+thread collects items until either ``max_batch_size`` are waiting or the
+oldest has waited ``max_wait_ms``, then runs them through the batch
+function as a single forward pass and resolves each caller's future.
+With ``workers > 1`` several batches can be in flight at once.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Generic, List, Optional, Sequence, Tuple, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+_STOP = object()
+
+
+class MicroBatcher(Generic[T, R]):
+    """Coalesces concurrent single-item requests into batched calls"""
+
+    def __init__(self, batch_fn: Callable[[List[T]], Sequence[R]], max_batch_size: int = 32,
+                 max_wait_ms: float = 5.0, name: str = "micro-batcher", workers: int = 1):
+        """
+        Args:
+            batch_fn: Processes a list of items and returns one result per item
+            max_batch_size: Largest batch handed to ``batch_fn``
+            max_wait_ms: Longest time the first item of a batch waits for company
+            name: Worker thread name
+            workers: Worker threads collecting and running batches
+        """
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.name = name
+        self.workers = workers
+        self._queue: "queue.Queue[Tuple[T, Future]]" = queue.Queue()
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.batches_run = 0
+        self.items_processed = 0
+
+    def submit(self, item: T) -> "Future[R]":
+        """Queue one item; the future resolves when its batch has run"""
+        self._ensure_worker()
+        future: "Future[R]" = Future()
+        self._queue.put((item, future))
+        return future
+
+    def __call__(self, item: T, timeout: Optional[float] = None) -> R:
+        return self.submit(item).result(timeout)
+
+    def _ensure_worker(self) -> None:
+        if len(self._threads) == self.workers and all(t.is_alive() for t in self._threads):
+            return
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run, daemon=True,
+                                          name=f"{self.name}-{len(self._threads)}")
+                thread.start()
+                self._threads.append(thread)
+
+    def _collect(self, first) -> List[Tuple[T, Future]]:
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    item = self._queue.get(timeout=remaining)
+                else:
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                self._queue.put(_STOP)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            batch = [(item, future) for item, future in self._collect(first)
+                     if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                results = self.batch_fn([item for item, _ in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(
+                        f"batch_fn returned {len(results)} results for {len(batch)} items"
+                    )
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            with self._stats_lock:
+                self.batches_run += 1
+                self.items_processed += len(batch)
+
+    def close(self) -> None:
+        """Stop the workers after the items already queued have been processed"""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(_STOP)
+        for thread in threads:
+            thread.join()
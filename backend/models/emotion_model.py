@@ -1,13 +1,82 @@
+import logging
+import os
+import threading
 
-from transformers import pipeline
+from models.emotion_batcher import MicroBatcher
 
-# Load sentiment/emotion classification pipeline (can use "j-hartmann/emotion-english-distilroberta-base" or similar)
-#emotion_classifier = pipeline("text-classification", model="j-hartmann/emotion-english-distilroberta-base", return_all_scores=False)
-emotion_classifier = pipeline(
-    "text-classification",
-    model="j-hartmann/emotion-english-distilroberta-base",
-    top_k=1
-)
+logger = logging.getLogger(__name__)
+
+# The transformers pipeline (and torch) is loaded on first use rather than at
+# import time, so processes that never classify text don't pay for it.
+# Can use "j-hartmann/emotion-english-distilroberta-base" or similar
+MODEL_NAME = "j-hartmann/emotion-english-distilroberta-base"
+
+# Concurrent predict_emotion calls are coalesced into padded batches of up
+# to EMOTION_BATCH_SIZE texts, waiting at most EMOTION_BATCH_WAIT_MS
+BATCH_SIZE = int(os.environ.get("EMOTION_BATCH_SIZE", 32))
+BATCH_WAIT_MS = float(os.environ.get("EMOTION_BATCH_WAIT_MS", 5))
+
+# Inference backend: "transformers" (PyTorch pipeline) or "onnx" (ONNX Runtime
+# on a model exported with `python -m models.emotion_onnx export`). The ONNX
+# backend uses the int8 model unless EMOTION_ONNX_QUANTIZED=0, falling back to
+# the fp32 one when the export was not quantized. A missing model or missing
+# onnxruntime/tokenizers is a configuration error and is raised; other
+# classification failures are logged and reported as None, never as a mood.
+BACKEND = os.environ.get("EMOTION_BACKEND", "transformers").lower()
+ONNX_DIR = os.environ.get("EMOTION_ONNX_DIR", "onnx/emotion")
+ONNX_QUANTIZED = os.environ.get("EMOTION_ONNX_QUANTIZED", "1").lower() not in ("0", "false", "no")
+
+# When set, predict_emotion / predict_emotions are served by the shared
+# sidecar process on this Unix socket (`python -m models.emotion_sidecar
+# serve`) and this process never loads the model itself
+SIDECAR_SOCKET = os.environ.get("EMOTION_SIDECAR_SOCKET", "")
+SIDECAR_TIMEOUT = float(os.environ.get("EMOTION_SIDECAR_TIMEOUT", 10))
+
+_emotion_classifier = None
+_classifier_lock = threading.Lock()
+_sidecar_client = None
+
+
+def get_emotion_classifier():
+    """Return the emotion classifier for the configured backend, loading it once on first call"""
+    global _emotion_classifier
+    if _emotion_classifier is None:
+        with _classifier_lock:
+            if _emotion_classifier is None:
+                if BACKEND == "onnx":
+                    from models.emotion_onnx import OnnxEmotionClassifier
+                    _emotion_classifier = OnnxEmotionClassifier(ONNX_DIR, quantized=ONNX_QUANTIZED)
+                else:
+                    from transformers import pipeline
+                    _emotion_classifier = pipeline(
+                        "text-classification",
+                        model=MODEL_NAME,
+                        top_k=1
+                    )
+    return _emotion_classifier
+
+
+def get_sidecar_client():
+    """Client for the shared sidecar, or None when EMOTION_SIDECAR_SOCKET is unset"""
+    global _sidecar_client
+    if SIDECAR_SOCKET and _sidecar_client is None:
+        with _classifier_lock:
+            if _sidecar_client is None:
+                from models.emotion_sidecar import SidecarClient
+                _sidecar_client = SidecarClient(SIDECAR_SOCKET, timeout=SIDECAR_TIMEOUT)
+    return _sidecar_client
+
+
+def warmup():
+    """Preload the classifier and run one inference, e.g. at server start"""
+    get_emotion_classifier()("warmup")
+
+
+def __getattr__(name):
+    # Keep `emotion_model.emotion_classifier` working for existing callers
+    if name == "emotion_classifier":
+        return get_emotion_classifier()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Map model's emotions to our simplified categories
 EMOTION_MAP = {
@@ -21,13 +90,46 @@ EMOTION_MAP = {
     "love": "happy"
 }
 
+def _classify_batch(texts):
+    """Run one padded forward pass over ``texts`` and map each to our categories"""
+    results = get_emotion_classifier()(list(texts), batch_size=len(texts), truncation=True)
+    return [EMOTION_MAP.get(result[0]['label'].lower(), "calm") for result in results]
+
+
+_batcher = MicroBatcher(_classify_batch, max_batch_size=BATCH_SIZE,
+                        max_wait_ms=BATCH_WAIT_MS, name="emotion-batcher")
+
+
 def predict_emotion(text):
+    """The emotion category of ``text``, or None when classification failed"""
     try:
-        result = emotion_classifier(text)[0][0]
-        label = result['label'].lower()
-        print("Model result:", result)
-        mapped_emotion = EMOTION_MAP.get(label, "calm")
-        return mapped_emotion
-    except Exception as e:
-        print("Error in emotion classification:", e)
-        return "calm"
+        sidecar = get_sidecar_client()
+        if sidecar is not None:
+            return sidecar.classify([text])[0]
+        return _batcher(text)
+    except (FileNotFoundError, ImportError):
+        raise
+    except Exception:
+        logger.exception("Emotion classification failed")
+        return None
+
+def predict_emotions(texts, batch_size=BATCH_SIZE):
+    """
+    Classify many texts directly in fixed-size batches, e.g. for backfilling
+    historical journal entries. Returns one emotion per text, in order,
+    with None for the texts of a batch that failed.
+    """
+    texts = list(texts)
+    sidecar = get_sidecar_client()
+    emotions = []
+    for start in range(0, len(texts), batch_size):
+        chunk = texts[start:start + batch_size]
+        try:
+            emotions.extend(sidecar.classify(chunk) if sidecar is not None
+                            else _classify_batch(chunk))
+        except (FileNotFoundError, ImportError):
+            raise
+        except Exception:
+            logger.exception("Emotion classification failed for a batch of %d texts", len(chunk))
+            emotions.extend([None] * len(chunk))
+    return emotions
@@ -0,0 +1,278 @@
+"""
+ONNX Runtime backend for the emotion classifier.
+
+Exports the Hugging Face model to ONNX, optionally applies dynamic int8
+quantization, and serves it through ``OnnxEmotionClassifier``, which is
+call-compatible with the ``transformers`` text-classification pipeline
+used by ``emotion_model``.
+
+Usage (from backend/):
+
+    python -m models.emotion_onnx export --output onnx/emotion --quantize
+    python -m models.emotion_onnx compare --model-dir onnx/emotion
+
+Inference needs ``onnxruntime`` and ``tokenizers`` (requirements-emotion.txt);
+``export`` additionally needs ``torch`` and ``transformers``.
+
+``compare`` runs the fixed ``PARITY_TEXTS`` through every backend and
+reports label agreement with the PyTorch pipeline, the largest score
+difference, latency and resident memory, each backend measured in its
+own process.
+"""
+
+import argparse
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "j-hartmann/emotion-english-distilroberta-base"
+FP32_FILE = "model.onnx"
+INT8_FILE = "model.int8.onnx"
+MAX_LENGTH = 512
+
+PARITY_TEXTS = [
+    "I finally got the job offer today, I can't stop smiling.",
+    "I haven't slept in days and everything feels pointless.",
+    "The VA appointment got cancelled again and I'm furious.",
+    "Loud noises at the fireworks show made my heart race.",
+    "Just another ordinary Tuesday, nothing much going on.",
+    "My daughter hugged me and said she's proud of me.",
+    "I don't know if I can keep going like this.",
+    "Wow, I didn't expect the whole unit to show up for my birthday!",
+    "The smell at that place made me sick to my stomach.",
+    "I'm worried about paying rent next month.",
+    "Had a good talk with my peer mentor, feeling calmer now.",
+    "They treated me like I was nothing after 12 years of service.",
+    "Went fishing with my buddy, best day in a long time.",
+    "I keep replaying what happened on that deployment.",
+    "Support group tonight was okay, I guess.",
+    "I love the new dog, he follows me everywhere.",
+    "Nobody calls anymore. It's just me and the TV.",
+    "Got my DD-214 uploaded and the benefits claim submitted.",
+    "I'm scared the nightmares will never stop.",
+    "That paperwork mess made me so angry I threw my phone.",
+]
+
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    shifted = logits - logits.max(axis=-1, keepdims=True)
+    exp = np.exp(shifted)
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+def export_onnx(model_name: str, output_dir: str, quantize: bool = True) -> Path:
+    """
+    Export ``model_name`` to ``output_dir`` and optionally quantize it
+
+    Writes model.onnx (and model.int8.onnx when quantizing) next to the
+    tokenizer and config files, so the directory is self-contained.
+    """
+    import torch
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    out = Path(output_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForSequenceClassification.from_pretrained(model_name).eval()
+    tokenizer.save_pretrained(out)
+    model.config.save_pretrained(out)
+
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (sample["input_ids"], sample["attention_mask"]),
+            str(out / FP32_FILE),
+            input_names=["input_ids", "attention_mask"],
+            output_names=["logits"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "logits": {0: "batch"},
+            },
+            opset_version=17,
+            dynamo=False,
+        )
+
+    if quantize:
+        quantize_model(out / FP32_FILE, out / INT8_FILE)
+    return out
+
+
+def quantize_model(source: Path, target: Path) -> None:
+    """Dynamic int8 weight quantization for CPU inference"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    quantize_dynamic(str(source), str(target), weight_type=QuantType.QInt8)
+
+
+class OnnxEmotionClassifier:
+    """Drop-in replacement for the text-classification pipeline with ``top_k=1``"""
+
+    def __init__(self, model_dir: str, quantized: bool = True, num_threads: Optional[int] = None):
+        # Only onnxruntime and tokenizers are needed at inference time, so
+        # this backend never imports torch
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        model_dir = Path(model_dir)
+        model_file = model_dir / (INT8_FILE if quantized else FP32_FILE)
+        if quantized and not model_file.exists() and (model_dir / FP32_FILE).exists():
+            # 导出时没有加 --quantize：退回 fp32 模型，而不是让每次分类都失败
+            logger.warning("%s not found; using the fp32 model. Export with --quantize "
+                           "or set EMOTION_ONNX_QUANTIZED=0", model_file)
+            model_file = model_dir / FP32_FILE
+        if not model_file.exists():
+            raise FileNotFoundError(
+                f"{model_file} not found; run `python -m models.emotion_onnx export` first"
+            )
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(str(model_file), options,
+                                            providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        config = json.loads((model_dir / "config.json").read_text())
+        self.id2label = {int(i): label for i, label in config["id2label"].items()}
+        self.tokenizer = Tokenizer.from_file(str(model_dir / "tokenizer.json"))
+        self.tokenizer.enable_padding(pad_id=config.get("pad_token_id") or 0)
+        self.tokenizer.no_truncation()
+
+    def __call__(self, texts, batch_size: Optional[int] = None, truncation: bool = True):
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        batch_size = batch_size or len(texts) or 1
+
+        results: List[List[Dict[str, float]]] = []
+        for start in range(0, len(texts), batch_size):
+            if truncation:
+                self.tokenizer.enable_truncation(MAX_LENGTH)
+            else:
+                self.tokenizer.no_truncation()
+            encoded = self.tokenizer.encode_batch(texts[start:start + batch_size])
+            feeds = {
+                "input_ids": np.array([e.ids for e in encoded], dtype=np.int64),
+                "attention_mask": np.array([e.attention_mask for e in encoded], dtype=np.int64),
+            }
+            feeds = {name: value for name, value in feeds.items() if name in self.input_names}
+            probs = _softmax(self.session.run(["logits"], feeds)[0])
+            for row in probs:
+                best = int(row.argmax())
+                results.append([{"label": self.id2label[best], "score": float(row[best])}])
+        return results
+
+
+def load_backend(backend: str, model_dir: Optional[str] = None, model_name: str = DEFAULT_MODEL):
+    """Build a classifier for ``backend``: "transformers", "onnx" or "onnx-int8" """
+    if backend == "transformers":
+        from transformers import pipeline
+        return pipeline("text-classification", model=model_name, top_k=1)
+    if backend in ("onnx", "onnx-int8"):
+        if not model_dir:
+            raise ValueError("model_dir is required for the ONNX backends")
+        return OnnxEmotionClassifier(model_dir, quantized=backend == "onnx-int8")
+    raise ValueError(f"Unknown emotion backend: {backend}")
+
+
+def _rss_mib() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(backend: str, model_dir: Optional[str], model_name: str = DEFAULT_MODEL,
+            repeats: int = 5) -> Dict:
+    """Load one backend in this process and time it on PARITY_TEXTS"""
+    rss_before = _rss_mib()
+    start = time.perf_counter()
+    classifier = load_backend(backend, model_dir, model_name)
+    load_s = time.perf_counter() - start
+
+    classifier(PARITY_TEXTS[:2])  # warm up
+    single = []
+    for _ in range(repeats):
+        for text in PARITY_TEXTS:
+            t = time.perf_counter()
+            classifier([text])
+            single.append(time.perf_counter() - t)
+    batched = []
+    for _ in range(repeats):
+        t = time.perf_counter()
+        outputs = classifier(PARITY_TEXTS, batch_size=len(PARITY_TEXTS))
+        batched.append(time.perf_counter() - t)
+
+    return {
+        "backend": backend,
+        "load_s": round(load_s, 3),
+        "latency_single_ms_p50": round(float(np.median(single)) * 1000, 2),
+        "latency_batch_ms_per_text": round(float(np.median(batched)) * 1000 / len(PARITY_TEXTS), 2),
+        "rss_load_mib": round(_rss_mib() - rss_before, 1),
+        "rss_peak_mib": round(_rss_mib(), 1),
+        "labels": [o[0]["label"] for o in outputs],
+        "scores": [o[0]["score"] for o in outputs],
+    }
+
+
+def compare(model_dir: str, backends: List[str], model_name: str = DEFAULT_MODEL) -> Dict:
+    """Measure each backend in a fresh subprocess and check parity against the first"""
+    reports = []
+    for backend in backends:
+        proc = subprocess.run(
+            [sys.executable, "-m", "models.emotion_onnx", "measure",
+             "--backend", backend, "--model-dir", model_dir, "--model", model_name],
+            capture_output=True, text=True, check=True,
+            cwd=Path(__file__).resolve().parent.parent,
+        )
+        reports.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    reference = reports[0]
+    for report in reports[1:]:
+        agree = sum(a == b for a, b in zip(report["labels"], reference["labels"]))
+        report["label_agreement"] = agree / len(PARITY_TEXTS)
+        report["max_score_diff"] = round(max(
+            abs(a - b) for a, b in zip(report["scores"], reference["scores"])), 4)
+    return {"reference": reference["backend"], "reports": reports}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_export = sub.add_parser("export", help="Export the model to ONNX")
+    p_export.add_argument("--model", default=DEFAULT_MODEL)
+    p_export.add_argument("--output", default=os.environ.get("EMOTION_ONNX_DIR", "onnx/emotion"))
+    p_export.add_argument("--quantize", action="store_true", help="Also write an int8 model")
+
+    p_compare = sub.add_parser("compare", help="Accuracy parity and latency/RSS comparison")
+    p_compare.add_argument("--model-dir", required=True)
+    p_compare.add_argument("--model", default=DEFAULT_MODEL,
+                           help="Model the transformers backend loads")
+    p_compare.add_argument("--backends", nargs="+",
+                           default=["transformers", "onnx", "onnx-int8"])
+
+    p_measure = sub.add_parser("measure", help=argparse.SUPPRESS)
+    p_measure.add_argument("--backend", required=True)
+    p_measure.add_argument("--model-dir")
+    p_measure.add_argument("--model", default=DEFAULT_MODEL)
+
+    args = parser.parse_args(argv)
+    if args.command == "export":
+        print(export_onnx(args.model, args.output, quantize=args.quantize))
+    elif args.command == "compare":
+        print(json.dumps(compare(args.model_dir, args.backends, args.model), indent=2))
+    else:
+        print(json.dumps(measure(args.backend, args.model_dir, args.model)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""
+Local inference sidecar for the emotion classifier.
+
+One process holds the model and serves classification over a Unix socket,
+so Django workers don't each load their own copy of the weights. Requests
+from every connection go through a shared ``MicroBatcher`` whose worker
+threads form the inference pool.
+
+Protocol: one JSON object per line in each direction.
+
+    {"op": "classify", "texts": ["..."]}  ->  {"emotions": ["happy"]}
+    {"op": "health"}                      ->  {"status": "ok", ...}
+
+Errors come back as ``{"error": "..."}``.
+
+Usage (from backend/):
+
+    python -m models.emotion_sidecar serve --socket /run/emotion.sock --workers 2
+    python -m models.emotion_sidecar health --socket /run/emotion.sock
+
+With ``EMOTION_SIDECAR_SOCKET`` set, ``emotion_model.predict_emotion`` is a
+thin client of this process.
+"""
+
+import argparse
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = "/tmp/emotion-sidecar.sock"
+MAX_REQUEST_BYTES = 1 << 20
+MAX_TEXTS_PER_REQUEST = 1024
+
+
+class SidecarError(Exception):
+    """The sidecar could not be reached or rejected the request"""
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            line = self.rfile.readline(MAX_REQUEST_BYTES + 1)
+            if not line:
+                return
+            if len(line) > MAX_REQUEST_BYTES:
+                self._reply({"error": "request too large"})
+                return
+            try:
+                response = self.server.dispatch(json.loads(line))
+            except Exception as e:
+                logger.exception("Sidecar request failed")
+                response = {"error": str(e)}
+            self._reply(response)
+
+    def _reply(self, payload: Dict[str, Any]) -> None:
+        self.wfile.write(json.dumps(payload).encode("utf-8") + b"\n")
+        self.wfile.flush()
+
+
+class EmotionSidecarServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serves ``emotion_model`` classification to local clients"""
+
+    daemon_threads = True
+    # Every client thread holds its own connection; the socketserver
+    # default backlog of 5 refuses connection bursts with EAGAIN
+    request_queue_size = 256
+
+    def __init__(self, socket_path: str, workers: int = 1, batch_size: Optional[int] = None,
+                 batch_wait_ms: Optional[float] = None):
+        """
+        Args:
+            socket_path: Filesystem path of the Unix socket
+            workers: Inference threads running batches in parallel
+            batch_size: Largest batch per forward pass (default EMOTION_BATCH_SIZE)
+            batch_wait_ms: Longest wait for a batch to fill (default EMOTION_BATCH_WAIT_MS)
+        """
+        from models import emotion_model
+        from models.emotion_batcher import MicroBatcher
+
+        self.emotion_model = emotion_model
+        self.batcher = MicroBatcher(
+            emotion_model._classify_batch,
+            max_batch_size=batch_size or emotion_model.BATCH_SIZE,
+            max_wait_ms=emotion_model.BATCH_WAIT_MS if batch_wait_ms is None else batch_wait_ms,
+            name="emotion-sidecar",
+            workers=workers,
+        )
+        self.started_at = time.monotonic()
+        self.socket_path = socket_path
+        _remove_stale_socket(socket_path)
+        super().__init__(socket_path, _Handler)
+        os.chmod(socket_path, 0o660)
+
+    def dispatch(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        op = request.get("op")
+        if op == "classify":
+            texts = request.get("texts")
+            if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+                return {"error": "texts must be a list of strings"}
+            if len(texts) > MAX_TEXTS_PER_REQUEST:
+                return {"error": f"at most {MAX_TEXTS_PER_REQUEST} texts per request"}
+            futures = [self.batcher.submit(text) for text in texts]
+            return {"emotions": [future.result() for future in futures]}
+        if op == "health":
+            return self.health()
+        return {"error": f"unknown op: {op!r}"}
+
+    def health(self) -> Dict[str, Any]:
+        return {
+            "status": "ok",
+            "backend": self.emotion_model.BACKEND,
+            "model_loaded": self.emotion_model._emotion_classifier is not None,
+            "workers": self.batcher.workers,
+            "uptime_s": round(time.monotonic() - self.started_at, 1),
+            "batches_run": self.batcher.batches_run,
+            "items_processed": self.batcher.items_processed,
+        }
+
+    def server_close(self):
+        super().server_close()
+        self.batcher.close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+def _remove_stale_socket(path: str) -> None:
+    """Delete a socket file left by a dead sidecar; refuse to replace a live one"""
+    if not os.path.exists(path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.unlink(path)
+    else:
+        raise SidecarError(f"another sidecar is already listening on {path}")
+    finally:
+        probe.close()
+
+
+class SidecarClient:
+    """Thread-safe client keeping one persistent connection per thread"""
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET, timeout: float = 10.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            conn = self._local.conn = (sock, sock.makefile("rb"))
+        return conn
+
+    def _drop_connection(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is not None:
+            conn[1].close()
+            conn[0].close()
+
+    def request(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        data = json.dumps(payload).encode("utf-8") + b"\n"
+        # A pooled connection may have been closed by a sidecar restart;
+        # retry once on a fresh one
+        for attempt in range(2):
+            try:
+                sock, reader = self._connection()
+                sock.sendall(data)
+                line = reader.readline()
+                if not line:
+                    raise ConnectionError("sidecar closed the connection")
+                break
+            except socket.timeout as e:
+                self._drop_connection()
+                raise SidecarError(f"emotion sidecar timed out: {e}")
+            except OSError as e:
+                self._drop_connection()
+                if attempt:
+                    raise SidecarError(f"emotion sidecar unavailable at {self.socket_path}: {e}")
+        response = json.loads(line)
+        if "error" in response:
+            raise SidecarError(response["error"])
+        return response
+
+    def classify(self, texts: List[str]) -> List[str]:
+        return self.request({"op": "classify", "texts": list(texts)})["emotions"]
+
+    def health(self) -> Dict[str, Any]:
+        return self.request({"op": "health"})
+
+    def close(self) -> None:
+        self._drop_connection()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Emotion classifier sidecar")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_serve = sub.add_parser("serve", help="Load the model and serve requests")
+    p_serve.add_argument("--socket", default=os.environ.get("EMOTION_SIDECAR_SOCKET", DEFAULT_SOCKET))
+    p_serve.add_argument("--workers", type=int,
+                         default=int(os.environ.get("EMOTION_SIDECAR_WORKERS", 1)))
+    p_serve.add_argument("--no-warmup", action="store_true",
+                         help="Load the model on the first request instead of at start")
+
+    p_health = sub.add_parser("health", help="Exit 0 if the sidecar answers a health check")
+    p_health.add_argument("--socket", default=os.environ.get("EMOTION_SIDECAR_SOCKET", DEFAULT_SOCKET))
+    p_health.add_argument("--timeout", type=float, default=5.0)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    if args.command == "health":
+        try:
+            print(json.dumps(SidecarClient(args.socket, args.timeout).health()))
+        except (SidecarError, ValueError) as e:
+            print(f"unhealthy: {e}", file=sys.stderr)
+            sys.exit(1)
+        return
+
+    server = EmotionSidecarServer(args.socket, workers=args.workers)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    if not args.no_warmup:
+        server.emotion_model.warmup()
+    logger.info("Emotion sidecar (%s backend, %d workers) listening on %s",
+                server.emotion_model.BACKEND, args.workers, args.socket)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
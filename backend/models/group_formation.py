@@ -0,0 +1,298 @@
+"""
+Capacity-bounded peer group formation over analysis tag vectors.
+
+Each member is embedded as their tag vector (from ``TagVocabulary``) plus
+scaled risk level and peer-support comfort. Members are partitioned by
+location, then clustered in two levels so large cohorts stay tractable:
+
+1. mini-batch k-means splits a location into coarse clusters of roughly
+   ``coarse_groups`` groups' worth of members, and clusters k-means cannot
+   separate (e.g. many identical profiles) are split further, so no coarse
+   cluster exceeds ``max_cluster_size``;
+2. each coarse cluster is split into groups of at most ``capacity`` members
+   by k-means followed by a greedy capacity-constrained assignment.
+
+New members can be placed with ``assign`` without re-clustering anyone.
+"""
+
+import itertools
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from models.tag_index import TagVocabulary, analysis_tags
+
+RISK_ORDER = {'Low': 0, 'Medium': 1, 'High': 2, 'Critical': 3}
+REMOTE_LOCATION = "Remote"
+
+
+@dataclass
+class PeerGroup:
+    """One capacity-bounded peer group"""
+    group_id: int
+    location: str
+    name: str
+    member_ids: List[Hashable] = field(default_factory=list)
+    centroid: Optional[np.ndarray] = None
+    risk_level: str = 'Low'
+    top_tags: List[str] = field(default_factory=list)
+
+    @property
+    def size(self) -> int:
+        return len(self.member_ids)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'group_id': self.group_id,
+            'name': self.name,
+            'location': self.location,
+            'member_ids': list(self.member_ids),
+            'risk_level': self.risk_level,
+            'top_tags': list(self.top_tags),
+        }
+
+
+def _sq_distances(X: np.ndarray, C: np.ndarray) -> np.ndarray:
+    d = (X * X).sum(1)[:, None] - 2 * X @ C.T + (C * C).sum(1)[None, :]
+    return np.maximum(d, 0)
+
+
+def _nearest(X: np.ndarray, C: np.ndarray, chunk: int = 4096) -> np.ndarray:
+    """Index of the nearest centroid for each row, computed in bounded-memory chunks"""
+    labels = np.empty(len(X), dtype=np.int64)
+    for start in range(0, len(X), chunk):
+        labels[start:start + chunk] = _sq_distances(X[start:start + chunk], C).argmin(1)
+    return labels
+
+
+def minibatch_kmeans(X: np.ndarray, k: int, rng: np.random.Generator,
+                     batch_size: int = 1024, n_iter: int = 50) -> np.ndarray:
+    """Mini-batch k-means (Sculley, 2010); returns the centroids"""
+    n = len(X)
+    k = max(1, min(k, n))
+    centers = X[rng.choice(n, size=k, replace=False)].astype(np.float64)
+    counts = np.zeros(k)
+    batch_size = min(batch_size, n)
+
+    for _ in range(n_iter):
+        batch = X[rng.integers(0, n, size=batch_size)] if batch_size < n else X
+        labels = _nearest(batch, centers)
+        batch_counts = np.bincount(labels, minlength=k).astype(np.float64)
+        sums = np.zeros_like(centers)
+        np.add.at(sums, labels, batch)
+        counts += batch_counts
+        hit = batch_counts > 0
+        centers[hit] += (sums[hit] - batch_counts[hit, None] * centers[hit]) / counts[hit, None]
+    return centers
+
+
+def capacity_assign(X: np.ndarray, centers: np.ndarray, capacity: int) -> np.ndarray:
+    """Greedy nearest-first assignment with at most ``capacity`` rows per centroid"""
+    n, k = len(X), len(centers)
+    distances = _sq_distances(X, centers)
+    labels = np.full(n, -1, dtype=np.int64)
+    load = np.zeros(k, dtype=np.int64)
+    for flat in np.argsort(distances, axis=None, kind='stable'):
+        row, col = divmod(int(flat), k)
+        if labels[row] == -1 and load[col] < capacity:
+            labels[row] = col
+            load[col] += 1
+    return labels
+
+
+class GroupFormationEngine:
+    """Forms and maintains capacity-bounded peer groups"""
+
+    def __init__(self, vocabulary: TagVocabulary, capacity: int = 12, coarse_groups: int = 16,
+                 tag_weight: float = 1.0, risk_weight: float = 2.0, comfort_weight: float = 1.0,
+                 random_state: int = 0):
+        """
+        Args:
+            vocabulary: Compiled tag vocabulary used for the tag vectors
+            capacity: Maximum members per group
+            coarse_groups: Groups per coarse cluster in the first clustering level
+            tag_weight: Feature weight of each tag
+            risk_weight: Feature weight of the risk level
+            comfort_weight: Feature weight of peer-support comfort
+            random_state: Seed for reproducible clustering
+        """
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.vocabulary = vocabulary
+        self.capacity = capacity
+        self.coarse_groups = coarse_groups
+        self.tag_weight = tag_weight
+        self.risk_weight = risk_weight
+        self.comfort_weight = comfort_weight
+        self.rng = np.random.default_rng(random_state)
+
+        self.groups: Dict[int, PeerGroup] = {}
+        self.member_group: Dict[Hashable, int] = {}
+        self._group_ids = itertools.count(1)
+        self._sums: Dict[int, np.ndarray] = {}
+        self._risks: Dict[int, Counter] = {}
+        # Each member's contribution, so they can leave a group later
+        self._members: Dict[Hashable, Tuple[np.ndarray, str]] = {}
+
+    @staticmethod
+    def location_key(profile) -> str:
+        return (getattr(profile, 'city', '') or '').strip().title() or REMOTE_LOCATION
+
+    def featurize(self, profiles: Sequence, analyses: Sequence[Dict[str, Any]]) -> np.ndarray:
+        """(N, len(vocab) + 2) feature matrix for members"""
+        tags = self.vocabulary.to_dense(
+            self.vocabulary.encode_batch([analysis_tags(a) for a in analyses])
+        ).astype(np.float64) * self.tag_weight
+        risk = np.array([RISK_ORDER.get(a.get('risk_level'), 1) for a in analyses],
+                        dtype=np.float64) / 3 * self.risk_weight
+        comfort = np.array([min(max(getattr(p, 'comfort_level_peer_support', 3) or 3, 1), 5)
+                            for p in profiles], dtype=np.float64)
+        comfort = (comfort - 1) / 4 * self.comfort_weight
+        return np.column_stack([tags, risk, comfort])
+
+    def form_groups(self, member_ids: Sequence[Hashable], profiles: Sequence,
+                    analyses: Sequence[Dict[str, Any]]) -> List[PeerGroup]:
+        """
+        Cluster members into peer groups, replacing any existing groups
+
+        Args:
+            member_ids: Stable identifier per member (e.g. user ID or email)
+            profiles: VeteranProfile per member
+            analyses: Analysis per member
+
+        Returns:
+            The newly formed groups
+        """
+        self.groups.clear()
+        self.member_group.clear()
+        self._sums.clear()
+        self._risks.clear()
+        self._members.clear()
+        if not member_ids:
+            return []
+
+        X = self.featurize(profiles, analyses)
+        risks = [a.get('risk_level', 'Medium') for a in analyses]
+        by_location: Dict[str, List[int]] = {}
+        for row, profile in enumerate(profiles):
+            by_location.setdefault(self.location_key(profile), []).append(row)
+
+        for location, rows in by_location.items():
+            rows = np.array(rows)
+            for cluster_rows in self._coarse_clusters(X[rows]):
+                self._split_cluster(location, rows[cluster_rows], X, member_ids, risks)
+        return list(self.groups.values())
+
+    @property
+    def max_cluster_size(self) -> int:
+        # capacity_assign 为每个粗簇建立 n×k 的距离矩阵，粗簇大小必须有上限
+        return 2 * self.capacity * self.coarse_groups
+
+    def _coarse_clusters(self, X: np.ndarray) -> List[np.ndarray]:
+        """Row indices of coarse clusters, none larger than ``max_cluster_size``"""
+        target = self.capacity * self.coarse_groups
+        n_coarse = -(-len(X) // target)
+        if n_coarse <= 1:
+            return [np.arange(len(X))]
+        centers = minibatch_kmeans(X, n_coarse, self.rng)
+        labels = _nearest(X, centers)
+        clusters = []
+        for c in range(len(centers)):
+            rows = np.flatnonzero(labels == c)
+            if len(rows) <= self.max_cluster_size:
+                if len(rows):
+                    clusters.append(rows)
+            elif len(rows) <= len(X) // 2:
+                clusters.extend(rows[sub] for sub in self._coarse_clusters(X[rows]))
+            else:
+                # k-means 没能分开（例如大量相同的资料）：沿方差最大的特征切成 target 大小的块，
+                # 块大小是 capacity 的整数倍，不会多出未满的小组
+                order = np.argsort(X[rows, X[rows].var(0).argmax()], kind='stable')
+                clusters.extend(rows[order[i:i + target]] for i in range(0, len(rows), target))
+        return clusters
+
+    def _split_cluster(self, location: str, rows: np.ndarray, X: np.ndarray,
+                       member_ids: Sequence[Hashable], risks: List[str]) -> None:
+        Xc = X[rows]
+        k = -(-len(rows) // self.capacity)
+        centers = minibatch_kmeans(Xc, k, self.rng, batch_size=len(Xc), n_iter=10)
+        labels = capacity_assign(Xc, centers, self.capacity)
+        for c in range(len(centers)):
+            members = rows[labels == c]
+            if len(members) == 0:
+                continue
+            group = self._new_group(location)
+            for row in members:
+                self._add_member(group, member_ids[row], X[row], risks[row])
+            self._refresh_group(group)
+
+    def _new_group(self, location: str) -> PeerGroup:
+        group = PeerGroup(group_id=next(self._group_ids), location=location, name="")
+        self.groups[group.group_id] = group
+        self._sums[group.group_id] = np.zeros(len(self.vocabulary) + 2)
+        self._risks[group.group_id] = Counter()
+        return group
+
+    def _add_member(self, group: PeerGroup, member_id: Hashable, x: np.ndarray, risk: str) -> None:
+        group.member_ids.append(member_id)
+        self.member_group[member_id] = group.group_id
+        self._sums[group.group_id] += x
+        self._risks[group.group_id][risk] += 1
+        self._members[member_id] = (x.astype(np.float32), risk)
+
+    def _refresh_group(self, group: PeerGroup) -> None:
+        """Recompute centroid, label and summary after membership changes"""
+        group.centroid = self._sums[group.group_id] / group.size
+        tag_means = group.centroid[:len(self.vocabulary)] / (self.tag_weight or 1)
+        top = [i for i in np.argsort(-tag_means, kind='stable')[:2] if tag_means[i] >= 0.5]
+        group.top_tags = [self.vocabulary.tags[i] for i in top]
+        group.risk_level = max(self._risks[group.group_id], key=lambda r: RISK_ORDER.get(r, 1))
+        focus = " & ".join(group.top_tags) or "Veterans"
+        group.name = f"{group.location} {focus} Peer Group {group.group_id}"
+
+    def assign(self, member_id: Hashable, profile, analysis: Dict[str, Any]) -> PeerGroup:
+        """
+        Place one new member without re-clustering
+
+        The member joins the nearest group in their location that still has
+        room, or starts a new group if every local group is full.
+        """
+        if member_id in self.member_group:
+            self.remove(member_id)
+
+        x = self.featurize([profile], [analysis])[0]
+        location = self.location_key(profile)
+        open_groups = [g for g in self.groups.values()
+                       if g.location == location and g.size < self.capacity]
+        if open_groups:
+            centers = np.stack([g.centroid for g in open_groups])
+            group = open_groups[int(_sq_distances(x[None, :], centers).argmin())]
+        else:
+            group = self._new_group(location)
+
+        self._add_member(group, member_id, x, analysis.get('risk_level', 'Medium'))
+        self._refresh_group(group)
+        return group
+
+    def remove(self, member_id: Hashable) -> None:
+        """Drop a member from their group; empty groups are deleted"""
+        group_id = self.member_group.pop(member_id, None)
+        if group_id is None:
+            return
+        group = self.groups[group_id]
+        group.member_ids.remove(member_id)
+        x, risk = self._members.pop(member_id)
+        if not group.member_ids:
+            del self.groups[group_id], self._sums[group_id], self._risks[group_id]
+            return
+        self._sums[group_id] -= x
+        self._risks[group_id][risk] -= 1
+        if self._risks[group_id][risk] <= 0:
+            del self._risks[group_id][risk]
+        self._refresh_group(group)
+
+    def group_for(self, member_id: Hashable) -> Optional[PeerGroup]:
+        group_id = self.member_group.get(member_id)
+        return self.groups.get(group_id) if group_id is not None else None
@@ -0,0 +1,268 @@
+"""
+Response cache for Llama generations.
+
+``TwoTierCache`` keeps hot entries in an in-process LRU (``MemoryLRUCache``)
+and persists everything to SQLite (``SQLiteCache``) so results survive
+restarts. Entries are keyed on the model, system prompt, prompt,
+generation options and output format, and expire by TTL or are evicted by
+size.
+"""
+
+import asyncio
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+
+from models import metrics
+
+_WHITESPACE_RE = re.compile(r"[ \t]+")
+
+
+def normalize_prompt(text: str) -> str:
+    """Collapse insignificant whitespace so equivalent prompts share a key"""
+    lines = (_WHITESPACE_RE.sub(" ", line).strip() for line in text.strip().splitlines())
+    return "\n".join(lines)
+
+
+def make_cache_key(model_name: str, system_prompt: str, prompt: str,
+                   options: Optional[Dict[str, Any]] = None,
+                   output_format: Optional[Any] = None) -> str:
+    """
+    Stable cache key for one generation request
+
+    ``output_format`` is the request's ``format`` (a JSON schema or "json"):
+    a response generated under one schema is not valid for another.
+    """
+    parts = [model_name, normalize_prompt(system_prompt), normalize_prompt(prompt), options or {}]
+    if output_format is not None:
+        # Appended only when set, so keys of free-text requests are unchanged
+        parts.append(output_format)
+    material = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class CacheStats:
+    """Hit/miss counters"""
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.memory_hits + self.disk_hits + self.misses
+        return (self.memory_hits + self.disk_hits) / total if total else 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data["hit_ratio"] = self.hit_ratio
+        return data
+
+
+class MemoryLRUCache:
+    """Thread-safe in-memory LRU with optional TTL"""
+
+    def __init__(self, max_entries: int = 1024, ttl: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, created_at = item
+            if self.ttl is not None and time.time() - created_at > self.ttl:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, created_at: Optional[float] = None) -> None:
+        with self._lock:
+            self._data[key] = (value, created_at if created_at is not None else time.time())
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteCache:
+    """On-disk cache backed by a single SQLite table"""
+
+    # Eviction scans the table, so it runs once per this many writes
+    EVICT_EVERY = 64
+
+    def __init__(self, path: Union[str, Path], max_entries: int = 100_000,
+                 ttl: Optional[float] = None):
+        self.path = str(path)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evictions = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS llm_cache_accessed_at ON llm_cache (accessed_at)"
+        )
+
+    def get_with_timestamp(self, key: str) -> Optional[tuple]:
+        """Return (value, created_at) or None"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if self.ttl is not None and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            return row
+
+    def get(self, key: str) -> Optional[str]:
+        row = self.get_with_timestamp(key)
+        return row[0] if row else None
+
+    def set(self, key: str, value: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, created_at, accessed_at)"
+                " VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            self._writes += 1
+            if self._writes % self.EVICT_EVERY == 0:
+                self._evict()
+
+    def _evict(self) -> None:
+        if self.ttl is not None:
+            cur = self._conn.execute(
+                "DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl,)
+            )
+            self.evictions += cur.rowcount
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            cur = self._conn.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                " SELECT key FROM llm_cache ORDER BY accessed_at ASC LIMIT ?)",
+                (overflow,),
+            )
+            self.evictions += cur.rowcount
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class TwoTierCache:
+    """In-memory LRU in front of an optional SQLite cache"""
+
+    _LOOKUP_RESULTS = {"memory_hits": "memory_hit", "disk_hits": "disk_hit", "misses": "miss"}
+
+    def __init__(self, memory: Optional[MemoryLRUCache] = None,
+                 disk: Optional[SQLiteCache] = None):
+        self.memory = memory if memory is not None else MemoryLRUCache()
+        self.disk = disk
+        self.stats = CacheStats()
+        self._stats_lock = threading.Lock()
+
+    @classmethod
+    def create(cls, path: Optional[Union[str, Path]] = None, memory_entries: int = 1024,
+               disk_entries: int = 100_000, ttl: Optional[float] = 7 * 24 * 3600) -> "TwoTierCache":
+        """Build a cache; ``path=None`` keeps it memory-only"""
+        disk = SQLiteCache(path, max_entries=disk_entries, ttl=ttl) if path else None
+        return cls(MemoryLRUCache(max_entries=memory_entries, ttl=ttl), disk)
+
+    def _count(self, field: str) -> None:
+        with self._stats_lock:
+            setattr(self.stats, field, getattr(self.stats, field) + 1)
+        metrics.increment("llm_cache_lookups_total", labels={"result": self._LOOKUP_RESULTS[field]})
+
+    def get(self, key: str) -> Optional[str]:
+        value = self._memory_get(key)
+        if value is None and self.disk is not None:
+            value = self._disk_get(key)
+        return value
+
+    async def aget(self, key: str) -> Optional[str]:
+        """``get`` for event loops: memory hits return at once, SQLite lookups run on a thread"""
+        value = self._memory_get(key)
+        if value is None and self.disk is not None:
+            value = await asyncio.to_thread(self._disk_get, key)
+        return value
+
+    def _memory_get(self, key: str) -> Optional[str]:
+        value = self.memory.get(key)
+        if value is not None:
+            self._count("memory_hits")
+        elif self.disk is None:
+            self._count("misses")
+        return value
+
+    def _disk_get(self, key: str) -> Optional[str]:
+        row = self.disk.get_with_timestamp(key)
+        if row is None:
+            self._count("misses")
+            return None
+        self._count("disk_hits")
+        # Promote, keeping the original creation time so the TTL still applies
+        self.memory.set(key, row[0], created_at=row[1])
+        return row[0]
+
+    def set(self, key: str, value: str) -> None:
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    async def aset(self, key: str, value: str) -> None:
+        """``set`` for event loops; the SQLite write runs on a thread"""
+        self.memory.set(key, value)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.set, key, value)
+
+    def get_stats(self) -> Dict[str, Any]:
+        data = self.stats.as_dict()
+        data["evictions"] = self.memory.evictions + (self.disk.evictions if self.disk else 0)
+        data["memory_entries"] = len(self.memory)
+        return data
+
+    def clear(self) -> None:
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def close(self) -> None:
+        if self.disk is not None:
+            self.disk.close()
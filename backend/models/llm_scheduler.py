@@ -0,0 +1,261 @@
+"""
+Priority scheduling for requests to the LLM backend.
+
+``LLMScheduler`` hands out a bounded number of request slots. Waiting
+requests are ordered by priority class, highest first:
+
+- ``crisis``: crisis-flagged profiles (pre-triage crisis route, which
+  includes the "hopeless" wording the action map sends to the crisis
+  protocol, or crisis-weight tags). They are always served first and
+  may use ``crisis_reserve`` extra slots, so they never wait for
+  routine work to finish
+- ``intake``: first analysis of a new user
+- ``outreach``: outreach message generation
+- ``background``: re-analysis and batch re-grouping
+
+Each class has its own heap keyed on a virtual deadline,
+``enqueued_at + rank * aging_seconds``. A lower class therefore moves
+ahead of higher-class work that arrived ``aging_seconds`` per rank
+later, so it cannot starve. Each class also has a concurrency limit.
+
+Code that knows the class of the work it is doing wraps it in
+``priority_scope``; the class is kept in a context variable, so it does
+not have to be passed through every call down to the HTTP request.
+
+A scheduler only orders the requests of its own process; size
+``max_concurrency`` per process so that all processes together match
+the parallelism of the backend.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from models import metrics
+from models.llm_transport import LlamaTransportError
+
+logger = logging.getLogger(__name__)
+
+CRISIS = "crisis"
+INTAKE = "intake"
+OUTREACH = "outreach"
+BACKGROUND = "background"
+PRIORITY_CLASSES = (CRISIS, INTAKE, OUTREACH, BACKGROUND)   # highest first
+
+_current_priority: ContextVar[Optional[str]] = ContextVar("llm_priority", default=None)
+
+
+def current_priority(default: str = INTAKE) -> str:
+    """Priority class set by the innermost ``priority_scope``, or ``default``"""
+    return _current_priority.get() or default
+
+
+def priority_is_set() -> bool:
+    return _current_priority.get() is not None
+
+
+@contextmanager
+def priority_scope(priority: str) -> Iterator[None]:
+    """Run the enclosed LLM calls in ``priority`` class"""
+    if priority not in PRIORITY_CLASSES:
+        raise ValueError(f"Unknown priority class: {priority}")
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+class SchedulerTimeout(LlamaTransportError):
+    """Waited longer than ``max_wait`` for a slot"""
+
+
+class _Ticket:
+    __slots__ = ("priority", "enqueued_at", "granted", "cancelled", "event", "loop", "future")
+
+    def __init__(self, priority: str, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+        self.cancelled = False
+        self.loop = loop
+        self.future = loop.create_future() if loop is not None else None
+        self.event = threading.Event() if loop is None else None
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class LLMScheduler:
+    """Bounded, priority-ordered admission of LLM requests (sync and asyncio)"""
+
+    def __init__(self, max_concurrency: int = 4, class_limits: Optional[Dict[str, int]] = None,
+                 aging_seconds: float = 30.0, crisis_reserve: int = 1,
+                 max_wait: Optional[float] = None):
+        """
+        Args:
+            max_concurrency: Slots shared by all classes
+            class_limits: Per-class slot limits; by default every class may use
+                all slots except ``background``, which gets half
+            aging_seconds: Waiting time that makes up for one priority rank
+            crisis_reserve: Extra slots only crisis requests may use
+            max_wait: Give up with ``SchedulerTimeout`` after this many seconds
+                (None waits indefinitely)
+        """
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        self.max_concurrency = max_concurrency
+        self.aging_seconds = aging_seconds
+        self.crisis_reserve = max(crisis_reserve, 0)
+        self.max_wait = max_wait
+        self.class_limits = {priority: max_concurrency for priority in PRIORITY_CLASSES}
+        self.class_limits[CRISIS] = max_concurrency + self.crisis_reserve
+        self.class_limits[BACKGROUND] = max(1, max_concurrency // 2)
+        for priority, limit in (class_limits or {}).items():
+            if priority not in PRIORITY_CLASSES:
+                raise ValueError(f"Unknown priority class: {priority}")
+            self.class_limits[priority] = max(int(limit), 1)
+
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self._queues: Dict[str, List[Tuple[float, int, _Ticket]]] = {p: [] for p in PRIORITY_CLASSES}
+        self._waiting = {priority: 0 for priority in PRIORITY_CLASSES}
+        self._active = {priority: 0 for priority in PRIORITY_CLASSES}
+
+    # ---------- bookkeeping (call with the lock held) ----------
+    def _has_capacity(self, priority: str) -> bool:
+        if self._active[priority] >= self.class_limits[priority]:
+            return False
+        limit = self.max_concurrency + (self.crisis_reserve if priority == CRISIS else 0)
+        return sum(self._active.values()) < limit
+
+    def _publish(self, priority: str) -> None:
+        labels = {"class": priority}
+        metrics.set_gauge("llm_scheduler_queue_depth", self._waiting[priority], labels)
+        metrics.set_gauge("llm_scheduler_in_flight", self._active[priority], labels)
+
+    def _grant(self, ticket: _Ticket) -> None:
+        ticket.granted = True
+        self._waiting[ticket.priority] -= 1
+        self._active[ticket.priority] += 1
+        self._publish(ticket.priority)
+        metrics.observe("llm_scheduler_wait_seconds", time.monotonic() - ticket.enqueued_at,
+                        {"class": ticket.priority})
+        if ticket.future is not None:
+            ticket.loop.call_soon_threadsafe(_resolve, ticket.future)
+        else:
+            ticket.event.set()
+
+    def _dispatch(self) -> None:
+        """Grant free slots to the most urgent eligible waiters"""
+        while True:
+            best = None
+            for priority in PRIORITY_CLASSES:
+                queue = self._queues[priority]
+                while queue and queue[0][2].cancelled:
+                    heapq.heappop(queue)
+                if not queue or not self._has_capacity(priority):
+                    continue
+                if priority == CRISIS:
+                    best = priority
+                    break
+                if best is None or queue[0] < self._queues[best][0]:
+                    best = priority
+            if best is None:
+                return
+            self._grant(heapq.heappop(self._queues[best])[2])
+
+    def _enqueue(self, ticket: _Ticket) -> None:
+        rank = PRIORITY_CLASSES.index(ticket.priority)
+        deadline = ticket.enqueued_at + rank * self.aging_seconds
+        with self._lock:
+            heapq.heappush(self._queues[ticket.priority], (deadline, next(self._seq), ticket))
+            self._waiting[ticket.priority] += 1
+            self._dispatch()
+            if not ticket.granted:
+                self._publish(ticket.priority)
+
+    def _withdraw(self, ticket: _Ticket) -> bool:
+        """Stop waiting; returns True if the slot was granted in the meantime"""
+        with self._lock:
+            if ticket.granted:
+                return True
+            ticket.cancelled = True
+            self._waiting[ticket.priority] -= 1
+            self._publish(ticket.priority)
+            return False
+
+    def _release_locked(self, ticket: _Ticket) -> None:
+        self._active[ticket.priority] -= 1
+        self._dispatch()
+        self._publish(ticket.priority)
+
+    def _timed_out(self, ticket: _Ticket, wait: Optional[float]) -> SchedulerTimeout:
+        metrics.increment("llm_scheduler_timeouts_total", labels={"class": ticket.priority})
+        logger.warning("Gave up on an LLM slot for %s work after %.1fs", ticket.priority, wait)
+        return SchedulerTimeout(f"No LLM slot for {ticket.priority} work within {wait}s")
+
+    # ---------- public API ----------
+    def acquire(self, priority: Optional[str] = None, timeout: Optional[float] = None) -> _Ticket:
+        """Block until a slot is free; pair with ``release``"""
+        ticket = _Ticket(priority or current_priority())
+        if ticket.priority not in PRIORITY_CLASSES:
+            raise ValueError(f"Unknown priority class: {ticket.priority}")
+        wait = timeout if timeout is not None else self.max_wait
+        self._enqueue(ticket)
+        if not ticket.event.wait(wait) and not self._withdraw(ticket):
+            raise self._timed_out(ticket, wait)
+        return ticket
+
+    def release(self, ticket: _Ticket) -> None:
+        with self._lock:
+            self._release_locked(ticket)
+
+    @contextmanager
+    def slot(self, priority: Optional[str] = None, timeout: Optional[float] = None) -> Iterator[None]:
+        """Hold a slot for the enclosed block"""
+        ticket = self.acquire(priority, timeout)
+        try:
+            yield
+        finally:
+            self.release(ticket)
+
+    @asynccontextmanager
+    async def aslot(self, priority: Optional[str] = None,
+                    timeout: Optional[float] = None) -> AsyncIterator[None]:
+        """Asyncio counterpart of ``slot``; waiting does not block the event loop"""
+        ticket = _Ticket(priority or current_priority(), asyncio.get_running_loop())
+        if ticket.priority not in PRIORITY_CLASSES:
+            raise ValueError(f"Unknown priority class: {ticket.priority}")
+        wait = timeout if timeout is not None else self.max_wait
+        self._enqueue(ticket)
+        if not ticket.granted:
+            try:
+                await asyncio.wait_for(asyncio.shield(ticket.future), wait)
+            except asyncio.TimeoutError:
+                if not self._withdraw(ticket):
+                    raise self._timed_out(ticket, wait) from None
+            except asyncio.CancelledError:
+                if self._withdraw(ticket):
+                    self.release(ticket)
+                raise
+        try:
+            yield
+        finally:
+            self.release(ticket)
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        """Waiting, in-flight and limit per class"""
+        with self._lock:
+            return {priority: {"waiting": self._waiting[priority],
+                               "in_flight": self._active[priority],
+                               "limit": self.class_limits[priority]}
+                    for priority in PRIORITY_CLASSES}
@@ -0,0 +1,370 @@
+"""
+HTTP transports for talking to the Ollama API.
+
+``SyncTransport`` wraps a pooled ``requests.Session`` and ``AsyncTransport``
+wraps an ``httpx.AsyncClient``. Both keep connections alive between calls,
+retry 5xx responses and connection errors with jittered exponential backoff,
+and enforce a per-call deadline that covers every attempt and the reading of
+the response body: socket timeouts only bound a single read, so the deadline
+is also checked between chunks.
+"""
+
+import asyncio
+import json
+import logging
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 8192
+
+
+class LlamaTransportError(Exception):
+    """Raised when a request to Ollama fails after all retries"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+@dataclass
+class RetryPolicy:
+    """Jittered exponential backoff settings"""
+    max_retries: int = 3
+    backoff_base: float = 0.5
+    backoff_max: float = 8.0
+    retry_statuses: Tuple[int, ...] = (500, 502, 503, 504)
+
+    def delay(self, attempt: int) -> float:
+        """Full-jitter delay before retry number ``attempt`` (0-based)"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+
+@dataclass
+class TokenUsage:
+    """Running totals of the token counts Ollama reports on each finished generation"""
+    calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    prompt_eval_ms: float = 0.0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def record(self, data: Dict[str, Any]) -> None:
+        """Add the counters from a final (``done``) Ollama response object"""
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += data.get("prompt_eval_count") or 0
+            self.completion_tokens += data.get("eval_count") or 0
+            self.prompt_eval_ms += (data.get("prompt_eval_duration") or 0) / 1e6
+
+    @property
+    def mean_prompt_tokens(self) -> float:
+        return self.prompt_tokens / self.calls if self.calls else 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "prompt_eval_ms": round(self.prompt_eval_ms, 1),
+                "mean_prompt_tokens": round(self.mean_prompt_tokens, 1),
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self.calls = self.prompt_tokens = self.completion_tokens = 0
+            self.prompt_eval_ms = 0.0
+
+
+class _Deadline:
+    """Wall-clock budget shared by all attempts of one call"""
+
+    def __init__(self, timeout: float):
+        self.expires_at = time.monotonic() + timeout
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def allows(self, delay: float) -> bool:
+        return self.remaining() - delay > 0
+
+    def check(self, url: str) -> None:
+        """Raise once the budget is spent, e.g. by a server trickling its response"""
+        if self.remaining() <= 0:
+            raise LlamaTransportError(f"Deadline exceeded reading from {url}")
+
+
+class SyncTransport:
+    """Pooled keep-alive transport built on ``requests.Session``"""
+
+    def __init__(self, endpoint: str, pool_size: int = 10, timeout: float = 30.0,
+                 connect_timeout: float = 5.0, retry_policy: Optional[RetryPolicy] = None):
+        """
+        Args:
+            endpoint: Base URL of the Ollama server
+            pool_size: Maximum number of pooled keep-alive connections
+            timeout: Default per-call deadline in seconds, across all retries
+            connect_timeout: Timeout for establishing a single connection
+            retry_policy: Backoff settings (defaults to ``RetryPolicy()``)
+        """
+        self.endpoint = endpoint.rstrip("/")
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.retry_policy = retry_policy or RetryPolicy()
+
+        self.session = requests.Session()
+        # Retries are handled here so they can respect the call deadline
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Content-Type": "application/json"})
+
+    def post_json(self, path: str, payload: Dict[str, Any],
+                  timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        POST ``payload`` and return the decoded JSON body
+
+        Raises:
+            LlamaTransportError: on a non-retryable error, or when retries or
+                the deadline are exhausted
+        """
+        deadline = self._deadline(timeout)
+        response = self._request_with_retries(path, payload, deadline)
+        try:
+            chunks = []
+            for chunk in response.iter_content(CHUNK_SIZE):
+                deadline.check(response.url)
+                chunks.append(chunk)
+        except requests.exceptions.RequestException as e:
+            raise LlamaTransportError(f"Error reading from Ollama: {e}") from e
+        finally:
+            response.close()
+        try:
+            return json.loads(b"".join(chunks))
+        except ValueError as e:
+            raise LlamaTransportError(f"Invalid JSON from Ollama: {e}") from e
+
+    def stream_json_lines(self, path: str, payload: Dict[str, Any],
+                          timeout: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+        """
+        POST ``payload`` and yield each NDJSON object as it arrives
+
+        Retries only happen before the response starts; once lines have been
+        yielded a failure is raised to the caller. Closing the generator
+        closes the underlying connection, which aborts the generation.
+        """
+        deadline = self._deadline(timeout)
+        response = self._request_with_retries(path, payload, deadline)
+        try:
+            for line in response.iter_lines():
+                deadline.check(response.url)
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError as e:
+                    raise LlamaTransportError(f"Invalid JSON line from Ollama: {e}") from e
+        except requests.exceptions.RequestException as e:
+            raise LlamaTransportError(f"Stream from Ollama interrupted: {e}") from e
+        finally:
+            response.close()
+
+    def _deadline(self, timeout: Optional[float]) -> _Deadline:
+        return _Deadline(timeout if timeout is not None else self.timeout)
+
+    def _request_with_retries(self, path: str, payload: Dict[str, Any],
+                              deadline: _Deadline) -> requests.Response:
+        url = f"{self.endpoint}{path}"
+        policy = self.retry_policy
+        attempt = 0
+
+        while True:
+            remaining = deadline.remaining()
+            if remaining <= 0:
+                raise LlamaTransportError(f"Deadline exceeded calling {url}")
+
+            try:
+                response = self.session.post(
+                    url, json=payload, stream=True,
+                    timeout=(min(self.connect_timeout, remaining), remaining),
+                )
+            except (requests.exceptions.ConnectionError, requests.exceptions.ConnectTimeout) as e:
+                error, status = e, None
+            except requests.exceptions.RequestException as e:
+                raise LlamaTransportError(f"Error calling {url}: {e}") from e
+            else:
+                if response.status_code == 200:
+                    return response
+                error, status = f"HTTP {response.status_code}", response.status_code
+                response.close()
+                if status not in policy.retry_statuses:
+                    raise LlamaTransportError(f"Llama API error: {status}", status_code=status)
+
+            delay = policy.delay(attempt)
+            if attempt >= policy.max_retries or not deadline.allows(delay):
+                raise LlamaTransportError(
+                    f"Giving up on {url} after {attempt + 1} attempts: {error}", status_code=status
+                )
+            logger.warning("Retrying %s in %.2fs after error: %s", url, delay, error)
+            time.sleep(delay)
+            attempt += 1
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class AsyncTransport:
+    """Pooled keep-alive transport built on ``httpx.AsyncClient``"""
+
+    def __init__(self, endpoint: str, pool_size: int = 10, timeout: float = 30.0,
+                 connect_timeout: float = 5.0, retry_policy: Optional[RetryPolicy] = None,
+                 keepalive_expiry: float = 60.0):
+        try:
+            import httpx
+        except ImportError as e:
+            raise ImportError("AsyncTransport requires httpx (pip install httpx)") from e
+
+        self._httpx = httpx
+        self.endpoint = endpoint.rstrip("/")
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.client = httpx.AsyncClient(
+            base_url=self.endpoint,
+            headers={"Content-Type": "application/json"},
+            limits=httpx.Limits(max_connections=pool_size,
+                                max_keepalive_connections=pool_size,
+                                keepalive_expiry=keepalive_expiry),
+        )
+
+    async def post_json(self, path: str, payload: Dict[str, Any],
+                        timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Async counterpart of ``SyncTransport.post_json``"""
+        deadline = self._deadline(timeout)
+        response = await self._send_with_retries(path, payload, deadline)
+        try:
+            chunks = []
+            async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                deadline.check(path)
+                chunks.append(chunk)
+        except self._httpx.HTTPError as e:
+            raise LlamaTransportError(f"Error reading from Ollama: {e}") from e
+        finally:
+            await response.aclose()
+        try:
+            return json.loads(b"".join(chunks))
+        except ValueError as e:
+            raise LlamaTransportError(f"Invalid JSON from Ollama: {e}") from e
+
+    async def stream_json_lines(self, path: str, payload: Dict[str, Any],
+                                timeout: Optional[float] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Async counterpart of ``SyncTransport.stream_json_lines``"""
+        deadline = self._deadline(timeout)
+        response = await self._send_with_retries(path, payload, deadline)
+        try:
+            async for line in response.aiter_lines():
+                deadline.check(path)
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError as e:
+                    raise LlamaTransportError(f"Invalid JSON line from Ollama: {e}") from e
+        except self._httpx.HTTPError as e:
+            raise LlamaTransportError(f"Stream from Ollama interrupted: {e}") from e
+        finally:
+            await response.aclose()
+
+    def _deadline(self, timeout: Optional[float]) -> _Deadline:
+        return _Deadline(timeout if timeout is not None else self.timeout)
+
+    async def _send_with_retries(self, path: str, payload: Dict[str, Any],
+                                 deadline: _Deadline):
+        httpx = self._httpx
+        policy = self.retry_policy
+        attempt = 0
+
+        while True:
+            remaining = deadline.remaining()
+            if remaining <= 0:
+                raise LlamaTransportError(f"Deadline exceeded calling {path}")
+
+            request = self.client.build_request(
+                "POST", path, json=payload,
+                timeout=httpx.Timeout(remaining, connect=min(self.connect_timeout, remaining)),
+            )
+            try:
+                response = await self.client.send(request, stream=True)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError) as e:
+                error, status = e, None
+            except httpx.HTTPError as e:
+                raise LlamaTransportError(f"Error calling {path}: {e}") from e
+            else:
+                if response.status_code == 200:
+                    return response
+                await response.aclose()
+                error, status = f"HTTP {response.status_code}", response.status_code
+                if status not in policy.retry_statuses:
+                    raise LlamaTransportError(f"Llama API error: {status}", status_code=status)
+
+            delay = policy.delay(attempt)
+            if attempt >= policy.max_retries or not deadline.allows(delay):
+                raise LlamaTransportError(
+                    f"Giving up on {path} after {attempt + 1} attempts: {error}", status_code=status
+                )
+            logger.warning("Retrying %s in %.2fs after error: %s", path, delay, error)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+class ThreadedAsyncTransport:
+    """Async adapter that runs a ``SyncTransport`` on worker threads
+
+    Used when httpx is not installed, so the asyncio APIs keep working.
+    A cancelled read keeps running on its thread until the call deadline at
+    the latest, so closing a stream waits for it: the generator cannot be
+    closed while it is executing.
+    """
+
+    def __init__(self, transport: SyncTransport):
+        self.transport = transport
+
+    async def post_json(self, path: str, payload: Dict[str, Any],
+                        timeout: Optional[float] = None) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.transport.post_json, path, payload, timeout)
+
+    async def stream_json_lines(self, path: str, payload: Dict[str, Any],
+                                timeout: Optional[float] = None) -> AsyncIterator[Dict[str, Any]]:
+        lines = self.transport.stream_json_lines(path, payload, timeout)
+        lock = threading.Lock()
+
+        def read():
+            with lock:
+                return next(lines, None)
+
+        def close():
+            with lock:
+                lines.close()
+
+        try:
+            while True:
+                data = await asyncio.to_thread(read)
+                if data is None:
+                    return
+                yield data
+        finally:
+            await asyncio.to_thread(close)
+
+    async def aclose(self) -> None:
+        pass
@@ -0,0 +1,262 @@
+"""
+Lightweight metrics for the grouping pipeline.
+
+Instrumented code calls the module-level helpers (``increment``,
+``observe``, ``set_gauge``, ``span``, ``record_generation``). Those fan out to every
+registered ``MetricsSink``. ``registry``, a ``PrometheusRegistry`` that
+renders the text exposition format, is always registered; more sinks
+(StatsD, OpenTelemetry, logging...) can be added with ``add_sink`` or
+listed as dotted class paths in ``GROUPER_METRICS_SINKS``.
+
+The registry is per process; with several server workers each one
+exposes its own counters, which Prometheus aggregates by instance.
+"""
+
+import bisect
+import importlib
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+Labels = Optional[Dict[str, str]]
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# name -> (type, help)
+METRICS: Dict[str, Tuple[str, str]] = {
+    "grouper_stage_seconds": ("histogram", "Time spent in each grouping pipeline stage"),
+    "llama_prompt_eval_seconds": ("histogram", "Ollama prompt evaluation time per generation"),
+    "llama_eval_seconds": ("histogram", "Ollama token generation time per generation"),
+    "llama_prompt_tokens_total": ("counter", "Prompt tokens evaluated by Ollama"),
+    "llama_eval_tokens_total": ("counter", "Tokens generated by Ollama"),
+    "llama_generations_total": ("counter", "Finished Ollama generations"),
+    "llama_request_errors_total": ("counter", "Ollama requests that failed after retries"),
+    "llama_parse_failures_total": ("counter", "Model responses that could not be used as an analysis"),
+    "llama_fallbacks_total": ("counter", "Analyses answered by the rule-based fallback"),
+    "llm_cache_lookups_total": ("counter", "LLM response cache lookups by result"),
+    "analysis_jobs_total": ("counter", "Background analysis job events"),
+    "llm_scheduler_queue_depth": ("gauge", "LLM requests waiting for a slot, by priority class"),
+    "llm_scheduler_in_flight": ("gauge", "LLM requests holding a slot, by priority class"),
+    "llm_scheduler_wait_seconds": ("histogram", "Time LLM requests waited for a slot"),
+    "llm_scheduler_timeouts_total": ("counter", "LLM requests that gave up waiting for a slot"),
+    "llm_requests_cancelled_total": ("counter", "LLM-backed requests abandoned by a disconnected client"),
+    "api_cache_requests_total": ("counter", "User/connection payload cache lookups by result"),
+    "api_cache_invalidations_total": ("counter", "User/connection payload cache invalidations"),
+    "api_cache_hit_ratio": ("gauge", "Share of payload cache lookups served from the cache"),
+}
+
+
+class MetricsSink:
+    """Receives metric events; subclasses override what they support"""
+
+    def increment(self, name: str, value: float = 1.0, labels: Labels = None) -> None:
+        pass
+
+    def observe(self, name: str, value: float, labels: Labels = None) -> None:
+        pass
+
+    def set_gauge(self, name: str, value: float, labels: Labels = None) -> None:
+        pass
+
+
+class LoggingSink(MetricsSink):
+    """Writes every event to the log at DEBUG level"""
+
+    def increment(self, name: str, value: float = 1.0, labels: Labels = None) -> None:
+        logger.debug("metric %s%s += %s", name, labels or "", value)
+
+    def observe(self, name: str, value: float, labels: Labels = None) -> None:
+        logger.debug("metric %s%s = %.6f", name, labels or "", value)
+
+    def set_gauge(self, name: str, value: float, labels: Labels = None) -> None:
+        logger.debug("metric %s%s := %s", name, labels or "", value)
+
+
+def _label_key(labels: Labels) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((labels or {}).items()))
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(key: Sequence[Tuple[str, str]], extra: Sequence[Tuple[str, str]] = ()) -> str:
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "total", "count")
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.total += value
+        self.count += 1
+
+
+class PrometheusRegistry(MetricsSink):
+    """In-memory counters, gauges and histograms rendered in Prometheus text format"""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[tuple, float]] = {}
+        self._gauges: Dict[str, Dict[tuple, float]] = {}
+        self._histograms: Dict[str, Dict[tuple, _Histogram]] = {}
+
+    def increment(self, name: str, value: float = 1.0, labels: Labels = None) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, labels: Labels = None) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = _Histogram(self.buckets)
+            histogram.observe(value)
+
+    def set_gauge(self, name: str, value: float, labels: Labels = None) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._gauges.setdefault(name, {})[key] = value
+
+    def gauge_value(self, name: str, labels: Labels = None) -> float:
+        with self._lock:
+            return self._gauges.get(name, {}).get(_label_key(labels), 0.0)
+
+    def counter_value(self, name: str, labels: Labels = None) -> float:
+        with self._lock:
+            return self._counters.get(name, {}).get(_label_key(labels), 0.0)
+
+    def histogram_count(self, name: str, labels: Labels = None) -> int:
+        with self._lock:
+            histogram = self._histograms.get(name, {}).get(_label_key(labels))
+            return histogram.count if histogram else 0
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+    def render(self) -> str:
+        """Current values in the Prometheus text exposition format (0.0.4)"""
+        lines: List[str] = []
+        with self._lock:
+            for kind, series in (("counter", self._counters), ("gauge", self._gauges)):
+                for name in sorted(series):
+                    self._header(lines, name, kind)
+                    for key, value in sorted(series[name].items()):
+                        lines.append(f"{name}{_format_labels(key)} {value:g}")
+            for name in sorted(self._histograms):
+                self._header(lines, name, "histogram")
+                for key, histogram in sorted(self._histograms[name].items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(key, [('le', f'{bound:g}')])} "
+                                     f"{cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} "
+                                 f"{histogram.count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {histogram.total:.6f}")
+                    lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _header(lines: List[str], name: str, kind: str) -> None:
+        help_text = METRICS.get(name, (kind, name))[1]
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+
+registry = PrometheusRegistry()
+_sinks: List[MetricsSink] = [registry]
+
+
+def add_sink(sink: MetricsSink) -> None:
+    if sink not in _sinks:
+        _sinks.append(sink)
+
+
+def remove_sink(sink: MetricsSink) -> None:
+    if sink is not registry and sink in _sinks:
+        _sinks.remove(sink)
+
+
+def increment(name: str, value: float = 1.0, labels: Labels = None) -> None:
+    for sink in _sinks:
+        try:
+            sink.increment(name, value, labels)
+        except Exception:
+            logger.exception("Metrics sink %r failed", sink)
+
+
+def observe(name: str, value: float, labels: Labels = None) -> None:
+    for sink in _sinks:
+        try:
+            sink.observe(name, value, labels)
+        except Exception:
+            logger.exception("Metrics sink %r failed", sink)
+
+
+def set_gauge(name: str, value: float, labels: Labels = None) -> None:
+    for sink in _sinks:
+        try:
+            sink.set_gauge(name, value, labels)
+        except Exception:
+            logger.exception("Metrics sink %r failed", sink)
+
+
+@contextmanager
+def span(stage: str, **labels: str) -> Iterator[None]:
+    """Time the enclosed block as ``grouper_stage_seconds{stage=...}``"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe("grouper_stage_seconds", time.perf_counter() - start, dict(labels, stage=stage))
+
+
+def record_generation(data: Dict[str, Any]) -> None:
+    """Record the timings and token counts from a finished Ollama response"""
+    increment("llama_generations_total")
+    if data.get("prompt_eval_count"):
+        increment("llama_prompt_tokens_total", data["prompt_eval_count"])
+    if data.get("eval_count"):
+        increment("llama_eval_tokens_total", data["eval_count"])
+    # Ollama reports durations in nanoseconds
+    if data.get("prompt_eval_duration") is not None:
+        observe("llama_prompt_eval_seconds", data["prompt_eval_duration"] / 1e9)
+    if data.get("eval_duration") is not None:
+        observe("llama_eval_seconds", data["eval_duration"] / 1e9)
+
+
+def _load_sinks_from_env() -> None:
+    for path in filter(None, (p.strip() for p in os.environ.get("GROUPER_METRICS_SINKS", "").split(","))):
+        module_name, _, class_name = path.rpartition(".")
+        try:
+            add_sink(getattr(importlib.import_module(module_name), class_name)())
+        except (ImportError, AttributeError, ValueError) as e:
+            logger.error("Could not load metrics sink %s: %s", path, e)
+
+
+_load_sinks_from_env()
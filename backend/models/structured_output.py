@@ -0,0 +1,231 @@
+"""
+Structured (schema-constrained) output for the veteran analysis.
+
+``analysis_schema`` builds the JSON schema passed as Ollama's ``format``
+parameter. ``IncrementalJSONValidator`` consumes the streamed response
+chunk by chunk, checks each top-level field against the schema as soon as
+its value is complete, and reports the object as complete the moment the
+closing brace arrives, so the caller can stop the generation right there
+instead of paying for trailing text or an invalid tail.
+"""
+
+import json
+from typing import Any, Dict, List, Optional, Sequence
+
+RISK_LEVELS = ["Critical", "High", "Medium", "Low"]
+
+PARTIAL = "partial"
+COMPLETE = "complete"
+INVALID = "invalid"
+
+# Longest response accepted before the generation is treated as runaway
+MAX_OUTPUT_CHARS = 6000
+
+
+def analysis_schema(tags: Sequence[str]) -> Dict[str, Any]:
+    """JSON schema of the analysis object, with tags restricted to ``tags``"""
+    tag_list = {"type": "array", "items": {"type": "string", "enum": list(tags)}}
+    string_list = {"type": "array", "items": {"type": "string"}}
+    return {
+        "type": "object",
+        "properties": {
+            "primary_tags": dict(tag_list, minItems=1),
+            "secondary_tags": tag_list,
+            "risk_level": {"type": "string", "enum": RISK_LEVELS},
+            "priority_score": {"type": "integer", "minimum": 1, "maximum": 20},
+            "intervention_needed": {"type": "boolean"},
+            "recommended_groups": string_list,
+            "resource_priorities": string_list,
+            "reasoning": {"type": "string"},
+        },
+        "required": [
+            "primary_tags", "secondary_tags", "risk_level", "priority_score",
+            "intervention_needed", "recommended_groups", "resource_priorities", "reasoning",
+        ],
+        "additionalProperties": False,
+    }
+
+
+_TYPES = {
+    "string": lambda v: isinstance(v, str),
+    "integer": lambda v: isinstance(v, int) and not isinstance(v, bool),
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    "boolean": lambda v: isinstance(v, bool),
+    "array": lambda v: isinstance(v, list),
+    "object": lambda v: isinstance(v, dict),
+}
+
+
+def check_value(value: Any, schema: Dict[str, Any], path: str = "") -> Optional[str]:
+    """
+    Check ``value`` against the subset of JSON schema used here
+
+    Returns:
+        A description of the first violation, or None if the value conforms
+    """
+    expected = schema.get("type")
+    if expected and not _TYPES[expected](value):
+        return f"{path or 'value'}: expected {expected}, got {type(value).__name__}"
+    if "enum" in schema and value not in schema["enum"]:
+        return f"{path or 'value'}: {value!r} is not one of the allowed values"
+    if "minimum" in schema and value < schema["minimum"]:
+        return f"{path}: {value} is below {schema['minimum']}"
+    if "maximum" in schema and value > schema["maximum"]:
+        return f"{path}: {value} is above {schema['maximum']}"
+    if expected == "array":
+        if len(value) < schema.get("minItems", 0):
+            return f"{path}: fewer than {schema['minItems']} items"
+        if "maxItems" in schema and len(value) > schema["maxItems"]:
+            return f"{path}: more than {schema['maxItems']} items"
+        for i, item in enumerate(value):
+            error = check_value(item, schema.get("items", {}), f"{path}[{i}]")
+            if error:
+                return error
+    return None
+
+
+class IncrementalJSONValidator:
+    """
+    Streaming validator for a single top-level JSON object
+
+    Call ``feed`` with each response fragment; it returns ``PARTIAL`` while
+    more input is needed, ``COMPLETE`` once the object has closed and passed
+    validation (``result`` holds it), or ``INVALID`` as soon as the output
+    can no longer become a valid object (``error`` says why).
+    """
+
+    def __init__(self, schema: Dict[str, Any], max_chars: int = MAX_OUTPUT_CHARS):
+        self.schema = schema
+        self.properties: Dict[str, Any] = schema.get("properties", {})
+        self.closed = schema.get("additionalProperties") is False
+        self.max_chars = max_chars
+
+        self.status = PARTIAL
+        self.error: Optional[str] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.seen: List[str] = []
+
+        self._chunks: List[str] = []
+        self._length = 0
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._expect_key = False
+        self._key_start: Optional[int] = None
+        self._key: Optional[str] = None
+        self._value_start: Optional[int] = None
+
+    @property
+    def text(self) -> str:
+        return "".join(self._chunks)
+
+    def feed(self, chunk: str) -> str:
+        if self.status != PARTIAL or not chunk:
+            return self.status
+        base = self._length
+        self._chunks.append(chunk)
+        self._length += len(chunk)
+        if self._length > self.max_chars:
+            return self._fail(f"output exceeded {self.max_chars} characters")
+
+        for offset, ch in enumerate(chunk):
+            pos = base + offset
+            if not self._started:
+                if ch.isspace():
+                    continue
+                if ch != "{":
+                    return self._fail(f"expected '{{' but output starts with {ch!r}")
+                self._started = True
+                self._depth = 1
+                self._expect_key = True
+                continue
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._key_start is not None:
+                        if not self._end_key(pos):
+                            return self.status
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                if self._depth == 1 and self._expect_key:
+                    self._key_start = pos
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    if self._value_start is not None and not self._end_value(pos):
+                        return self.status
+                    return self._finish(pos)
+            elif self._depth == 1:
+                if ch == ":" and self._key is not None:
+                    self._value_start = pos + 1
+                elif ch == ",":
+                    if self._value_start is None:
+                        return self._fail("malformed object")
+                    if not self._end_value(pos):
+                        return self.status
+                    self._expect_key = True
+        return self.status
+
+    def _end_key(self, pos: int) -> bool:
+        text = self.text
+        self._key = json.loads(text[self._key_start:pos + 1])
+        self._key_start = None
+        self._expect_key = False
+        if self.closed and self._key not in self.properties:
+            self._fail(f"unexpected field {self._key!r}")
+            return False
+        if self._key in self.seen:
+            self._fail(f"duplicate field {self._key!r}")
+            return False
+        return True
+
+    def _end_value(self, pos: int) -> bool:
+        raw = self.text[self._value_start:pos]
+        try:
+            value = json.loads(raw)
+        except ValueError:
+            self._fail(f"malformed value for {self._key!r}")
+            return False
+        error = check_value(value, self.properties.get(self._key, {}), self._key)
+        if error:
+            self._fail(error)
+            return False
+        self.seen.append(self._key)
+        self._key = None
+        self._value_start = None
+        return True
+
+    def _finish(self, pos: int) -> str:
+        missing = [name for name in self.schema.get("required", []) if name not in self.seen]
+        if missing:
+            return self._fail(f"missing fields: {', '.join(missing)}")
+        text = self.text
+        try:
+            self.result = json.loads(text[:pos + 1])
+        except ValueError as e:
+            return self._fail(f"malformed object: {e}")
+        # Anything after the closing brace is never kept
+        self._chunks = [text[:pos + 1]]
+        self.status = COMPLETE
+        return self.status
+
+    def finalize(self) -> str:
+        """Mark the stream as ended; an unfinished object becomes invalid"""
+        if self.status == PARTIAL:
+            self._fail("response ended before the object was complete")
+        return self.status
+
+    def _fail(self, error: str) -> str:
+        self.status = INVALID
+        self.error = error
+        return self.status
@@ -0,0 +1,127 @@
+"""
+Compiled tag vocabulary and bitset index for analysis tags.
+
+``TagVocabulary`` assigns every known tag an integer ID and a priority
+weight, so tag validation is a dict lookup and priority scoring for a whole
+batch of analyses is a single weighted bincount. ``TagIndex`` packs
+each analysis' tags into a row of uint64 words for fast set queries such as
+"all profiles tagged PTSD and Unemployed".
+"""
+
+from typing import Any, Dict, Iterable, List, Sequence
+
+import numpy as np
+
+WORD_BITS = 64
+
+
+class TagVocabulary:
+    """Immutable tag -> ID mapping with per-tag priority weights"""
+
+    def __init__(self, tags: Iterable[str], weights: Dict[str, float], default_weight: float = 1):
+        """
+        Args:
+            tags: Valid tags; duplicates are ignored, first occurrence wins
+            weights: Priority weight per tag
+            default_weight: Weight for valid tags missing from ``weights``
+        """
+        self.tags = tuple(dict.fromkeys(tags))
+        self.ids = {tag: i for i, tag in enumerate(self.tags)}
+        self.weights = np.array([weights.get(tag, default_weight) for tag in self.tags],
+                                dtype=np.float64)
+        self.n_words = max(1, -(-len(self.tags) // WORD_BITS))
+
+    def __len__(self) -> int:
+        return len(self.tags)
+
+    def __contains__(self, tag: str) -> bool:
+        return tag in self.ids
+
+    def validate(self, tags: Iterable[str]) -> List[str]:
+        """Drop tags that are not in the vocabulary, preserving order"""
+        return [tag for tag in tags if isinstance(tag, str) and tag in self.ids]
+
+    def encode(self, tags: Iterable[str]) -> np.ndarray:
+        """Bitset (``n_words`` uint64 words) of the valid tags in ``tags``"""
+        return self.encode_batch([tags])[0]
+
+    def encode_strict(self, tags: Iterable[str]) -> np.ndarray:
+        """Like ``encode``, but raises KeyError for tags not in the vocabulary"""
+        tags = list(tags)
+        unknown = [tag for tag in tags if tag not in self.ids]
+        if unknown:
+            raise KeyError(f"Unknown tag(s): {', '.join(map(str, unknown))}")
+        return self.encode(tags)
+
+    def decode(self, bits: np.ndarray) -> List[str]:
+        """Tags set in one bitset row, in vocabulary order"""
+        return [self.tags[i] for i in np.flatnonzero(self.to_dense(bits[np.newaxis, :])[0])]
+
+    def to_dense(self, bitsets: np.ndarray) -> np.ndarray:
+        """(N, n_words) bitsets -> (N, len(vocab)) boolean matrix"""
+        as_bytes = np.ascontiguousarray(bitsets, dtype='<u8').view(np.uint8)
+        dense = np.unpackbits(as_bytes, axis=1, bitorder='little')
+        return dense[:, :len(self.tags)].astype(bool)
+
+    def flatten(self, tag_lists: Sequence[Iterable[str]]):
+        """(row indices, tag IDs) of every valid tag occurrence, duplicates included"""
+        ids = self.ids
+        rows: List[int] = []
+        cols: List[int] = []
+        for row, tags in enumerate(tag_lists):
+            for tag in tags:
+                if isinstance(tag, str) and tag in ids:
+                    rows.append(row)
+                    cols.append(ids[tag])
+        return np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64)
+
+    def encode_batch(self, tag_lists: Sequence[Iterable[str]]) -> np.ndarray:
+        """(N, n_words) bitsets for a batch of tag lists"""
+        bitsets = np.zeros((len(tag_lists), self.n_words), dtype=np.uint64)
+        rows, cols = self.flatten(tag_lists)
+        np.bitwise_or.at(bitsets, (rows, cols // WORD_BITS),
+                         np.left_shift(np.uint64(1), (cols % WORD_BITS).astype(np.uint64)))
+        return bitsets
+
+    def score_batch(self, tag_lists: Sequence[Iterable[str]]) -> np.ndarray:
+        """Sum of tag weights for each row, in one vectorized pass"""
+        rows, cols = self.flatten(tag_lists)
+        return np.bincount(rows, weights=self.weights[cols], minlength=len(tag_lists))
+
+
+def analysis_tags(analysis: Dict[str, Any]) -> List[str]:
+    """All tags of an analysis, primary first"""
+    return list(analysis.get('primary_tags', [])) + list(analysis.get('secondary_tags', []))
+
+
+class TagIndex:
+    """Bitset index over the tags of a batch of analyses"""
+
+    def __init__(self, vocabulary: TagVocabulary, analyses: Sequence[Dict[str, Any]]):
+        self.vocabulary = vocabulary
+        self.bitsets = vocabulary.encode_batch([analysis_tags(a) for a in analyses])
+
+    def __len__(self) -> int:
+        return len(self.bitsets)
+
+    # Queries raise KeyError for unknown tags rather than ignoring them, which
+    # would silently widen all_of and none_of to every row
+
+    def all_of(self, tags: Iterable[str]) -> np.ndarray:
+        """Row indices whose tags include every tag in ``tags``"""
+        mask = self.vocabulary.encode_strict(tags)
+        return np.flatnonzero(((self.bitsets & mask) == mask).all(axis=1))
+
+    def any_of(self, tags: Iterable[str]) -> np.ndarray:
+        """Row indices with at least one tag in ``tags``"""
+        mask = self.vocabulary.encode_strict(tags)
+        return np.flatnonzero((self.bitsets & mask).any(axis=1))
+
+    def none_of(self, tags: Iterable[str]) -> np.ndarray:
+        """Row indices with no tag in ``tags``"""
+        mask = self.vocabulary.encode_strict(tags)
+        return np.flatnonzero(~(self.bitsets & mask).any(axis=1))
+
+    def dense(self) -> np.ndarray:
+        """(N, len(vocab)) boolean tag matrix, e.g. as clustering features"""
+        return self.vocabulary.to_dense(self.bitsets)
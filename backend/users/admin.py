@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import CustomUser, UserConnection
+from .models import Analysis, AnalysisJob, CustomUser, UserConnection
 
 @admin.register(CustomUser)
 class CustomUserAdmin(UserAdmin):
@@ -12,3 +12,19 @@ class CustomUserAdmin(UserAdmin):
     )
 
 admin.site.register(UserConnection)
+
+
+@admin.register(AnalysisJob)
+class AnalysisJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "user", "status", "attempts", "run_after", "created_at", "finished_at")
+    list_filter = ("status",)
+    readonly_fields = ("result", "last_error")
+
+
+@admin.register(Analysis)
+class AnalysisAdmin(admin.ModelAdmin):
+    list_display = ("user", "risk_level", "calculated_priority_score", "intervention_needed",
+                    "analysis_source", "analyzed_at")
+    list_filter = ("risk_level", "intervention_needed", "analysis_source")
+    list_select_related = ("user",)
+
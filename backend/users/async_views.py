@@ -0,0 +1,197 @@
+"""
+Async endpoints for work that waits on the LLM.
+
+Served over ASGI, these views await Ollama through the grouper's httpx
+transport instead of holding a worker thread for the whole round trip,
+so one server process keeps hundreds of slow requests in flight while
+the priority scheduler bounds how many reach the model at once.
+
+When the client disconnects, Django cancels the view task (or stops the
+streaming response); the cancellation closes the upstream HTTP stream,
+which aborts the generation in Ollama, and frees the scheduler slot.
+
+Under WSGI (``runserver``) the views still work, but each request runs
+on its own event loop and streamed responses are buffered.
+"""
+import asyncio
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.decorators import classonlymethod
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, permissions
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from models import metrics
+from models.llm_scheduler import INTAKE, priority_scope
+from .grouping import analysis_for, get_grouper, veteran_profile_for
+from .jobs import enqueue_analysis
+from .models import Analysis, AnalysisJob, CustomUser
+from .renderers import sse_event
+from .serializers import AnalysisJobSerializer
+
+logger = logging.getLogger(__name__)
+
+JOB_EVENTS_POLL = 1.0       # 秒
+JOB_EVENTS_TIMEOUT = 120.0
+
+
+class AsyncAPIView(View):
+    """
+    Async view that authenticates and authorizes with the same DRF classes
+    as an ``APIView`` (DRF only dispatches sync handlers) and renders
+    ``APIException``s the way DRF does
+    """
+    authentication_classes = api_settings.DEFAULT_AUTHENTICATION_CLASSES
+    permission_classes = [permissions.IsAuthenticated]
+
+    @classonlymethod
+    def as_view(cls, **initkwargs):
+        # 与 APIView 相同：JWT 认证不依赖 cookie，无需 CSRF 校验
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        request = Request(request, authenticators=[auth() for auth in self.authentication_classes])
+        self.request = request
+        try:
+            await sync_to_async(self.check_permissions)(request)
+            return await super().dispatch(request, *args, **kwargs)
+        except exceptions.APIException as exc:
+            response = JsonResponse({"detail": exc.detail}, status=exc.status_code)
+            if isinstance(exc, exceptions.NotAuthenticated) and request.authenticators:
+                response["WWW-Authenticate"] = request.authenticators[0].authenticate_header(request)
+            return response
+        except asyncio.CancelledError:
+            metrics.increment("llm_requests_cancelled_total", labels={"view": type(self).__name__})
+            logger.info("%s cancelled: client disconnected", type(self).__name__)
+            raise
+
+    def check_permissions(self, request) -> None:
+        """Run the permission classes; touching ``request.user`` authenticates (sync, may query)"""
+        for permission in (cls() for cls in self.permission_classes):
+            if not permission.has_permission(request, self):
+                if request.authenticators and not request.successful_authenticator:
+                    raise exceptions.NotAuthenticated()
+                raise exceptions.PermissionDenied(getattr(permission, "message", None))
+
+    def get_user(self, pk) -> CustomUser:
+        """The user ``pk``, which only that user and staff may act on (sync)"""
+        try:
+            user = CustomUser.objects.get(pk=pk)
+        except CustomUser.DoesNotExist:
+            raise exceptions.NotFound()
+        if user.pk != self.request.user.pk and not self.request.user.is_staff:
+            raise exceptions.PermissionDenied()
+        return user
+
+
+class AnalyzeView(AsyncAPIView):
+    """POST /api/v1/users/{id}/analyze/ — analyse the profile now and store the result"""
+
+    async def post(self, request, pk):
+        # 同步 ORM 调用合并为一次线程切换：高并发时每次切换都要争抢 GIL
+        user, previous = await sync_to_async(self._load)(pk)
+        with priority_scope(INTAKE):   # 用户在等待结果
+            analysis, action = await get_grouper().reanalyze_async(veteran_profile_for(user), previous)
+
+        if analysis.get("analysis_source") == "fallback":
+            # 模型不可用：返回规则分析，但不保存，交给后台任务重试
+            await sync_to_async(enqueue_analysis)(user.pk)
+        elif action != "skipped":
+            await sync_to_async(Analysis.store)(user.pk, analysis)
+        return JsonResponse({"action": action, "analysis": analysis})
+
+    def _load(self, pk):
+        user = self.get_user(pk)
+        previous = Analysis.objects.filter(user_id=user.pk).values_list("details", flat=True).first()
+        return user, previous
+
+
+class OutreachView(AsyncAPIView):
+    """GET /api/v1/users/{id}/outreach/ — personalized outreach message
+
+    Sent as SSE tokens when the client accepts `text/event-stream`,
+    otherwise as one JSON object once generation finishes.
+    """
+
+    async def get(self, request, pk):
+        user, analysis = await sync_to_async(self._load)(pk)
+        profile = veteran_profile_for(user)
+        grouper = get_grouper()
+
+        if "text/event-stream" in request.headers.get("Accept", ""):
+            tokens = grouper.stream_personalized_outreach_async(profile, analysis)
+            response = StreamingHttpResponse(self._events(tokens), content_type="text/event-stream")
+            response["Cache-Control"] = "no-cache"
+            response["X-Accel-Buffering"] = "no"   # 关闭 nginx 缓冲
+            return response
+
+        message = await grouper.generate_personalized_outreach_async(profile, analysis)
+        if not message:
+            return JsonResponse({"detail": "Outreach generation failed"}, status=503)
+        return JsonResponse({"message": message})
+
+    def _load(self, pk):
+        user = self.get_user(pk)
+        return user, analysis_for(user)
+
+    async def _events(self, tokens):
+        try:
+            async for token in tokens:
+                yield sse_event({"token": token})
+            yield sse_event({}, event="done")
+        except asyncio.CancelledError:
+            metrics.increment("llm_requests_cancelled_total", labels={"view": type(self).__name__})
+            logger.info("Outreach stream cancelled: client disconnected")
+            raise
+        finally:
+            await tokens.aclose()
+
+
+class JobEventsView(AsyncAPIView):
+    """GET /api/v1/jobs/{id}/events/ — SSE `status` events until the job finishes
+
+    Polls the job between awaited sleeps, so a waiting client holds no
+    worker thread; users only see their own jobs.
+    """
+
+    async def get(self, request, pk):
+        job = await sync_to_async(self._load)(pk)
+        response = StreamingHttpResponse(self._events(job.pk), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+    def _load(self, pk):
+        jobs = AnalysisJob.objects.all()
+        if not self.request.user.is_staff:
+            jobs = jobs.filter(user=self.request.user)
+        try:
+            return jobs.get(pk=pk)
+        except AnalysisJob.DoesNotExist:
+            raise exceptions.NotFound()
+
+    @staticmethod
+    def _state(job_id):
+        job = AnalysisJob.objects.get(pk=job_id)
+        return job.status, job.attempts, AnalysisJobSerializer(job).data
+
+    async def _events(self, job_id):
+        deadline = time.monotonic() + JOB_EVENTS_TIMEOUT
+        last = None
+        while True:
+            status, attempts, data = await sync_to_async(self._state)(job_id)
+            if (status, attempts) != last:
+                last = (status, attempts)
+                yield sse_event(data, event="status")
+            if status in AnalysisJob.FINISHED:
+                yield sse_event({}, event="done")
+                return
+            if time.monotonic() >= deadline:
+                yield sse_event({"detail": "timeout"}, event="timeout")
+                return
+            await asyncio.sleep(JOB_EVENTS_POLL)
@@ -0,0 +1,128 @@
+"""
+Read-through cache for user and connection payloads.
+
+Serialized responses are stored in Django's cache framework (``CACHES``,
+configured through ``CACHE_URL``). Every cached resource (``user`` or
+``connections`` of one user id) has a version stamp; entry keys and
+ETags are derived from it, so invalidating a resource is a single write
+of a fresh stamp and stale entries simply stop being reachable. The
+signals in ``signals`` invalidate on every save and delete.
+
+A request whose ``If-None-Match`` matches the current ETag gets a 304
+before any database query or serialization.
+
+``locmem`` caches are per process; with several server workers use a
+shared backend (file, Redis, Memcached) so invalidations reach all of them.
+"""
+import hashlib
+import time
+from typing import Callable
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from models import metrics
+
+USER = "user"
+CONNECTIONS = "connections"
+
+
+def _cache():
+    return caches[settings.API_CACHE_ALIAS]
+
+
+def _version_key(resource: str, pk) -> str:
+    return f"users:{resource}:{pk}:version"
+
+
+def _version(resource: str, pk) -> str:
+    key = _version_key(resource, pk)
+    version = _cache().get(key)
+    if version is None:
+        # A fresh stamp, never an old one: the key may have been evicted
+        _cache().add(key, f"{time.time_ns():x}", None)
+        version = _cache().get(key)
+    return version
+
+
+def _bump(resource: str, pk) -> None:
+    _cache().set(_version_key(resource, pk), f"{time.time_ns():x}", None)
+
+
+def invalidate(resource: str, pk) -> None:
+    """Drop every cached payload of ``resource`` for ``pk``
+
+    Inside a transaction the stamp is renewed again on commit, so a read
+    racing the write cannot keep the old rows cached under the new stamp.
+    """
+    _bump(resource, pk)
+    transaction.on_commit(lambda: _bump(resource, pk))
+    metrics.increment("api_cache_invalidations_total", labels={"resource": resource})
+
+
+def _record(resource: str, result: str) -> None:
+    metrics.increment("api_cache_requests_total", labels={"resource": resource, "result": result})
+    metrics.set_gauge("api_cache_hit_ratio", hit_ratio(resource), {"resource": resource})
+
+
+def hit_ratio(resource: str) -> float:
+    """Share of this process's requests for ``resource`` answered without the database"""
+    hits, not_modified, misses = (
+        metrics.registry.counter_value("api_cache_requests_total", {"resource": resource, "result": result})
+        for result in ("hit", "not_modified", "miss")
+    )
+    total = hits + not_modified + misses
+    return (hits + not_modified) / total if total else 0.0
+
+
+def _etag(request, resource: str, pk, version: str) -> str:
+    # 同一资源的不同 ?fields= / 分页游标 / 渲染格式分别缓存
+    variant = f"{request.get_host()}|{request.get_full_path()}|{request.accepted_renderer.format}"
+    digest = hashlib.sha1(f"{resource}:{pk}:{version}:{variant}".encode()).hexdigest()[:24]
+    return f'W/"{digest}"'
+
+
+def _matches(request, etag: str) -> bool:
+    header = request.headers.get("If-None-Match")
+    if not header:
+        return False
+    tags = parse_etags(header)
+    return any(tag.removeprefix("W/") == etag.removeprefix("W/") for tag in tags)
+
+
+def _finish(response: Response, etag: str) -> Response:
+    response["ETag"] = etag
+    response["Cache-Control"] = "private, no-cache"   # 每次都用 ETag 重新验证
+    return response
+
+
+def cached_response(request, resource: str, pk, build: Callable[[], Response]) -> Response:
+    """Serve ``build()`` through the cache, answering 304 on a matching ETag
+
+    Only 200 responses from ``build`` are cached.
+    """
+    try:
+        pk = int(pk)   # "01" 与 "1" 是同一资源
+    except (TypeError, ValueError):
+        return build()
+    etag = _etag(request, resource, pk, _version(resource, pk))
+    if _matches(request, etag):
+        _record(resource, "not_modified")
+        return _finish(Response(status=status.HTTP_304_NOT_MODIFIED), etag)
+
+    key = f"users:{resource}:{pk}:{etag[3:-1]}"
+    data = _cache().get(key)
+    if data is not None:
+        _record(resource, "hit")
+        return _finish(Response(data), etag)
+
+    _record(resource, "miss")
+    response = build()
+    if response.status_code != status.HTTP_200_OK:
+        return response
+    _cache().set(key, response.data, settings.API_CACHE_TIMEOUT)
+    return _finish(response, etag)
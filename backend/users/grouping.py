@@ -0,0 +1,84 @@
+"""
+Glue between the Django user model and the Llama grouping engine.
+"""
+from functools import lru_cache
+from typing import Optional
+
+from django.conf import settings
+
+from models.DynamicGrouping_Llama2B import LlamaVeteranGrouper, VeteranProfile
+from models.llm_cache import TwoTierCache
+from models.llm_scheduler import LLMScheduler
+from .models import Analysis
+
+
+@lru_cache(maxsize=1)
+def get_grouper() -> LlamaVeteranGrouper:
+    """Process-wide grouper, so the connection pool and cache are shared"""
+    return LlamaVeteranGrouper(
+        llama_endpoint=settings.LLAMA_ENDPOINT,
+        model_name=settings.LLAMA_MODEL,
+        pool_size=settings.LLAMA_POOL_SIZE,
+        timeout=settings.LLAMA_TIMEOUT,
+        cache=TwoTierCache.create(settings.LLAMA_CACHE_PATH or None),
+        scheduler=get_scheduler(),
+    )
+
+
+def get_scheduler() -> Optional[LLMScheduler]:
+    """Priority scheduler for LLM requests, or None when disabled"""
+    if settings.LLAMA_CONCURRENCY <= 0:
+        return None
+    return LLMScheduler(
+        max_concurrency=settings.LLAMA_CONCURRENCY,
+        aging_seconds=settings.LLAMA_SCHEDULER_AGING,
+        max_wait=settings.LLAMA_SCHEDULER_MAX_WAIT or None,
+    )
+
+
+# mental_health / wellness 是 0-10 的自评分，越低越差
+LOW_SELF_RATING = 3
+
+
+def veteran_profile_for(user) -> VeteranProfile:
+    """Build a VeteranProfile from the fields a CustomUser actually has
+
+    The free-text description joins the hobby as a topic, so pre-triage
+    and the prompts see what the veteran wrote about themselves. Giving a
+    mental-health or wellness rating counts as mood tracking / wellness
+    check-ins, and a low rating is passed on as a request for support.
+    """
+    comfort = user.engage if user.engage and 1 <= user.engage <= 5 else 3
+    looking_for = []
+    if user.mental_health is not None and user.mental_health <= LOW_SELF_RATING:
+        looking_for.append("Mental health counseling")
+    if user.wellness is not None and user.wellness <= LOW_SELF_RATING:
+        looking_for.append("Wellness support")
+    topics = [text.strip() for text in (user.hobby, user.description) if text and text.strip()]
+    return VeteranProfile(
+        full_name=user.get_full_name() or user.username,
+        email=user.email,
+        username=user.username,
+        age=user.age or 0,
+        city=user.location or "",
+        comfort_level_peer_support=comfort,
+        mood_tracker_optin=user.mental_health is not None,
+        daily_wellness_checkins=user.wellness is not None,
+        looking_for=looking_for or None,
+        career_interests=[user.job] if user.job else None,
+        topics_of_interest=topics or None,
+    )
+
+
+def quick_analysis_for(user) -> dict:
+    """Rule-based analysis that needs no LLM round trip"""
+    grouper = get_grouper()
+    profile = veteran_profile_for(user)
+    triage = grouper.pretriage_engine.triage([profile])[0]
+    return grouper._enhance_llama_analysis(triage.analysis, profile)
+
+
+def analysis_for(user) -> dict:
+    """The user's stored analysis, or the rule-based one until it has been analysed"""
+    details = Analysis.objects.filter(user_id=user.pk).values_list("details", flat=True).first()
+    return details or quick_analysis_for(user)
@@ -0,0 +1,220 @@
+"""
+Streaming bulk import of veteran rosters.
+
+The pipeline is a chain of generators, so only one chunk of rows is in
+memory at a time regardless of file size:
+
+    read_rows -> map_row -> chunked -> validate_chunk -> write_chunk
+
+Rows may use ``CustomUser`` field names or the ``VeteranProfile`` names
+that ``grouping.veteran_profile_for`` maps them from (``city``,
+``comfort_level_peer_support``, ``career_interests``, ...). Imported
+users get an unusable password instead of a hashed one, so they sign in
+through a password reset.
+"""
+import csv
+import io
+import json
+import secrets
+import sys
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX, UNUSABLE_PASSWORD_SUFFIX_LENGTH
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+
+from .jobs import enqueue_many
+from .models import CustomUser
+
+# VeteranProfile 字段名 -> CustomUser 字段名（与 veteran_profile_for 相反方向）
+PROFILE_ALIASES = {
+    "city": "location",
+    "comfort_level_peer_support": "engage",
+    "career_interests": "job",
+    "topics_of_interest": "hobby",
+    "notes": "description",
+}
+IMPORT_FIELDS = ("username", "email", "first_name", "last_name", "job", "mental_health",
+                 "wellness", "engage", "location", "gender", "age", "description", "hobby")
+INTEGER_FIELDS = {"mental_health", "wellness", "engage", "age"}
+# 只校验导入的字段；其余字段取默认值
+NOT_VALIDATED = [f.name for f in CustomUser._meta.concrete_fields if f.name not in IMPORT_FIELDS]
+FORMATS = ("csv", "jsonl")
+
+
+class RowError(ValueError):
+    """A row that cannot be imported; ``line`` is its position in the input"""
+
+    def __init__(self, line: int, message: str):
+        super().__init__(f"line {line}: {message}")
+        self.line = line
+
+
+@dataclass
+class ImportStats:
+    read: int = 0
+    created: int = 0
+    invalid: int = 0
+    duplicates: int = 0
+    enqueued: int = 0
+    errors: List[str] = field(default_factory=list)
+    max_errors: int = 20
+
+    def reject(self, error: RowError, duplicate: bool = False) -> None:
+        if duplicate:
+            self.duplicates += 1
+        else:
+            self.invalid += 1
+        if len(self.errors) < self.max_errors:   # 只保留前几条，内存不随文件增长
+            self.errors.append(str(error))
+
+
+def detect_format(path: str) -> str:
+    if path.lower().endswith(".csv"):
+        return "csv"
+    if path.lower().endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    raise ValueError(f"Cannot tell the format of {path}; pass --format")
+
+
+def read_rows(stream: io.TextIOBase, fmt: str) -> Iterator[Tuple[int, Any]]:
+    """Yield (line number, raw row) pairs without reading the whole input"""
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == "jsonl":
+        for line_num, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                yield line_num, json.loads(line)
+            except ValueError as e:
+                yield line_num, RowError(line_num, f"invalid JSON: {e}")
+    else:
+        raise ValueError(f"Unknown format: {fmt}")
+
+
+def _first(value: Any) -> Any:
+    # VeteranProfile 的列表字段只取第一项，与 veteran_profile_for 对应
+    if isinstance(value, list):
+        return value[0] if value else None
+    return value
+
+
+def map_row(line: int, row: Any) -> Dict[str, Any]:
+    """Map a raw row onto CustomUser fields; raises ``RowError``"""
+    if isinstance(row, RowError):
+        raise row
+    if not isinstance(row, dict):
+        raise RowError(line, "expected an object")
+    values = {}
+    for key, value in row.items():
+        if key is None:
+            raise RowError(line, "more values than header columns")
+        name = PROFILE_ALIASES.get(key.strip(), key.strip())
+        value = _first(value)
+        if isinstance(value, str):
+            value = value.strip()
+        if name in IMPORT_FIELDS and value not in (None, ""):
+            values[name] = value
+    if "full_name" in row and not ("first_name" in values or "last_name" in values):
+        first, _, last = str(row["full_name"] or "").strip().partition(" ")
+        values.update(first_name=first, last_name=last.strip())
+    for name in INTEGER_FIELDS & values.keys():
+        try:
+            values[name] = int(values[name])
+        except (TypeError, ValueError):
+            raise RowError(line, f"{name} must be an integer")
+    if not values.get("username"):
+        raise RowError(line, "username is required")
+    values["username"] = CustomUser.normalize_username(str(values["username"]))
+    if values.get("email"):
+        values["email"] = CustomUser.objects.normalize_email(values["email"])
+    return values
+
+
+def chunked(iterable: Iterable, size: int) -> Iterator[List]:
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def unusable_password() -> str:
+    """Same kind of value as ``make_password(None)``, from one urandom call instead of 40"""
+    return UNUSABLE_PASSWORD_PREFIX + secrets.token_hex(UNUSABLE_PASSWORD_SUFFIX_LENGTH // 2)
+
+
+def validate_chunk(chunk: List[Tuple[int, Any]], stats: ImportStats) -> List[Tuple[int, CustomUser]]:
+    """(line, unsaved user) for the valid, new rows of ``chunk``; rejects the rest into ``stats``
+
+    Uniqueness is checked with one query per chunk. Rows from earlier
+    chunks are already in the database, so duplicates across the whole
+    file are caught without remembering every username.
+    """
+    candidates = []
+    for line, row in chunk:
+        try:
+            user = CustomUser(password=unusable_password(), **map_row(line, row))   # 无需哈希
+            user.clean_fields(exclude=NOT_VALIDATED)
+        except RowError as e:
+            stats.reject(e)
+            continue
+        except ValidationError as e:
+            stats.reject(RowError(line, "; ".join(f"{k}: {' '.join(v)}" for k, v in e.message_dict.items())))
+            continue
+        candidates.append((line, user))
+    return drop_existing(candidates, stats)
+
+
+def drop_existing(candidates: List[Tuple[int, CustomUser]],
+                  stats: ImportStats) -> List[Tuple[int, CustomUser]]:
+    """Reject users whose username is taken, in the database or earlier in the chunk"""
+    existing = set(CustomUser.objects
+                   .filter(username__in=[user.username for _, user in candidates])
+                   .values_list("username", flat=True))
+    kept = []
+    for line, user in candidates:
+        if user.username in existing:
+            stats.reject(RowError(line, f"username {user.username!r} already exists"), duplicate=True)
+            continue
+        existing.add(user.username)
+        kept.append((line, user))
+    return kept
+
+
+def write_chunk(users: List[CustomUser], enqueue: bool) -> Tuple[int, int]:
+    """Insert ``users`` (and their analysis jobs) in one transaction; returns (created, enqueued)"""
+    with transaction.atomic():
+        created = CustomUser.objects.bulk_create(users)
+        enqueued = enqueue_many([user.pk for user in created]) if enqueue else 0
+    return len(created), enqueued
+
+
+def import_rows(rows: Iterable[Tuple[int, Any]], chunk_size: int = 1000, enqueue: bool = False,
+                dry_run: bool = False, stats: Optional[ImportStats] = None) -> Iterator[ImportStats]:
+    """Run the pipeline, yielding the running ``stats`` after every chunk"""
+    stats = stats or ImportStats()
+    for chunk in chunked(rows, chunk_size):
+        stats.read += len(chunk)
+        valid = validate_chunk(chunk, stats)
+        if dry_run:
+            stats.created += len(valid)
+        elif valid:
+            try:
+                created, enqueued = write_chunk([user for _, user in valid], enqueue)
+            except IntegrityError:
+                # 其他写入者同时占用了部分用户名：剔除后重试一次
+                valid = drop_existing(valid, stats)
+                created, enqueued = write_chunk([user for _, user in valid], enqueue) if valid else (0, 0)
+            stats.created += created
+            stats.enqueued += enqueued
+        yield stats
+
+
+def open_input(path: str, encoding: str = "utf-8") -> io.TextIOBase:
+    if path == "-":
+        return io.TextIOWrapper(sys.stdin.buffer, encoding=encoding, newline="")
+    return open(path, encoding=encoding, newline="")
@@ -0,0 +1,239 @@
+"""
+DB-backed queue for LLM profile analysis.
+
+Saving a user enqueues an ``AnalysisJob`` (see ``signals``); the
+``run_analysis_worker`` management command claims and runs them, so
+requests never wait on the model. Each user has at most one pending
+job, failed attempts are retried with exponential backoff, and jobs
+whose worker died are reclaimed once their lease expires; a running
+worker renews the leases of its jobs in the background. Successful
+results are stored in the user's ``Analysis`` row for the triage queue.
+"""
+import logging
+import os
+import random
+import socket
+import threading
+from datetime import timedelta
+from typing import Optional
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from models import metrics
+from models.llm_scheduler import BACKGROUND, INTAKE, priority_scope
+from .grouping import get_grouper, veteran_profile_for
+from .models import Analysis, AnalysisJob
+
+logger = logging.getLogger(__name__)
+
+CLAIM_CANDIDATES = 10
+
+
+def enqueue_analysis(user_id: int) -> AnalysisJob:
+    """Queue an analysis for ``user_id``, reusing its pending job if there is one"""
+    for _ in range(3):
+        job = AnalysisJob.objects.filter(user_id=user_id, status=AnalysisJob.PENDING).first()
+        if job is not None:
+            return job
+        try:
+            with transaction.atomic():
+                job = AnalysisJob.objects.create(user_id=user_id)
+        except IntegrityError:
+            continue   # 并发入队，改用已存在的任务
+        metrics.increment("analysis_jobs_total", labels={"event": "enqueued"})
+        return job
+    raise RuntimeError(f"Could not enqueue analysis for user {user_id}")
+
+
+def enqueue_many(user_ids) -> int:
+    """Queue analyses for many users in one INSERT; returns how many jobs were submitted
+
+    Users that already have a pending job keep it (the conflict is ignored).
+    """
+    jobs = AnalysisJob.objects.bulk_create([AnalysisJob(user_id=user_id) for user_id in user_ids],
+                                           ignore_conflicts=True)
+    metrics.increment("analysis_jobs_total", len(jobs), labels={"event": "enqueued"})
+    return len(jobs)
+
+
+def latest_job(user_id: int) -> Optional[AnalysisJob]:
+    return AnalysisJob.objects.filter(user_id=user_id).order_by("-created_at", "-pk").first()
+
+
+def claim_next(worker_id: str) -> Optional[AnalysisJob]:
+    """
+    Atomically take the oldest due job
+
+    Claiming is a conditional UPDATE on the job's status, so concurrent
+    workers never run the same job, on any database backend.
+    """
+    now = timezone.now()
+    due = (AnalysisJob.objects
+           .filter(status=AnalysisJob.PENDING, run_after__lte=now)
+           .order_by("run_after", "pk")
+           .values_list("pk", flat=True)[:CLAIM_CANDIDATES])
+    for pk in due:
+        claimed = AnalysisJob.objects.filter(pk=pk, status=AnalysisJob.PENDING).update(
+            status=AnalysisJob.RUNNING, locked_by=worker_id, locked_at=now,
+            attempts=F("attempts") + 1, updated_at=now,
+        )
+        if claimed:
+            return AnalysisJob.objects.select_related("user").get(pk=pk)
+    return None
+
+
+def backoff_seconds(attempts: int) -> float:
+    """Delay before retry number ``attempts``, doubling up to the configured cap"""
+    delay = min(settings.ANALYSIS_JOB_BACKOFF * 2 ** max(attempts - 1, 0),
+                settings.ANALYSIS_JOB_MAX_BACKOFF)
+    return delay * random.uniform(0.8, 1.0)   # 抖动，避免重试扎堆
+
+
+def _finish(job: AnalysisJob, worker_id: str, **fields) -> bool:
+    """Write the outcome, unless the job was reclaimed from this worker meanwhile"""
+    fields.setdefault("updated_at", timezone.now())
+    return bool(AnalysisJob.objects
+                .filter(pk=job.pk, status=AnalysisJob.RUNNING, locked_by=worker_id)
+                .update(**fields))
+
+
+def _retry_or_fail(job: AnalysisJob, worker_id: str, error: str) -> None:
+    now = timezone.now()
+    if job.attempts >= settings.ANALYSIS_JOB_MAX_ATTEMPTS:
+        _finish(job, worker_id, status=AnalysisJob.FAILED, last_error=error, finished_at=now)
+        metrics.increment("analysis_jobs_total", labels={"event": "failed"})
+        logger.error("Analysis job %s failed after %s attempts: %s", job.pk, job.attempts, error)
+        return
+    retry_at = now + timedelta(seconds=backoff_seconds(job.attempts))
+    try:
+        with transaction.atomic():
+            _finish(job, worker_id, status=AnalysisJob.PENDING, run_after=retry_at,
+                    last_error=error, locked_by="", locked_at=None)
+    except IntegrityError:
+        # The user changed meanwhile; the newer pending job covers this one
+        _finish(job, worker_id, status=AnalysisJob.FAILED, finished_at=now,
+                last_error=f"{error} (superseded by a newer job)")
+        return
+    metrics.increment("analysis_jobs_total", labels={"event": "retried"})
+    logger.warning("Analysis job %s attempt %s failed (%s); retrying at %s",
+                   job.pk, job.attempts, error, retry_at.isoformat())
+
+
+def run_job(job: AnalysisJob, worker_id: str) -> None:
+    """Analyse the job's user and record the outcome"""
+    previous = Analysis.objects.filter(user_id=job.user_id).values_list("details", flat=True).first()
+    try:
+        profile = veteran_profile_for(job.user)
+        with priority_scope(BACKGROUND if previous else INTAKE):
+            analysis, action = get_grouper().reanalyze(profile, previous)
+    except Exception as e:
+        logger.exception("Analysis job %s raised", job.pk)
+        _retry_or_fail(job, worker_id, f"{type(e).__name__}: {e}")
+        return
+
+    # The grouper degrades to rule-based analysis when the model is down;
+    # retry for an LLM answer, and keep the fallback only on the last attempt.
+    # A stored fallback is never skipped (the grouper re-runs it), so a
+    # skipped result is always a reusable one.
+    if (action != "skipped" and analysis.get("analysis_source") == "fallback"
+            and job.attempts < settings.ANALYSIS_JOB_MAX_ATTEMPTS):
+        _retry_or_fail(job, worker_id, "LLM unavailable, used fallback analysis")
+        return
+
+    with transaction.atomic():
+        finished = _finish(job, worker_id, status=AnalysisJob.SUCCEEDED, result=analysis,
+                           last_error="", finished_at=timezone.now())
+        if finished and action != "skipped":
+            Analysis.store(job.user_id, analysis)
+    if finished:
+        metrics.increment("analysis_jobs_total", labels={"event": "succeeded"})
+        logger.info("Analysis job %s for user %s %s", job.pk, job.user_id, action)
+
+
+def renew_leases(worker_id: str) -> int:
+    """Extend the lease of every job the threads of ``worker_id`` are running; returns how many"""
+    return (AnalysisJob.objects
+            .filter(status=AnalysisJob.RUNNING, locked_by__startswith=f"{worker_id}/")
+            .update(locked_at=timezone.now()))
+
+
+def requeue_stale(lease_seconds: Optional[float] = None) -> int:
+    """Release running jobs whose worker stopped renewing them; returns how many"""
+    lease = lease_seconds if lease_seconds is not None else settings.ANALYSIS_JOB_LEASE
+    cutoff = timezone.now() - timedelta(seconds=lease)
+    stale = list(AnalysisJob.objects.filter(status=AnalysisJob.RUNNING, locked_at__lt=cutoff))
+    for job in stale:
+        _retry_or_fail(job, job.locked_by, "worker lease expired")
+    return len(stale)
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class Worker:
+    """Pool of threads that claim and run analysis jobs until stopped"""
+
+    def __init__(self, threads: int = 4, poll_interval: float = 2.0, burst: bool = False,
+                 worker_id: Optional[str] = None):
+        self.threads = max(threads, 1)
+        self.poll_interval = poll_interval
+        self.burst = burst   # 队列为空时退出
+        self.worker_id = worker_id or default_worker_id()
+        self.stop_event = threading.Event()
+        self.processed = 0
+        self._lock = threading.Lock()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+
+    def run(self) -> int:
+        """Run until ``stop`` (or an empty queue in burst mode); returns jobs processed"""
+        pool = [threading.Thread(target=self._loop, args=(f"{self.worker_id}/{i}",),
+                                 name=f"analysis-worker-{i}", daemon=True)
+                for i in range(self.threads)]
+        for thread in pool:
+            thread.start()
+        finished = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(finished,),
+                                     name="analysis-worker-heartbeat", daemon=True)
+        heartbeat.start()
+        for thread in pool:
+            while thread.is_alive():
+                thread.join(timeout=0.5)
+        finished.set()
+        heartbeat.join()
+        return self.processed
+
+    def _heartbeat(self, finished: threading.Event) -> None:
+        """Renew the leases of running jobs so slow LLM calls are not reclaimed"""
+        interval = settings.ANALYSIS_JOB_LEASE / 3
+        try:
+            while not finished.wait(interval):
+                try:
+                    renew_leases(self.worker_id)
+                except Exception:
+                    logger.exception("Could not renew analysis job leases")   # 下一轮再试
+                close_old_connections()
+        finally:
+            connection.close()
+
+    def _loop(self, thread_id: str) -> None:
+        try:
+            while not self.stop_event.is_set():
+                close_old_connections()
+                job = claim_next(thread_id)
+                if job is None:
+                    requeue_stale()
+                    if self.burst:
+                        return
+                    self.stop_event.wait(self.poll_interval)
+                    continue
+                run_job(job, thread_id)
+                with self._lock:
+                    self.processed += 1
+        finally:
+            connection.close()
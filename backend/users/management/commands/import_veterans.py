@@ -0,0 +1,64 @@
+import resource
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import reset_queries
+
+from users.importer import FORMATS, ImportStats, detect_format, import_rows, open_input, read_rows
+
+
+class Command(BaseCommand):
+    help = "Import veteran profiles from a CSV or JSONL file as users, streaming in chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV/JSONL file, or - for stdin")
+        parser.add_argument("--format", choices=FORMATS,
+                            help="Input format (default: from the file extension)")
+        parser.add_argument("--chunk-size", type=int, default=1000,
+                            help="Rows validated and inserted per transaction")
+        parser.add_argument("--enqueue", action="store_true",
+                            help="Queue an LLM analysis job for every imported user")
+        parser.add_argument("--dry-run", action="store_true",
+                            help="Validate only; write nothing")
+        parser.add_argument("--progress-every", type=int, default=10,
+                            help="Report progress every N chunks (0 = only at the end)")
+
+    def handle(self, *args, **options):
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be at least 1")
+        try:
+            fmt = options["format"] or detect_format(options["path"])
+            stream = open_input(options["path"])
+        except (ValueError, OSError) as e:
+            raise CommandError(str(e))
+
+        stats = ImportStats()
+        start = time.perf_counter()
+        with stream:
+            rows = read_rows(stream, fmt)
+            for chunks, _ in enumerate(import_rows(rows, options["chunk_size"], options["enqueue"],
+                                                   options["dry_run"], stats), 1):
+                reset_queries()   # DEBUG 下 Django 会保留执行过的 SQL，逐块清空以保持内存恒定
+                if options["progress_every"] and chunks % options["progress_every"] == 0:
+                    self.stdout.write(self._summary(stats, time.perf_counter() - start))
+        elapsed = time.perf_counter() - start
+
+        for error in stats.errors:
+            self.stderr.write(error)
+        hidden = stats.invalid + stats.duplicates - len(stats.errors)
+        if hidden > 0:
+            self.stderr.write(f"... and {hidden} more rejected rows")
+        verb = "Would create" if options["dry_run"] else "Created"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {stats.created} users ({stats.enqueued} analyses queued); "
+            + self._summary(stats, elapsed)
+        ))
+
+    @staticmethod
+    def _summary(stats: ImportStats, elapsed: float) -> str:
+        rate = stats.read / elapsed if elapsed else 0.0
+        # ru_maxrss 在 Linux 上以 KB 为单位
+        peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        return (f"{stats.read} rows read, {stats.created} valid, {stats.invalid} invalid, "
+                f"{stats.duplicates} duplicates in {elapsed:.1f}s ({rate:,.0f} rows/s, "
+                f"peak RSS {peak_mb:.0f} MB)")
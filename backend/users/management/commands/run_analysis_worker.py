@@ -0,0 +1,54 @@
+import signal
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from users.jobs import Worker, requeue_stale
+
+
+class Command(BaseCommand):
+    help = "Run queued LLM profile analysis jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=settings.ANALYSIS_WORKER_THREADS,
+                            help="Worker threads per process")
+        parser.add_argument("--processes", type=int, default=1,
+                            help="Worker processes; more than 1 starts child workers")
+        parser.add_argument("--poll-interval", type=float, default=2.0,
+                            help="Seconds to wait when the queue is empty")
+        parser.add_argument("--burst", action="store_true",
+                            help="Exit once no job is due instead of polling")
+
+    def handle(self, *args, **options):
+        if options["processes"] > 1:
+            return self._supervise(options)
+
+        requeue_stale()
+        worker = Worker(threads=options["threads"], poll_interval=options["poll_interval"],
+                        burst=options["burst"])
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, lambda *_: worker.stop())   # 处理完当前任务后退出
+        self.stdout.write(f"Analysis worker {worker.worker_id} started with {worker.threads} threads")
+        processed = worker.run()
+        self.stdout.write(f"Analysis worker {worker.worker_id} stopped after {processed} jobs")
+
+    def _supervise(self, options):
+        """Start one single-process worker per requested process and wait for them"""
+        command = [sys.executable, sys.argv[0], "run_analysis_worker",
+                   "--processes", "1", "--threads", str(options["threads"]),
+                   "--poll-interval", str(options["poll_interval"])]
+        if options["burst"]:
+            command.append("--burst")
+        children = [subprocess.Popen(command) for _ in range(options["processes"])]
+
+        def forward(signum, frame):
+            for child in children:
+                child.send_signal(signum)
+
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, forward)
+        codes = [child.wait() for child in children]
+        if any(codes):
+            sys.exit(max(codes))
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.1 on 2026-10-17 22:13
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_analysisjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Analysis',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('primary_tags', models.JSONField(default=list)),
+                ('secondary_tags', models.JSONField(default=list)),
+                ('risk_level', models.CharField(blank=True, max_length=20)),
+                ('priority_score', models.SmallIntegerField(default=0)),
+                ('calculated_priority_score', models.IntegerField(default=0)),
+                ('intervention_needed', models.BooleanField(default=False)),
+                ('analysis_source', models.CharField(blank=True, max_length=20)),
+                ('model_used', models.CharField(blank=True, max_length=100)),
+                ('details', models.JSONField(default=dict)),
+                ('analyzed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='analysis', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-calculated_priority_score', '-priority_score', '-analyzed_at'],
+                'indexes': [models.Index(fields=['-calculated_priority_score', '-priority_score', '-analyzed_at'], name='analysis_triage_idx'), models.Index(fields=['risk_level', '-calculated_priority_score'], name='analysis_risk_score_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.1 on 2026-10-17 22:20
+
+from django.db import migrations, models
+
+
+def delete_self_connections(apps, schema_editor):
+    # 旧数据中可能存在自连接，需先删除才能添加约束
+    UserConnection = apps.get_model("users", "UserConnection")
+    UserConnection.objects.filter(user=models.F("connected_user")).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_analysis'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userconnection',
+            index=models.Index(fields=['connected_user', 'created_at'], name='connection_reverse_idx'),
+        ),
+        migrations.RunPython(delete_self_connections, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='userconnection',
+            constraint=models.CheckConstraint(condition=models.Q(('user', models.F('connected_user')), _negated=True), name='no_self_connection'),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.utils import timezone
 
 class CustomUser(AbstractUser):
     job = models.CharField(max_length=100, null=True, blank=True)
@@ -28,6 +29,125 @@ class UserConnection(models.Model):
     class Meta:
         unique_together = ("user", "connected_user")
         ordering = ["-created_at"]
+        indexes = [
+            # 反向查询（谁连接了我）及二度连接
+            models.Index(fields=["connected_user", "created_at"], name="connection_reverse_idx"),
+        ]
+        constraints = [
+            models.CheckConstraint(
+                condition=~models.Q(user=models.F("connected_user")),
+                name="no_self_connection",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.user_id} ➜ {self.connected_user_id}"
+
+
+class AnalysisJob(models.Model):
+    """LLM analysis of one user, run by the `run_analysis_worker` command"""
+
+    PENDING = "pending"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (SUCCEEDED, "Succeeded"),
+        (FAILED, "Failed"),
+    ]
+    FINISHED = (SUCCEEDED, FAILED)
+
+    user = models.ForeignKey(
+        CustomUser, related_name="analysis_jobs", on_delete=models.CASCADE
+    )
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    result = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        indexes = [models.Index(fields=["status", "run_after"])]
+        constraints = [
+            # 每个用户最多一个排队中的任务
+            models.UniqueConstraint(
+                fields=["user"],
+                condition=models.Q(status="pending"),
+                name="unique_pending_analysis_job",
+            ),
+        ]
+
+    def __str__(self):
+        return f"AnalysisJob {self.pk} ({self.user_id}, {self.status})"
+
+
+class Analysis(models.Model):
+    """Latest LLM (or fallback) analysis of a user, kept for the triage queue"""
+
+    RISK_LEVELS = ["Critical", "High", "Medium", "Low"]
+
+    user = models.OneToOneField(
+        CustomUser, related_name="analysis", on_delete=models.CASCADE
+    )
+    primary_tags = models.JSONField(default=list)
+    secondary_tags = models.JSONField(default=list)
+    risk_level = models.CharField(max_length=20, blank=True)
+    priority_score = models.SmallIntegerField(default=0)             # 模型给出的分数
+    calculated_priority_score = models.IntegerField(default=0)      # 按标签权重重算
+    intervention_needed = models.BooleanField(default=False)
+    analysis_source = models.CharField(max_length=20, blank=True)  # llm / fallback / rules
+    model_used = models.CharField(max_length=100, blank=True)
+    details = models.JSONField(default=dict)                        # 完整分析结果
+    analyzed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ["-calculated_priority_score", "-priority_score", "-analyzed_at"]
+        indexes = [
+            models.Index(
+                fields=["-calculated_priority_score", "-priority_score", "-analyzed_at"],
+                name="analysis_triage_idx",
+            ),
+            models.Index(
+                fields=["risk_level", "-calculated_priority_score"],
+                name="analysis_risk_score_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"Analysis of {self.user_id} ({self.risk_level}, {self.calculated_priority_score})"
+
+    @classmethod
+    def fields_from(cls, analysis: dict) -> dict:
+        """Model field values for an analysis dict returned by the grouper"""
+        def as_int(value):
+            try:
+                return int(float(value))
+            except (TypeError, ValueError):
+                return 0
+
+        return {
+            "primary_tags": list(analysis.get("primary_tags") or []),
+            "secondary_tags": list(analysis.get("secondary_tags") or []),
+            "risk_level": str(analysis.get("risk_level") or "")[:20],
+            "priority_score": max(min(as_int(analysis.get("priority_score")), 32767), -32768),
+            "calculated_priority_score": as_int(analysis.get("calculated_priority_score")),
+            "intervention_needed": bool(analysis.get("intervention_needed")),
+            "analysis_source": str(analysis.get("analysis_source") or "")[:20],
+            "model_used": str(analysis.get("llama_model_used") or "")[:100],
+            "details": analysis,
+            "analyzed_at": timezone.now(),
+        }
+
+    @classmethod
+    def store(cls, user_id: int, analysis: dict) -> "Analysis":
+        obj, _ = cls.objects.update_or_create(user_id=user_id, defaults=cls.fields_from(analysis))
+        return obj
+
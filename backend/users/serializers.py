@@ -1,17 +1,63 @@
 from rest_framework import serializers
-from .models import CustomUser, UserConnection
+from .models import Analysis, AnalysisJob, CustomUser, UserConnection
 
-class UserSerializer(serializers.ModelSerializer):
+
+def requested_fields(request):
+    """Field names from `?fields=a,b` on a GET request, or None"""
+    if request is None or request.method != "GET":
+        return None
+    raw = request.query_params.get("fields")
+    if not raw:
+        return None
+    return {name.strip() for name in raw.split(",") if name.strip()} or None
+
+
+class SparseFieldsetMixin:
+    """Limit a serializer's output to the fields named in `?fields=`"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        wanted = requested_fields(self.context.get("request"))
+        if wanted is None:
+            return
+        unknown = wanted - set(self.fields)
+        if unknown:
+            raise serializers.ValidationError({"fields": f"Unknown field(s): {', '.join(sorted(unknown))}"})
+        for name in set(self.fields) - wanted:
+            self.fields.pop(name)
+
+    @classmethod
+    def only_requested(cls, queryset, request, *required):
+        """Narrow `queryset` with .only() to the model columns behind `?fields=`
+
+        `required` names columns the caller needs regardless, such as the
+        foreign key a related manager filters on.
+        """
+        wanted = requested_fields(request)
+        if wanted is None:
+            return queryset
+        fields = cls().fields
+        sources = {fields[name].source for name in wanted
+                   if name in fields and fields[name].source != "*"}
+        return queryset.only("pk", *required, *sources)
+
+
+class UserSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = CustomUser
         exclude = ("password", "is_staff", "is_superuser", "groups", "user_permissions")
 
-class ConnectionSerializer(serializers.ModelSerializer):
+class ConnectionSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = UserConnection
         fields = ("id", "connected_user", "created_at")
         read_only_fields = ("id", "created_at")
 
+class BulkConnectionSerializer(serializers.Serializer):
+    connected_users = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=1000
+    )
+
 class RegisterSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, min_length=6)
 
@@ -20,4 +66,26 @@ class RegisterSerializer(serializers.ModelSerializer):
         fields = ("id", "username", "email", "password")
 
     def create(self, validated_data):
-        return CustomUser.objects.create_user(**validated_data)
\ No newline at end of file
+        return CustomUser.objects.create_user(**validated_data)
+
+class AnalysisJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = AnalysisJob
+        fields = ("id", "user", "status", "attempts", "run_after", "last_error", "result",
+                  "created_at", "updated_at", "finished_at")
+        read_only_fields = fields
+
+class TriageSerializer(serializers.ModelSerializer):
+    user_id = serializers.IntegerField(source="user.id", read_only=True)
+    username = serializers.CharField(source="user.username", read_only=True)
+    email = serializers.EmailField(source="user.email", read_only=True)
+    location = serializers.CharField(source="user.location", read_only=True)
+
+    class Meta:
+        model = Analysis
+        fields = ("user_id", "username", "email", "location", "risk_level",
+                  "calculated_priority_score", "priority_score", "intervention_needed",
+                  "primary_tags", "secondary_tags", "analysis_source", "model_used",
+                  "analyzed_at")
+        read_only_fields = fields
+
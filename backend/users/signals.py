@@ -0,0 +1,60 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import cache
+from .jobs import enqueue_analysis
+from .models import Analysis, CustomUser, UserConnection
+from .similarity import get_index
+
+
+@receiver(post_save, sender=CustomUser)
+def update_similarity_index(sender, instance, **kwargs):
+    index = get_index(build=False)   # 索引尚未构建时无需维护
+    if index is None:
+        return
+    if instance.is_active:
+        index.upsert(instance)
+    else:
+        index.remove(instance.pk)
+
+
+@receiver(post_delete, sender=CustomUser)
+def remove_from_similarity_index(sender, instance, **kwargs):
+    index = get_index(build=False)
+    if index is not None:
+        index.remove(instance.pk)
+
+
+@receiver(post_save, sender=Analysis)
+def update_similarity_tags(sender, instance, **kwargs):
+    # 索引使用已保存分析的标签
+    index = get_index(build=False)
+    if index is not None and instance.user.is_active:
+        index.upsert(instance.user)
+
+
+# 仅改动这些字段（如登录）时不需要重新分析
+NON_PROFILE_FIELDS = {"last_login", "password"}
+
+
+@receiver(post_save, sender=CustomUser)
+def enqueue_profile_analysis(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    if raw or not settings.ANALYSIS_AUTO_ENQUEUE or not instance.is_active:
+        return
+    if update_fields and set(update_fields) <= NON_PROFILE_FIELDS:
+        return
+    transaction.on_commit(lambda: enqueue_analysis(instance.pk))
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_user_cache(sender, instance, **kwargs):
+    cache.invalidate(cache.USER, instance.pk)
+
+
+@receiver(post_save, sender=UserConnection)
+@receiver(post_delete, sender=UserConnection)
+def invalidate_connections_cache(sender, instance, **kwargs):
+    cache.invalidate(cache.CONNECTIONS, instance.user_id)
@@ -0,0 +1,254 @@
+"""
+In-memory vector index for peer suggestions.
+
+Every user is embedded as a unit vector built from hashed job / hobby /
+location tokens, the wellness scores and the tags of their stored
+analysis (the rule-based tags until they have been analysed), so
+similarity is one matrix-vector product. The index is built from the
+database on first use, kept current by the post_save / post_delete
+signals in ``users.signals``, and rebuilt after ``SIMILARITY_INDEX_TTL``
+seconds so edits made in other worker processes are eventually picked up.
+Changes made while a rebuild runs are replayed onto the new index before
+it replaces the old one.
+"""
+import logging
+import re
+import threading
+import time
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+
+from .grouping import get_grouper, veteran_profile_for
+
+logger = logging.getLogger(__name__)
+
+HASH_DIMS = 256
+BUILD_BATCH = 2000
+SCORE_MAX = 10
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Relative weight of each feature block
+FIELD_WEIGHTS = {"job": 1.0, "hobby": 1.0, "location": 1.5}
+SCORE_WEIGHT = 0.5
+TAG_WEIGHT = 1.0
+
+
+def _hash_token(field: str, token: str) -> Tuple[int, float]:
+    h = zlib.crc32(f"{field}:{token}".encode("utf-8"))
+    return h % HASH_DIMS, (1.0 if h & 0x80000000 else -1.0)
+
+
+class SimilarityIndex:
+    """Thread-safe cosine-similarity index over users"""
+
+    def __init__(self):
+        self._vocabulary = get_grouper().tag_vocabulary
+        self.dims = HASH_DIMS + 3 + len(self._vocabulary)
+        self._lock = threading.RLock()
+        self._matrix = np.zeros((0, self.dims), dtype=np.float32)
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._rows: Dict[int, int] = {}
+        self._free: List[int] = []
+        self.built_at: Optional[float] = None
+        # 重建期间记录的改动（user id -> 用户，None 表示删除），以及接替的新索引
+        self._changes: Optional[Dict[int, object]] = None
+        self._successor: Optional["SimilarityIndex"] = None
+
+    # ---------- encoding ----------
+    def encode_many(self, users: List) -> np.ndarray:
+        """Unit feature vectors for a batch of users, one row each"""
+        matrix = np.zeros((len(users), self.dims), dtype=np.float32)
+        if not users:
+            return matrix
+
+        for row, user in enumerate(users):
+            vec = matrix[row]
+            for field, weight in FIELD_WEIGHTS.items():
+                text = (getattr(user, field) or "").lower()
+                tokens = [text.strip()] if field == "location" else TOKEN_RE.findall(text)
+                for token in filter(None, tokens):
+                    col, sign = _hash_token(field, token)
+                    vec[col] += sign * weight
+            for offset, field in enumerate(("mental_health", "wellness", "engage")):
+                value = getattr(user, field)
+                if value is not None:
+                    vec[HASH_DIMS + offset] = min(value, SCORE_MAX) / SCORE_MAX * SCORE_WEIGHT
+
+        matrix[:, HASH_DIMS + 3:] = self._vocabulary.to_dense(
+            self._vocabulary.encode_batch(self._tags(users))) * TAG_WEIGHT
+
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms > 0, norms, 1)
+
+    @staticmethod
+    def _tags(users: List) -> List[List[str]]:
+        """Stored analysis tags per user, or the rule-based tags for users not analysed yet"""
+        from .models import Analysis
+        stored = {user_id: primary + secondary for user_id, primary, secondary in
+                  Analysis.objects.filter(user_id__in=[u.pk for u in users])
+                  .values_list("user_id", "primary_tags", "secondary_tags")}
+        missing = [u for u in users if u.pk not in stored]
+        if missing:
+            triaged = get_grouper().pretriage_engine.triage([veteran_profile_for(u) for u in missing])
+            for user, result in zip(missing, triaged):
+                stored[user.pk] = result.analysis["primary_tags"] + result.analysis["secondary_tags"]
+        return [stored[u.pk] for u in users]
+
+    def encode(self, user) -> np.ndarray:
+        return self.encode_many([user])[0]
+
+    # ---------- maintenance ----------
+    def build(self, users: Iterable) -> None:
+        blocks, ids = [], []
+        batch = []
+        for user in users:
+            batch.append(user)
+            if len(batch) == BUILD_BATCH:
+                blocks.append(self.encode_many(batch))
+                ids.extend(u.pk for u in batch)
+                batch = []
+        blocks.append(self.encode_many(batch))
+        ids.extend(u.pk for u in batch)
+
+        with self._lock:
+            self._matrix = np.vstack(blocks)
+            self._ids = np.array(ids, dtype=np.int64)
+            self._rows = {int(pk): row for row, pk in enumerate(ids)}
+            self._free = []
+            self.built_at = time.monotonic()
+
+    def upsert(self, user) -> None:
+        vec = self.encode(user)
+        with self._lock:
+            if self._successor is not None:
+                return self._successor.upsert(user)
+            if self._changes is not None:
+                self._changes[user.pk] = user
+            row = self._rows.get(user.pk)
+            if row is None:
+                row = self._allocate_row()
+                self._rows[user.pk] = row
+                self._ids[row] = user.pk
+            self._matrix[row] = vec
+
+    def remove(self, user_id: int) -> None:
+        with self._lock:
+            if self._successor is not None:
+                return self._successor.remove(user_id)
+            if self._changes is not None:
+                self._changes[user_id] = None
+            row = self._rows.pop(user_id, None)
+            if row is not None:
+                self._matrix[row] = 0
+                self._ids[row] = -1
+                self._free.append(row)
+
+    def track_changes(self, enabled: bool = True) -> None:
+        """Start (or stop) recording ``upsert`` / ``remove`` calls, e.g. while a replacement is built"""
+        with self._lock:
+            self._changes = {} if enabled else None
+
+    def hand_over(self, successor: "SimilarityIndex") -> None:
+        """Replay the recorded changes onto ``successor`` and forward all later ones to it"""
+        with self._lock:
+            for user_id, user in (self._changes or {}).items():
+                if user is None:
+                    successor.remove(user_id)
+                else:
+                    successor.upsert(user)
+            self._changes = None
+            self._successor = successor
+
+    def _allocate_row(self) -> int:
+        if not self._free:
+            old = len(self._matrix)
+            grown = max(old * 2, 16)
+            self._matrix = np.vstack([self._matrix, np.zeros((grown - old, self.dims), np.float32)])
+            self._ids = np.concatenate([self._ids, np.full(grown - old, -1, np.int64)])
+            self._free = list(range(grown - 1, old - 1, -1))
+        return self._free.pop()
+
+    # ---------- queries ----------
+    def top_k(self, user_id: int, k: int = 10,
+              exclude: Iterable[int] = ()) -> List[Tuple[int, float]]:
+        """(user_id, cosine similarity) of the ``k`` most similar other users"""
+        with self._lock:
+            row = self._rows.get(user_id)
+            if row is None:
+                return []
+            scores = self._matrix @ self._matrix[row]
+            scores[self._ids < 0] = -np.inf
+            scores[row] = -np.inf
+            excluded = [self._rows[pk] for pk in exclude if pk in self._rows]
+            scores[excluded] = -np.inf
+
+            k = min(k, int(np.isfinite(scores).sum()))
+            if k <= 0:
+                return []
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind="stable")]
+            return [(int(self._ids[i]), float(scores[i])) for i in top]
+
+
+_index: Optional[SimilarityIndex] = None
+_index_lock = threading.Lock()
+_rebuilding = threading.Event()
+
+
+def _build_index() -> SimilarityIndex:
+    from .models import CustomUser
+    index = SimilarityIndex()
+    index.build(CustomUser.objects.filter(is_active=True).only(
+        "id", "username", "first_name", "last_name", "email",
+        "job", "hobby", "location", "mental_health", "wellness", "engage", "age", "description",
+    ).iterator(chunk_size=BUILD_BATCH))
+    return index
+
+
+def _rebuild_in_background() -> None:
+    global _index
+    try:
+        with _index_lock:
+            current = _index
+        current.track_changes()
+        try:
+            index = _build_index()
+        except Exception:
+            current.track_changes(False)
+            raise
+        # 构建期间 signals 仍在更新旧索引：先补上这些改动，之后的改动直接转给新索引
+        current.hand_over(index)
+        with _index_lock:
+            _index = index
+    except Exception:
+        logger.exception("Similarity index rebuild failed")
+    finally:
+        _rebuilding.clear()
+        connection.close()   # 后台线程自己的数据库连接
+
+
+def get_index(build: bool = True) -> Optional[SimilarityIndex]:
+    """
+    Process-wide index
+
+    The first call builds it synchronously. Once it is older than
+    ``SIMILARITY_INDEX_TTL`` it is rebuilt on a background thread while the
+    current one keeps serving queries.
+    """
+    global _index
+    with _index_lock:
+        if not build:
+            return _index
+        if _index is None:
+            _index = _build_index()
+            return _index
+        ttl = getattr(settings, "SIMILARITY_INDEX_TTL", 300)
+        if ttl and time.monotonic() - _index.built_at > ttl and not _rebuilding.is_set():
+            _rebuilding.set()
+            threading.Thread(target=_rebuild_in_background, daemon=True,
+                             name="similarity-index-rebuild").start()
+        return _index
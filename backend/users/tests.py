@@ -1,3 +1,1863 @@
-from django.test import TestCase
+import asyncio
+import importlib.util
+import io
+import itertools
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+from django.core.cache import cache as django_cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from benchmarks import run as benchmark
+from benchmarks.fake_ollama import FakeOllamaConfig, FakeOllamaServer
+from models import emotion_model, emotion_onnx, metrics
+from models.DynamicGrouping_Llama2B import LlamaVeteranGrouper, VeteranProfile
+from models.emotion_batcher import MicroBatcher
+from models.emotion_sidecar import EmotionSidecarServer, SidecarClient, SidecarError
+from models.group_formation import GroupFormationEngine
+from models.llm_cache import MemoryLRUCache, SQLiteCache, TwoTierCache, make_cache_key
+from models.llm_scheduler import (
+    BACKGROUND, CRISIS, INTAKE, OUTREACH, LLMScheduler, SchedulerTimeout, priority_scope,
+)
+from models.llm_transport import (
+    AsyncTransport, LlamaTransportError, RetryPolicy, SyncTransport, ThreadedAsyncTransport, TokenUsage,
+)
+from models.pretriage import (
+    ROUTE_CRISIS, ROUTE_LLM, ROUTE_RULES, PreTriageEngine, has_crisis_signals,
+)
+from models.structured_output import (
+    COMPLETE, INVALID, PARTIAL, IncrementalJSONValidator, analysis_schema,
+)
+from models.tag_index import TagVocabulary
+from . import importer, jobs, similarity
+from .grouping import quick_analysis_for, veteran_profile_for
+from .models import Analysis, AnalysisJob, CustomUser, UserConnection
+
+LLM_ANALYSIS = {
+    "primary_tags": ["PTSD", "Sleep issues", "Seeking therapy"],
+    "secondary_tags": ["Peer support"],
+    "risk_level": "Medium",
+    "priority_score": 9,
+    "intervention_needed": False,
+    "recommended_groups": ["PTSD Peer Circle"],
+    "resource_priorities": ["VA mental health", "Sleep clinic", "Peer mentor"],
+    "reasoning": "Sleep issues and PTSD topics without current support.",
+}
+
+
+class FakeTransport:
+    """Stands in for ``SyncTransport``; every generation returns ``LLM_ANALYSIS``"""
+
+    def __init__(self):
+        self.up = True
+        self.calls = 0
+        self.prompts = []
+
+    def _request(self, payload):
+        self.calls += 1
+        self.prompts.append(payload["prompt"])
+        if not self.up:
+            raise LlamaTransportError("connection refused")
+
+    def post_json(self, path, payload, timeout=None):
+        self._request(payload)
+        return {"response": json.dumps(LLM_ANALYSIS), "done": True}
+
+    def stream_json_lines(self, path, payload, timeout=None):
+        self._request(payload)
+        yield {"response": json.dumps(LLM_ANALYSIS), "done": False}
+        yield {"response": "", "done": True}
+
+    def close(self):
+        pass
+
+
+def make_grouper(**kwargs) -> LlamaVeteranGrouper:
+    transport = FakeTransport()
+    return LlamaVeteranGrouper(transport=transport, async_transport=ThreadedAsyncTransport(transport),
+                               **kwargs)
+
+
+def make_profile(**kwargs) -> VeteranProfile:
+    values = dict(full_name="Jo Doe", email="jo@example.com", branch_of_service="Army",
+                  city="Austin", sleep_issues=True, topics_of_interest=["PTSD"])
+    values.update(kwargs)
+    return VeteranProfile(**values)
+
+
+class ReanalysisTests(SimpleTestCase):
+    def setUp(self):
+        self.grouper = make_grouper()
+        self.profile = make_profile()
+        self.previous, action = self.grouper.reanalyze(self.profile)
+        self.assertEqual(action, "analyzed")
+        self.assertEqual(self.previous["analysis_source"], "llm")
+
+    def test_unchanged_profile_is_skipped(self):
+        analysis, action = self.grouper.reanalyze(make_profile(), self.previous)
+        self.assertEqual(action, "skipped")
+        self.assertIs(analysis, self.previous)
+        self.assertEqual(self.grouper.transport.calls, 1)
+
+    def test_name_and_email_do_not_rerun_the_llm(self):
+        _, action = self.grouper.reanalyze(make_profile(full_name="Jo Smith", email="js@example.com"),
+                                           self.previous)
+        self.assertEqual(action, "skipped")
+
+    def test_city_change_only_reenhances(self):
+        analysis, action = self.grouper.reanalyze(make_profile(city="Dallas"), self.previous)
+        self.assertEqual(action, "enhanced")
+        self.assertEqual(analysis["local_group"], "Dallas Local Veterans")
+        self.assertNotIn("Austin Local Veterans", analysis["recommended_groups"])
+        self.assertEqual(self.grouper.transport.calls, 1)
+
+    def test_prompt_input_change_reanalyzes(self):
+        _, action = self.grouper.reanalyze(make_profile(substance_use=True), self.previous)
+        self.assertEqual(action, "analyzed")
+        self.assertEqual(self.grouper.transport.calls, 2)
+
+    def test_model_or_prompt_style_change_reanalyzes(self):
+        for grouper in (make_grouper(model_name="llama3"), make_grouper(prompt_style="verbose")):
+            _, action = grouper.reanalyze(make_profile(), self.previous)
+            self.assertEqual(action, "analyzed")
+
+    def test_output_mode_or_tag_vocabulary_change_reanalyzes(self):
+        self.assertEqual(make_grouper().reanalyze(make_profile(), self.previous)[1], "skipped")
+        edited = make_grouper()
+        edited.available_tags.append("Caregiver")
+        edited.refresh_tag_vocabulary()
+        for grouper in (make_grouper(structured_output=False), edited):
+            _, action = grouper.reanalyze(make_profile(), self.previous)
+            self.assertEqual(action, "analyzed")
+
+    def test_fallback_is_replaced_once_the_llm_is_back(self):
+        self.grouper.transport.up = False
+        fallback, action = self.grouper.reanalyze(self.profile)
+        self.assertEqual((action, fallback["analysis_source"]), ("analyzed", "fallback"))
+
+        self.grouper.transport.up = True
+        analysis, action = self.grouper.reanalyze(self.profile, fallback)
+        self.assertEqual((action, analysis["analysis_source"]), ("analyzed", "llm"))
+
+    def test_reanalyze_many_only_sends_stale_profiles(self):
+        results = self.grouper.reanalyze_many([
+            (make_profile(), self.previous),
+            (make_profile(city="Dallas"), self.previous),
+            (make_profile(substance_use=True), self.previous),
+        ])
+        self.assertEqual([action for _, action in results], ["skipped", "enhanced", "analyzed"])
+        self.assertEqual(self.grouper.transport.calls, 2)
+
+
+class AnalysisJobTests(TestCase):
+    def setUp(self):
+        self.grouper = make_grouper()
+        patcher = mock.patch("users.jobs.get_grouper", return_value=self.grouper)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = CustomUser.objects.create(username="jo", location="Austin", hobby="PTSD")
+
+    def run_next(self, worker_id="test/0"):
+        AnalysisJob.objects.filter(status=AnalysisJob.PENDING).update(run_after=timezone.now())
+        job = jobs.claim_next(worker_id)
+        self.assertIsNotNone(job)
+        jobs.run_job(job, worker_id)
+        job.refresh_from_db()
+        return job
+
+    def test_success_stores_analysis(self):
+        jobs.enqueue_analysis(self.user.pk)
+        job = self.run_next()
+        self.assertEqual(job.status, AnalysisJob.SUCCEEDED)
+        self.assertEqual(Analysis.objects.get(user=self.user).analysis_source, "llm")
+
+    def test_fallback_is_retried_with_backoff(self):
+        self.grouper.transport.up = False
+        jobs.enqueue_analysis(self.user.pk)
+        job = jobs.claim_next("test/0")
+        jobs.run_job(job, "test/0")
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (AnalysisJob.PENDING, 1))
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertFalse(Analysis.objects.filter(user=self.user).exists())
+
+        self.grouper.transport.up = True
+        job = self.run_next()
+        self.assertEqual((job.status, job.attempts), (AnalysisJob.SUCCEEDED, 2))
+        self.assertEqual(Analysis.objects.get(user=self.user).analysis_source, "llm")
+
+    @override_settings(ANALYSIS_JOB_MAX_ATTEMPTS=1)
+    def test_last_attempt_keeps_fallback(self):
+        self.grouper.transport.up = False
+        jobs.enqueue_analysis(self.user.pk)
+        self.assertEqual(self.run_next().status, AnalysisJob.SUCCEEDED)
+        self.assertEqual(Analysis.objects.get(user=self.user).analysis_source, "fallback")
+
+    def test_stored_fallback_is_replaced(self):
+        self.grouper.transport.up = False
+        Analysis.store(self.user.pk, self.grouper.reanalyze(veteran_profile_for(self.user))[0])
+        self.grouper.transport.up = True
+        calls = self.grouper.transport.calls
+
+        jobs.enqueue_analysis(self.user.pk)
+        job = self.run_next()
+        self.assertEqual((job.status, job.attempts), (AnalysisJob.SUCCEEDED, 1))
+        self.assertEqual(self.grouper.transport.calls, calls + 1)
+        self.assertEqual(Analysis.objects.get(user=self.user).analysis_source, "llm")
+
+    def test_unchanged_profile_is_skipped(self):
+        jobs.enqueue_analysis(self.user.pk)
+        self.run_next()
+        jobs.enqueue_analysis(self.user.pk)
+        job = self.run_next()
+        self.assertEqual(job.status, AnalysisJob.SUCCEEDED)
+        self.assertEqual(self.grouper.transport.calls, 1)
+
+    @override_settings(ANALYSIS_JOB_MAX_ATTEMPTS=2)
+    def test_errors_retry_then_fail(self):
+        jobs.enqueue_analysis(self.user.pk)
+        with mock.patch.object(self.grouper, "reanalyze", side_effect=RuntimeError("boom")):
+            self.assertEqual(self.run_next().status, AnalysisJob.PENDING)
+            job = self.run_next()
+        self.assertEqual((job.status, job.attempts), (AnalysisJob.FAILED, 2))
+        self.assertIn("boom", job.last_error)
+
+    def test_expired_lease_is_requeued_unless_renewed(self):
+        mine, theirs = (CustomUser.objects.create(username=name) for name in ("mine", "theirs"))
+        for user, worker_id in ((mine, "host:1/0"), (theirs, "host:12/0")):
+            jobs.enqueue_analysis(user.pk)
+            AnalysisJob.objects.filter(user=user).update(
+                status=AnalysisJob.RUNNING, locked_by=worker_id, attempts=1,
+                locked_at=timezone.now() - timedelta(minutes=10))
+
+        self.assertEqual(jobs.renew_leases("host:1"), 1)
+        self.assertEqual(jobs.requeue_stale(lease_seconds=60), 1)
+        self.assertEqual(AnalysisJob.objects.get(user=mine).status, AnalysisJob.RUNNING)
+        self.assertEqual(AnalysisJob.objects.get(user=theirs).status, AnalysisJob.PENDING)
+
+    def events(self, job, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.get(f"/api/v1/jobs/{job.pk}/events/")
+
+    def test_events_until_the_job_finishes(self):
+        job = jobs.enqueue_analysis(self.user.pk)
+        self.run_next()
+        response = self.events(job, self.user)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        body = b"".join(response).decode()
+        self.assertEqual([line for line in body.splitlines() if line.startswith("event:")],
+                         ["event: status", "event: done"])
+        self.assertIn('"status": "succeeded"', body)
+
+    def test_events_time_out_without_blocking(self):
+        job = jobs.enqueue_analysis(self.user.pk)
+        with mock.patch("users.async_views.JOB_EVENTS_TIMEOUT", 0), \
+                mock.patch("users.async_views.time.sleep", side_effect=AssertionError):
+            body = b"".join(self.events(job, self.user)).decode()
+        self.assertIn("event: status", body)
+        self.assertIn("event: timeout", body)
+
+    def test_events_of_other_users_jobs_are_hidden(self):
+        job = jobs.enqueue_analysis(self.user.pk)
+        other = CustomUser.objects.create(username="sam")
+        self.assertEqual(self.events(job, other).status_code, 404)
+        other.is_staff = True
+        other.save()
+        self.assertEqual(self.events(job, other).status_code, 200)
+        self.assertEqual(APIClient().get(f"/api/v1/jobs/{job.pk}/events/").status_code, 401)
+
+
+class OutreachTests(TestCase):
+    def setUp(self):
+        self.grouper = make_grouper()
+        for module in ("users.views", "users.async_views", "users.grouping"):
+            patcher = mock.patch(f"{module}.get_grouper", return_value=self.grouper)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.user = CustomUser.objects.create(username="jo", location="Austin")
+        self.other = CustomUser.objects.create(username="sam")
+        Analysis.store(self.user.pk, dict(LLM_ANALYSIS, risk_level="High", analysis_source="llm"))
+        self.client = APIClient()
+
+    def get_both(self, **headers):
+        return [self.client.get(f"/api/v1/users/{self.user.pk}/{path}/", **headers)
+                for path in ("outreach/stream", "outreach")]
+
+    def test_requires_authentication(self):
+        self.assertEqual([r.status_code for r in self.get_both()], [401, 401])
+        self.assertEqual(self.grouper.transport.calls, 0)
+
+    def test_other_users_are_forbidden(self):
+        self.client.force_authenticate(self.other)
+        self.assertEqual([r.status_code for r in self.get_both()], [403, 403])
+        self.assertEqual(self.grouper.transport.calls, 0)
+
+    def test_staff_may_read(self):
+        self.other.is_staff = True
+        self.other.save()
+        self.client.force_authenticate(self.other)
+        self.assertEqual([r.status_code for r in self.get_both()], [200, 200])
+
+    def test_uses_stored_analysis(self):
+        self.client.force_authenticate(self.user)
+        stream, message = self.get_both()
+        self.assertIn(b"event: done", b"".join(stream.streaming_content))
+        self.assertIn("message", message.json())
+        self.assertEqual(len(self.grouper.transport.prompts), 2)
+        for prompt in self.grouper.transport.prompts:
+            self.assertIn("Risk level: High", prompt)
+            self.assertIn("Current needs: PTSD, Sleep issues, Seeking therapy", prompt)
+
+
+class TagIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.grouper = make_grouper()
+        self.analyses = [
+            {"primary_tags": ["PTSD", "Homeless"], "secondary_tags": ["Unemployed"]},
+            {"primary_tags": ["PTSD"], "secondary_tags": ["Bogus"]},
+            {"primary_tags": ["Anxiety"], "secondary_tags": []},
+            {"primary_tags": [], "secondary_tags": []},
+        ]
+        self.index = self.grouper.build_tag_index(self.analyses)
+
+    def test_weighted_tags_are_in_the_vocabulary(self):
+        self.assertLessEqual(set(self.grouper.priority_weights), set(self.grouper.tag_vocabulary.tags))
+
+    def test_queries(self):
+        self.assertEqual(self.index.all_of(["PTSD"]).tolist(), [0, 1])
+        self.assertEqual(self.index.all_of(["PTSD", "Homeless"]).tolist(), [0])
+        self.assertEqual(self.index.any_of(["Homeless", "Anxiety"]).tolist(), [0, 2])
+        self.assertEqual(self.index.none_of(["PTSD"]).tolist(), [2, 3])
+        self.assertEqual(self.index.all_of([]).tolist(), [0, 1, 2, 3])
+
+    def test_unknown_tags_raise(self):
+        for query in (self.index.all_of, self.index.any_of, self.index.none_of):
+            with self.assertRaises(KeyError):
+                query(["PTSD", "Bogus"])
+
+    def test_batch_scores_match_weights(self):
+        scores = self.grouper.score_analyses(self.analyses)
+        self.assertEqual(scores.tolist(), [7 + 9 + 7, 7, 5, 0])
+        self.assertEqual(self.analyses[0]["calculated_priority_score"], 23)
+
+    def test_dense_round_trip(self):
+        vocabulary = self.grouper.tag_vocabulary
+        self.assertEqual(vocabulary.decode(self.index.bitsets[0]), ["Unemployed", "PTSD", "Homeless"])
+        self.assertEqual(self.index.dense().sum(axis=1).tolist(), [3, 1, 1, 0])
+
+
+class TriageTests(TestCase):
+    def setUp(self):
+        self.staff = CustomUser.objects.create(username="staff", is_staff=True)
+        self.scores = {}
+        for i in range(9):
+            user = CustomUser.objects.create(username=f"vet{i}", is_active=i != 8)
+            score = [20, 10, 10, 10, 10, 5, 5, 1, 30][i]   # 大量并列分数
+            self.scores[user.pk] = score
+            Analysis.store(user.pk, {
+                "primary_tags": ["PTSD"], "risk_level": "High" if score >= 10 else "Low",
+                "priority_score": 5, "calculated_priority_score": score,
+                "intervention_needed": score >= 20, "analysis_source": "llm",
+            })
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def expected(self):
+        ordered = Analysis.objects.filter(user__is_active=True).order_by(
+            "-calculated_priority_score", "-priority_score", "-analyzed_at", "pk")
+        return [analysis.user_id for analysis in ordered]
+
+    def test_staff_only(self):
+        client = APIClient()
+        self.assertEqual(client.get("/api/v1/triage/").status_code, 401)
+        client.force_authenticate(CustomUser.objects.get(username="vet0"))
+        self.assertEqual(client.get("/api/v1/triage/").status_code, 403)
+
+    def test_highest_priority_first_without_inactive_users(self):
+        results = self.client.get("/api/v1/triage/").json()["results"]
+        self.assertEqual([r["user_id"] for r in results], self.expected())
+        self.assertEqual(results[0]["calculated_priority_score"], 20)
+
+    def test_filters(self):
+        response = self.client.get("/api/v1/triage/?risk_level=high&min_score=10&intervention_needed=false")
+        scores = [r["calculated_priority_score"] for r in response.json()["results"]]
+        self.assertEqual(scores, [10, 10, 10, 10])
+        self.assertEqual(self.client.get("/api/v1/triage/?risk_level=Severe").status_code, 400)
+        self.assertEqual(self.client.get("/api/v1/triage/?min_score=x").status_code, 400)
+
+    def test_cursor_pages_through_ties_both_ways(self):
+        url, pages = "/api/v1/triage/?page_size=2", []
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                body = self.client.get(url).json()
+            self.assertFalse(any("COUNT(" in q["sql"] for q in queries.captured_queries))
+            pages.append([r["user_id"] for r in body["results"]])
+            url = body["next"]
+            last = body
+        seen = [pk for page in pages for pk in page]
+        self.assertEqual(seen, self.expected())
+
+        back, url = [], last["previous"]
+        while url:
+            body = self.client.get(url).json()
+            back.insert(0, [r["user_id"] for r in body["results"]])
+            url = body["previous"]
+        self.assertEqual(back, pages[:-1])
+
+    def test_invalid_cursor(self):
+        for cursor in ("bogus", "cD1bMSwyXQ=="):   # 后者解码为 p=[1,2]
+            self.assertEqual(self.client.get(f"/api/v1/triage/?cursor={cursor}").status_code, 404)
+
+
+class AsyncGrouperTests(SimpleTestCase):
+    def test_owned_transport_is_per_loop_and_closed_with_it(self):
+        grouper = LlamaVeteranGrouper(transport=FakeTransport())
+
+        async def use():
+            transport = grouper.async_transport
+            self.assertIs(grouper.async_transport, transport)
+            return transport
+
+        with ThreadPoolExecutor(4) as pool:
+            transports = list(pool.map(lambda _: asyncio.run(use()), range(8)))
+        self.assertEqual(len({id(t) for t in transports}), 8)
+        self.assertTrue(all(t.client.is_closed for t in transports))
+        self.assertEqual(grouper._async_transports, {})
+
+    def test_aclose_closes_the_running_loops_transport(self):
+        grouper = LlamaVeteranGrouper(transport=FakeTransport())
+
+        async def use():
+            transport = grouper.async_transport
+            await grouper.aclose()
+            self.assertTrue(transport.client.is_closed)
+            self.assertIsNot(grouper.async_transport, transport)
+
+        asyncio.run(use())
+        self.assertEqual(grouper._async_transports, {})
+
+    def test_cache_is_not_read_on_the_event_loop(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = TwoTierCache.create(f"{tmp}/llm.sqlite3")
+            grouper = make_grouper(cache=cache)
+            threads = []
+            for name in ("get_with_timestamp", "set"):
+                method = getattr(cache.disk, name)
+                setattr(cache.disk, name, lambda *a, _m=method: threads.append(threading.get_ident()) or _m(*a))
+
+            async def analyze():
+                threads.clear()
+                analysis = await grouper.generate_structured_async("prompt", "system")
+                text = await grouper.call_llama_async("outreach prompt", "system")
+                self.assertTrue(threads)
+                self.assertNotIn(threading.get_ident(), threads)
+                return analysis, text
+
+            first = asyncio.run(analyze())
+            cache.memory.clear()
+            self.assertEqual(asyncio.run(analyze()), first)   # 从磁盘缓存读取
+            self.assertEqual(grouper.transport.calls, 2)
+            self.assertEqual(cache.stats.disk_hits, 2)
+            cache.close()
+
+
+class TransportTests(SimpleTestCase):
+    """The HTTP transports against the fake Ollama server"""
+    RETRIES = RetryPolicy(max_retries=2, backoff_base=0.001)
+
+    payload = {"model": "fake", "system": "system", "prompt": "x" * 40, "stream": False}
+
+    def start_server(self, **config):
+        config = dict(dict(latency_ms=1, jitter_ms=0, tokens_per_second=0, seed=1), **config)
+        server = FakeOllamaServer(FakeOllamaConfig(**config)).start()
+        self.addCleanup(server.stop)
+        return server
+
+    def post(self, endpoint, asynchronous):
+        """``post_json`` over a fresh sync or async transport"""
+        if not asynchronous:
+            transport = SyncTransport(endpoint, retry_policy=self.RETRIES)
+            try:
+                return transport.post_json("/api/generate", self.payload)
+            finally:
+                transport.close()
+
+        async def post():
+            transport = AsyncTransport(endpoint, retry_policy=self.RETRIES)
+            try:
+                return await transport.post_json("/api/generate", self.payload)
+            finally:
+                await transport.aclose()
+        return asyncio.run(post())
+
+    def test_5xx_is_retried(self):
+        for asynchronous in (False, True):
+            with self.subTest(asynchronous=asynchronous):
+                server = self.start_server()
+                # 两次 503，第三次成功（第二个 False 是 malformed 的判定）
+                with mock.patch.object(server, "_roll", side_effect=[True, True, False, False]):
+                    data = self.post(server.endpoint, asynchronous)
+                self.assertTrue(data["done"])
+                self.assertEqual((server.stats.requests, server.stats.errors), (3, 2))
+
+    def test_gives_up_after_max_retries(self):
+        server = self.start_server(error_rate=1.0)
+        for asynchronous in (False, True):
+            with self.subTest(asynchronous=asynchronous):
+                with self.assertRaises(LlamaTransportError) as raised:
+                    self.post(server.endpoint, asynchronous)
+                self.assertEqual(raised.exception.status_code, 503)
+                self.assertIn("after 3 attempts", str(raised.exception))
+        self.assertEqual(server.stats.requests, 6)
+
+    def test_connection_errors_are_retried(self):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            endpoint = "http://127.0.0.1:%d" % sock.getsockname()[1]
+        for asynchronous in (False, True):
+            with self.subTest(asynchronous=asynchronous):
+                with mock.patch.object(self.RETRIES, "delay", wraps=self.RETRIES.delay) as delay:
+                    with self.assertRaises(LlamaTransportError) as raised:
+                        self.post(endpoint, asynchronous)
+                self.assertIsNone(raised.exception.status_code)
+                self.assertEqual(delay.call_count, 3)
+
+    def test_deadline_covers_a_trickling_stream(self):
+        # 每个 token 间隔 50ms：单次读取不会超时，整个响应需要数秒
+        server = self.start_server(tokens_per_second=20)
+        payload = dict(self.payload, stream=True)
+        sync = SyncTransport(server.endpoint)
+        self.addCleanup(sync.close)
+
+        def read_sync():
+            return list(sync.stream_json_lines("/api/generate", payload, timeout=0.3))
+
+        def read_async(transport=None):
+            async def read():
+                lines = (transport or AsyncTransport(server.endpoint)).stream_json_lines(
+                    "/api/generate", payload, timeout=0.3)
+                return [line async for line in lines]
+            return asyncio.run(read())
+
+        for read in (read_sync, read_async, lambda: read_async(ThreadedAsyncTransport(sync))):
+            started = time.monotonic()
+            with self.assertRaisesRegex(LlamaTransportError, "Deadline exceeded"):
+                read()
+            self.assertLess(time.monotonic() - started, 1.5)
+
+    def test_closing_a_threaded_stream_waits_for_the_pending_read(self):
+        server = self.start_server(tokens_per_second=10)
+        sync = SyncTransport(server.endpoint)
+        self.addCleanup(sync.close)
+        transport = ThreadedAsyncTransport(sync)
+
+        async def cancel_mid_read():
+            async def consume():
+                async for _ in transport.stream_json_lines("/api/generate", dict(self.payload, stream=True)):
+                    pass
+            task = asyncio.create_task(consume())
+            await asyncio.sleep(0.25)   # 此时 next() 正在工作线程里等待下一个 token
+            task.cancel()
+            await task
+
+        with self.assertRaises(asyncio.CancelledError):
+            asyncio.run(cancel_mid_read())
+
+    def test_token_usage_accumulates(self):
+        usage = TokenUsage()
+        usage.record({"prompt_eval_count": 100, "eval_count": 20, "prompt_eval_duration": 5_000_000})
+        usage.record({"prompt_eval_count": 50, "eval_count": 10})
+        self.assertEqual(usage.as_dict(), {"calls": 2, "prompt_tokens": 150, "completion_tokens": 30,
+                                           "prompt_eval_ms": 5.0, "mean_prompt_tokens": 75.0})
+
+    def test_grouper_records_the_servers_token_counts(self):
+        grouper = LlamaVeteranGrouper(llama_endpoint=self.start_server().endpoint, retry_policy=self.RETRIES)
+        self.addCleanup(grouper.close)
+        with mock.patch.object(grouper.transport, "stream_json_lines",
+                               wraps=grouper.transport.stream_json_lines) as stream:
+            for name in ("Jo Doe", "Sam Roe"):
+                self.assertEqual(grouper.reanalyze(make_profile(full_name=name))[1], "analyzed")
+        payloads = [call.args[1] for call in stream.call_args_list]
+        self.assertEqual(grouper.token_usage.calls, 2)
+        self.assertEqual(grouper.token_usage.prompt_tokens,
+                         sum((len(p["system"]) + len(p["prompt"])) // 4 for p in payloads))
+        self.assertGreater(grouper.token_usage.completion_tokens, 0)
+
+
+class PromptTests(SimpleTestCase):
+    PROFILES = [
+        dict(),
+        dict(full_name="Sam Roe", email="sam@example.com", city="Denver", age=61, branch_of_service="Navy",
+             sleep_issues=False, topics_of_interest=["Fishing"], looking_for=["Peer support"]),
+        dict(full_name="Al Poe", housing_status="Unstable", substance_use=True, topics_of_interest=[]),
+    ]
+
+    def test_compact_system_prompt_is_identical_across_profiles(self):
+        grouper = make_grouper()
+        payloads = []
+        stream = grouper.transport.stream_json_lines
+        grouper.transport.stream_json_lines = lambda path, payload, timeout=None: (
+            payloads.append(payload) or stream(path, payload, timeout))
+        for kwargs in self.PROFILES:
+            grouper.analyze_veteran_with_llama(make_profile(**kwargs))
+
+        # 系统提示词逐字节相同，Ollama 才能复用已计算的前缀
+        systems = {payload["system"].encode("utf-8") for payload in payloads}
+        self.assertEqual(len(payloads), len(self.PROFILES))
+        self.assertEqual(systems, {grouper._compact_analysis_system_prompt().encode("utf-8")})
+        self.assertEqual(len({payload["prompt"] for payload in payloads}), len(self.PROFILES))
+        for name in ("Jo Doe", "Sam Roe", "Denver", "Fishing"):
+            self.assertNotIn(name, payloads[0]["system"])
+
+    def test_prompt_token_report_counts_what_the_server_reports(self):
+        server = FakeOllamaServer(FakeOllamaConfig(latency_ms=1, jitter_ms=0, tokens_per_second=0)).start()
+        self.addCleanup(server.stop)
+        grouper = LlamaVeteranGrouper(llama_endpoint=server.endpoint)
+        self.addCleanup(grouper.close)
+        profiles = [make_profile(**kwargs) for kwargs in self.PROFILES]
+
+        report = grouper.prompt_token_report(profiles)
+        self.assertEqual(grouper.prompt_style, "compact")
+        for style in ("verbose", "compact"):
+            grouper.prompt_style = style
+            prompts = [grouper._build_analysis_prompts(profile) for profile in profiles]
+            # 假服务器按每 4 个字符一个 token 计算 prompt_eval_count
+            self.assertEqual(report[style]["prompt_tokens"],
+                             sum((len(prompt) + len(system)) // 4 for prompt, system in prompts))
+            self.assertEqual((report[style]["calls"], report[style]["completion_tokens"]), (3, 3))
+        self.assertLess(report["compact"]["mean_prompt_tokens"], report["verbose"]["mean_prompt_tokens"])
+
+
+class BatchAnalysisTests(SimpleTestCase):
+    """``analyze_many`` / ``iter_analyses`` and their async forms against the fake Ollama server"""
+    FAILING_AGE = 33
+
+    def setUp(self):
+        server = FakeOllamaServer(FakeOllamaConfig(latency_ms=20, jitter_ms=15, tokens_per_second=0,
+                                                   seed=2)).start()
+        self.addCleanup(server.stop)
+        self.in_flight = self.peak = 0
+        lock = threading.Lock()
+        generate = server._generate
+
+        def tracked(handler, body):
+            with lock:
+                self.in_flight += 1
+                self.peak = max(self.peak, self.in_flight)
+            try:
+                if f"Age: {self.FAILING_AGE}" in body["prompt"]:
+                    handler._send_json(503, {"error": "model overloaded"})
+                else:
+                    generate(handler, body)
+            finally:
+                with lock:
+                    self.in_flight -= 1
+
+        patcher = mock.patch.object(server, "_generate", tracked)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.grouper = LlamaVeteranGrouper(llama_endpoint=server.endpoint,
+                                           retry_policy=RetryPolicy(max_retries=1, backoff_base=0.001))
+        self.addCleanup(self.grouper.close)
+        # 城市不进提示词，用 local_group 辨认结果属于哪个输入
+        self.profiles = [make_profile(city=f"City{i}", age=30 + i) for i in range(10)]
+
+    def check(self, results):
+        self.assertEqual([r["local_group"] for r in results], [f"City{i} Local Veterans" for i in range(10)])
+        self.assertEqual([r["analysis_source"] for r in results],
+                         ["fallback" if 30 + i == self.FAILING_AGE else "llm" for i in range(10)])
+        self.assertLessEqual(self.peak, 3)
+        self.assertGreater(self.peak, 1)
+
+    def test_analyze_many(self):
+        self.check(self.grouper.analyze_many(self.profiles, max_concurrency=3, pretriage=False))
+
+    def test_iter_analyses_yields_every_index_once(self):
+        results = dict(self.grouper.iter_analyses(iter(self.profiles), max_concurrency=3, pretriage=False))
+        self.assertEqual(sorted(results), list(range(10)))
+        self.check([results[i] for i in range(10)])
+
+    def test_analyze_many_async(self):
+        self.check(asyncio.run(self.grouper.analyze_many_async(self.profiles, max_concurrency=3,
+                                                               pretriage=False)))
+
+    def test_iter_analyses_async(self):
+        async def collect():
+            return [item async for item in self.grouper.iter_analyses_async(
+                self.profiles, max_concurrency=3, pretriage=False)]
+
+        results = dict(asyncio.run(collect()))
+        self.assertEqual(sorted(results), list(range(10)))
+        self.check([results[i] for i in range(10)])
+
+    def test_max_concurrency_is_validated(self):
+        with self.assertRaises(ValueError):
+            list(self.grouper.iter_analyses(self.profiles, max_concurrency=0))
+
+
+class BenchmarkTests(SimpleTestCase):
+    FAST = ["--latency-ms", "1", "--jitter-ms", "0", "--token-rate", "0", "--concurrency", "4"]
+
+    def run_main(self, *args):
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, "report.json")
+            code = benchmark.main(["--profiles", "20", "--output", output, *self.FAST, *args])
+            with open(output) as f:
+                return code, json.load(f)
+
+    def test_report_schema(self):
+        code, report = self.run_main()
+        self.assertEqual(code, 0)
+        self.assertLessEqual({
+            "report_version", "environment", "config", "profiles", "wall_s", "throughput_per_s",
+            "latency", "routes", "sources", "fallback_rate", "stages", "token_usage",
+            "structured_outcomes", "server",
+        }, set(report))
+        self.assertEqual(report["report_version"], benchmark.REPORT_VERSION)
+        self.assertEqual(report["profiles"], 20)
+        self.assertEqual(sum(report["routes"].values()), 20)
+        self.assertEqual(sum(report["sources"].values()), 20)
+        self.assertEqual(report["latency"]["count"], 20)
+        self.assertEqual(report["token_usage"]["calls"], report["server"]["requests"])
+
+        # instrument() 的包装确实生效：每个画像恰好记录一次端到端耗时
+        stages = report["stages"]
+        self.assertEqual(sum(stages.get(stage, {"count": 0})["count"]
+                             for stage in ("profile_llm", "profile_rules")), 20)
+        for stage in ("pretriage", "prompt_build", "llm_structured", "enhance"):
+            self.assertGreater(stages[stage]["count"], 0, stage)
+        self.assertEqual(stages["llm_structured"]["count"], report["server"]["requests"])
+
+    def test_baseline_regressions_fail_the_run(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            baseline = os.path.join(tmp, "baseline.json")
+            with open(baseline, "w") as f:
+                json.dump({"throughput_per_s": 1e9, "latency": {"p95_ms": 1e-6}}, f)
+            with mock.patch("sys.stderr", io.StringIO()) as stderr:
+                code, _ = self.run_main("--baseline", baseline)
+        self.assertEqual(code, 1)
+        self.assertEqual(stderr.getvalue().count("REGRESSION"), 2)
+
+    def test_compare_to_baseline(self):
+        baseline = {"throughput_per_s": 100.0, "latency": {"p95_ms": 50.0}}
+        compare = benchmark.compare_to_baseline
+        self.assertEqual(compare({"throughput_per_s": 91.0, "latency": {"p95_ms": 54.0}}, baseline, 0.1), [])
+        problems = compare({"throughput_per_s": 89.0, "latency": {"p95_ms": 56.0}}, baseline, 0.1)
+        self.assertEqual(len(problems), 2)
+        self.assertIn("throughput", problems[0])
+        self.assertIn("p95 latency", problems[1])
+        # 缺少指标的基线不算回归
+        self.assertEqual(compare({"throughput_per_s": 1.0, "latency": {}}, {}, 0.1), [])
+
+
+class MetricsTests(SimpleTestCase):
+    def test_histogram_exposition(self):
+        registry = metrics.PrometheusRegistry(buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 5):
+            registry.observe("grouper_stage_seconds", value, {"stage": "parse"})
+        self.assertEqual(registry.render().splitlines(), [
+            "# HELP grouper_stage_seconds Time spent in each grouping pipeline stage",
+            "# TYPE grouper_stage_seconds histogram",
+            'grouper_stage_seconds_bucket{stage="parse",le="0.1"} 2',
+            'grouper_stage_seconds_bucket{stage="parse",le="1"} 3',
+            'grouper_stage_seconds_bucket{stage="parse",le="+Inf"} 4',
+            'grouper_stage_seconds_sum{stage="parse"} 5.650000',
+            'grouper_stage_seconds_count{stage="parse"} 4',
+        ])
+
+    def test_counters_gauges_and_label_escaping(self):
+        registry = metrics.PrometheusRegistry()
+        registry.increment("llm_cache_lookups_total", labels={"result": "hit"})
+        registry.increment("llm_cache_lookups_total", 2, labels={"result": "hit"})
+        registry.increment("custom_total", labels={"view": 'a "b"\\c\nd', "b": "1"})
+        registry.set_gauge("llm_scheduler_in_flight", 3, {"priority": "crisis"})
+        lines = registry.render().splitlines()
+        self.assertIn('llm_cache_lookups_total{result="hit"} 3', lines)
+        self.assertIn("# TYPE llm_cache_lookups_total counter", lines)
+        # 标签按名称排序，反斜杠、引号和换行被转义
+        self.assertIn('custom_total{b="1",view="a \\"b\\"\\\\c\\nd"} 1', lines)
+        self.assertIn("# HELP custom_total custom_total", lines)
+        self.assertIn('llm_scheduler_in_flight{priority="crisis"} 3', lines)
+        self.assertIn("# TYPE llm_scheduler_in_flight gauge", lines)
+
+    def test_failing_sink_does_not_stop_the_others(self):
+        broken = mock.Mock(spec=metrics.MetricsSink)
+        broken.increment.side_effect = RuntimeError("down")
+        before = metrics.registry.counter_value("analysis_jobs_total", {"event": "test"})
+        with mock.patch.object(metrics, "_sinks", [broken, metrics.registry]):
+            with self.assertLogs("models.metrics", "ERROR"):
+                metrics.increment("analysis_jobs_total", labels={"event": "test"})
+        self.assertEqual(metrics.registry.counter_value("analysis_jobs_total", {"event": "test"}), before + 1)
+
+    def test_sinks_load_from_the_environment(self):
+        sinks = [metrics.registry]
+        with mock.patch.object(metrics, "_sinks", sinks), mock.patch.dict(
+                os.environ, {"GROUPER_METRICS_SINKS": " models.metrics.LoggingSink, no.such.Sink,"}):
+            with self.assertLogs("models.metrics", "ERROR") as logs:
+                metrics._load_sinks_from_env()
+        self.assertEqual([type(sink) for sink in sinks], [metrics.PrometheusRegistry, metrics.LoggingSink])
+        self.assertIn("no.such.Sink", logs.output[0])
+
+    def test_endpoint_renders_the_registry(self):
+        metrics.increment("analysis_jobs_total", labels={"event": "scrape-test"})
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/plain; version=0.0.4; charset=utf-8")
+        self.assertIn('analysis_jobs_total{event="scrape-test"}', response.content.decode())
+        self.assertEqual(self.client.post("/metrics").status_code, 405)
+
+    @override_settings(METRICS_TOKEN="s3cret")
+    def test_endpoint_requires_the_token(self):
+        for headers in ({}, {"HTTP_AUTHORIZATION": "Bearer wrong"}, {"HTTP_AUTHORIZATION": "s3cre"}):
+            self.assertEqual(self.client.get("/metrics", **headers).status_code, 401)
+        self.assertEqual(self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer s3cret").status_code, 200)
+
+
+class SchedulerTests(SimpleTestCase):
+    def grant_order(self, scheduler, priorities, pause=0.0):
+        """Queue ``priorities`` behind one held slot, then release it; returns the grant order"""
+        held = scheduler.acquire(INTAKE)
+        order = []
+
+        def wait(priority):
+            scheduler.release(scheduler.acquire(priority))
+            order.append(priority)
+
+        threads = []
+        for queued, priority in enumerate(priorities, 1):
+            threads.append(threading.Thread(target=wait, args=(priority,)))
+            threads[-1].start()
+            while sum(s["waiting"] for s in scheduler.snapshot().values()) < queued:
+                time.sleep(0.001)
+            time.sleep(pause)
+        scheduler.release(held)
+        for thread in threads:
+            thread.join(5)
+        return order
+
+    def test_higher_classes_first(self):
+        scheduler = LLMScheduler(max_concurrency=1, crisis_reserve=0, aging_seconds=60)
+        order = self.grant_order(scheduler, [BACKGROUND, OUTREACH, INTAKE, CRISIS])
+        self.assertEqual(order, [CRISIS, INTAKE, OUTREACH, BACKGROUND])
+
+    def test_aging_prevents_starvation(self):
+        scheduler = LLMScheduler(max_concurrency=1, crisis_reserve=0, aging_seconds=0.01)
+        order = self.grant_order(scheduler, [BACKGROUND, INTAKE], pause=0.1)
+        self.assertEqual(order, [BACKGROUND, INTAKE])
+
+    def test_crisis_uses_reserved_slot(self):
+        scheduler = LLMScheduler(max_concurrency=1, crisis_reserve=1, max_wait=0.05)
+        held = scheduler.acquire(INTAKE)
+        with scheduler.slot(CRISIS):
+            self.assertEqual(scheduler.snapshot()[CRISIS]["in_flight"], 1)
+        with self.assertRaises(SchedulerTimeout):
+            scheduler.acquire(OUTREACH)
+        scheduler.release(held)
+        self.assertEqual(scheduler.snapshot()[OUTREACH]["waiting"], 0)
+
+    def test_async_slots(self):
+        scheduler = LLMScheduler(max_concurrency=1, crisis_reserve=0)
+
+        async def run():
+            order = []
+
+            async def work(priority, delay):
+                await asyncio.sleep(delay)
+                async with scheduler.aslot(priority):
+                    order.append(priority)
+                    await asyncio.sleep(0.01)
+
+            await asyncio.gather(work(INTAKE, 0), work(BACKGROUND, 0.001), work(CRISIS, 0.002))
+            return order
+
+        self.assertEqual(asyncio.run(run()), [INTAKE, CRISIS, BACKGROUND])
+
+    def test_crisis_profiles_get_crisis_priority(self):
+        grouper = make_grouper(scheduler=LLMScheduler())
+        self.assertEqual(grouper._analysis_priority(make_profile(topics_of_interest=["feeling hopeless"])),
+                         CRISIS)
+        self.assertIsNone(grouper._analysis_priority(make_profile()))
+        self.assertEqual(grouper._analysis_priority(make_profile(), {"primary_tags": ["Suicidal risk"]}),
+                         CRISIS)
+        with priority_scope(CRISIS):
+            self.assertEqual(grouper._analysis_priority(make_profile()), CRISIS)
+
+
+class PreTriageTests(SimpleTestCase):
+    ENGAGED = dict(sleep_issues=False, topics_of_interest=["fishing"], daily_wellness_checkins=True,
+                   mood_tracker_optin=True, dd214_uploaded=True, resume_uploaded=True,
+                   emergency_contact="Sam Doe")
+
+    def route(self, engine=None, **kwargs):
+        return (engine or PreTriageEngine()).triage([make_profile(**kwargs)])[0]
+
+    def test_routine_profile_at_min_engagement_skips_llm(self):
+        result = self.route(**self.ENGAGED)
+        self.assertEqual(result.route, ROUTE_RULES)
+        self.assertEqual(result.analysis["analysis_source"], "rules")
+        self.assertFalse(result.analysis["intervention_needed"])
+
+    def test_skip_threshold_controls_rules_route(self):
+        result = self.route(PreTriageEngine(skip_llm_confidence=0.84), **self.ENGAGED)
+        self.assertEqual(result.route, ROUTE_LLM)
+        result = self.route(PreTriageEngine(skip_llm_confidence=0.84),
+                            **dict(self.ENGAGED, willing_to_mentor=True))
+        self.assertEqual(result.route, ROUTE_RULES)
+
+    def test_risk_or_low_engagement_goes_to_llm(self):
+        self.assertEqual(self.route().route, ROUTE_LLM)
+        self.assertEqual(self.route(**dict(self.ENGAGED, emergency_contact="")).route, ROUTE_LLM)
+        self.assertEqual(self.route(**dict(self.ENGAGED, sleep_issues=True)).route, ROUTE_LLM)
+
+    def test_crisis_route(self):
+        for kwargs in ({"topics_of_interest": ["feeling hopeless"]},
+                       {"deployment_history": "I am in crisis"},
+                       {"looking_for": ["help after an overdose"]},
+                       {"deployment_history": "thoughts of self-harm"},
+                       {"housing_status": "Homeless", "substance_use": True}):
+            with self.subTest(**kwargs):
+                result = self.route(**dict(self.ENGAGED, **kwargs))
+                self.assertEqual(result.route, ROUTE_CRISIS)
+                self.assertEqual(result.analysis["risk_level"], "Critical")
+                self.assertTrue(has_crisis_signals(make_profile(**kwargs)))
+
+    def test_crisis_service_names_are_not_crisis(self):
+        kwargs = dict(self.ENGAGED, looking_for=["crisis counseling training"],
+                      topics_of_interest=["crisis intervention volunteering"])
+        result = self.route(**kwargs)
+        self.assertEqual(result.route, ROUTE_LLM)   # 求助于咨询服务，但不是危机
+        self.assertNotIn("Crisis risk", result.analysis["primary_tags"])
+        self.assertFalse(has_crisis_signals(make_profile(**kwargs)))
+
+    def test_unstable_housing_is_tagged_homeless(self):
+        result = self.route(housing_status="Couch surfing")
+        self.assertIn("Homeless", result.analysis["primary_tags"])
+        self.assertIn("Housing assistance (HUD-VASH)", result.analysis["resource_priorities"])
+        self.assertIn("Homeless", make_grouper().available_tags)
+
+    def test_reanalyze_answers_routine_profiles_by_rules(self):
+        grouper = make_grouper()
+        for analysis, action in (grouper.reanalyze(make_profile(**self.ENGAGED)),
+                                 asyncio.run(grouper.reanalyze_async(make_profile(**self.ENGAGED)))):
+            self.assertEqual(action, "analyzed")
+            self.assertEqual((analysis["analysis_source"], analysis["triage_route"]), ("rules", ROUTE_RULES))
+        self.assertEqual(grouper.transport.calls, 0)
+        self.assertEqual(grouper.reanalyze(make_profile(**self.ENGAGED), analysis)[1], "skipped")
+
+    def test_reanalyze_runs_crisis_profiles_at_crisis_priority(self):
+        scheduler = LLMScheduler()
+        grouper = make_grouper(scheduler=scheduler)
+        profile = make_profile(**dict(self.ENGAGED, deployment_history="I am in crisis"))
+        with mock.patch.object(scheduler, "slot", wraps=scheduler.slot) as slot, \
+                mock.patch.object(scheduler, "aslot", wraps=scheduler.aslot) as aslot:
+            analysis, _ = grouper.reanalyze(profile)
+            async_analysis, _ = asyncio.run(grouper.reanalyze_async(profile))
+        self.assertEqual([slot.call_args.args[0], aslot.call_args.args[0]], [CRISIS, CRISIS])
+        for result in (analysis, async_analysis):
+            self.assertEqual((result["analysis_source"], result["triage_route"]), ("llm", ROUTE_CRISIS))
+            self.assertTrue(result["intervention_needed"])
+
+
+        profiles = [make_profile(**self.ENGAGED), make_profile(topics_of_interest=["hopeless"]),
+                    make_profile()]
+        routes = [r.route for r in PreTriageEngine().triage(profiles)]
+        self.assertEqual(routes, [ROUTE_RULES, ROUTE_CRISIS, ROUTE_LLM])
+        self.assertEqual(PreTriageEngine().triage([]), [])
+
+
+class GroupFormationTests(SimpleTestCase):
+    TAGS = ["PTSD", "Job", "Sleep issues", "Peer support"]
+
+    def form(self, analyses, cities=None, **kwargs):
+        engine = GroupFormationEngine(TagVocabulary(self.TAGS, {}), capacity=4, coarse_groups=2, **kwargs)
+        cities = cities or ["Austin"] * len(analyses)
+        profiles = [make_profile(city=city) for city in cities]
+        return engine, engine.form_groups(list(range(len(analyses))), profiles, analyses)
+
+    def test_identical_profiles_stay_within_bounds(self):
+        engine, groups = self.form([{"primary_tags": ["PTSD"], "risk_level": "Medium"}] * 203)
+        self.assertEqual(len(groups), 51)   # ceil(203 / 4)，没有多余的未满小组
+        self.assertLessEqual(max(g.size for g in groups), 4)
+        self.assertEqual(sorted(m for g in groups for m in g.member_ids), list(range(203)))
+        X = engine.featurize([make_profile()] * 203, [{"primary_tags": ["PTSD"]}] * 203)
+        clusters = engine._coarse_clusters(X)
+        self.assertLessEqual(max(map(len, clusters)), engine.max_cluster_size)
+        self.assertEqual(sum(map(len, clusters)), 203)
+
+    def test_groups_by_location_and_tags(self):
+        analyses = ([{"primary_tags": ["PTSD", "Sleep issues"], "risk_level": "High"}] * 4
+                    + [{"primary_tags": ["Job"], "risk_level": "Low"}] * 4)
+        _, groups = self.form(analyses * 2, cities=["Austin"] * 8 + [""] * 8)
+        self.assertEqual(len(groups), 4)
+        for group in groups:
+            self.assertEqual(group.size, 4)
+            self.assertEqual(len({m % 8 < 4 for m in group.member_ids}), 1)
+            self.assertEqual(len({m < 8 for m in group.member_ids}), 1)
+        self.assertEqual({g.location for g in groups}, {"Austin", "Remote"})
+        self.assertIn(["PTSD", "Sleep issues"], [g.top_tags for g in groups])
+
+
+class CacheTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = f"{self.tmp.name}/llm_cache.sqlite3"
+
+    def disk_cache(self, **kwargs) -> TwoTierCache:
+        cache = TwoTierCache(MemoryLRUCache(max_entries=2), SQLiteCache(self.path, **kwargs))
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_key_ignores_whitespace_only(self):
+        key = make_cache_key("llama2", "system", "Analyze  this\n  profile ", {"temperature": 0.1})
+        self.assertEqual(key, make_cache_key("llama2", "system", "Analyze this\nprofile",
+                                             {"temperature": 0.1}))
+        self.assertNotEqual(key, make_cache_key("llama2", "system", "Analyze this\nprofile",
+                                                {"temperature": 0.2}))
+        self.assertNotEqual(key, make_cache_key("mistral", "system", "Analyze this\nprofile",
+                                                {"temperature": 0.1}))
+
+    def test_key_includes_the_output_format(self):
+        schema = analysis_schema(["PTSD", "Anxiety"])
+        key = make_cache_key("llama2", "system", "prompt", {}, schema)
+        self.assertNotEqual(key, make_cache_key("llama2", "system", "prompt", {}))
+        self.assertNotEqual(key, make_cache_key("llama2", "system", "prompt", {}, "json"))
+        self.assertNotEqual(key, make_cache_key("llama2", "system", "prompt", {},
+                                                analysis_schema(["PTSD", "Anxiety", "Depression"])))
+        self.assertEqual(key, make_cache_key("llama2", "system", "prompt", {}, json.loads(json.dumps(schema))))
+
+    def test_structured_and_free_text_generations_do_not_share_entries(self):
+        grouper = make_grouper(cache=TwoTierCache(MemoryLRUCache()))
+        self.assertIsNotNone(grouper.generate_structured("prompt", "system"))
+        self.assertTrue(grouper.call_llama("prompt", "system"))
+        self.assertEqual(grouper.transport.calls, 2)
+        self.assertIsNotNone(grouper.generate_structured("prompt", "system"))
+        self.assertEqual(grouper.transport.calls, 2)
+
+    def test_memory_hit_miss_and_lru_eviction(self):
+        cache = TwoTierCache(MemoryLRUCache(max_entries=2))
+        self.assertIsNone(cache.get("a"))
+        cache.set("a", "1")
+        cache.set("b", "2")
+        self.assertEqual(cache.get("a"), "1")   # a 变为最近使用
+        cache.set("c", "3")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), "3")
+        stats = cache.get_stats()
+        self.assertEqual((stats["memory_hits"], stats["misses"], stats["evictions"]), (2, 2, 1))
+        self.assertEqual(stats["memory_entries"], 2)
+
+    def test_ttl_expiry(self):
+        cache = TwoTierCache.create(self.path, ttl=60)
+        self.addCleanup(cache.close)
+        with mock.patch("models.llm_cache.time.time", return_value=1000.0):
+            cache.set("a", "1")
+        with mock.patch("models.llm_cache.time.time", return_value=1059.0):
+            self.assertEqual(cache.get("a"), "1")
+        with mock.patch("models.llm_cache.time.time", return_value=1061.0):
+            self.assertIsNone(cache.get("a"))
+            self.assertIsNone(cache.disk.get("a"))
+
+    def test_disk_survives_restart_and_promotes(self):
+        self.disk_cache().set("a", "1")
+        cache = self.disk_cache()
+        self.assertEqual(cache.get("a"), "1")
+        self.assertEqual(cache.get("a"), "1")
+        stats = cache.get_stats()
+        self.assertEqual((stats["disk_hits"], stats["memory_hits"], stats["misses"]), (1, 1, 0))
+
+    def test_disk_evicts_least_recently_accessed(self):
+        cache = self.disk_cache(max_entries=2)
+        cache.disk.EVICT_EVERY = 1
+        with mock.patch("models.llm_cache.time.time", side_effect=itertools.count(1.0)):
+            cache.set("a", "1")
+            cache.set("b", "2")
+            cache.disk.get("a")   # b 现在是最久未访问的
+            cache.set("c", "3")
+        self.assertIsNone(cache.disk.get("b"))
+        self.assertEqual(cache.disk.get("a"), "1")
+        self.assertEqual(cache.disk.evictions, 1)
+
+    def test_async_get_and_set(self):
+        cache = self.disk_cache()
+
+        async def run():
+            await cache.aset("a", "1")
+            cache.memory.clear()
+            return await cache.aget("a"), await cache.aget("a"), await cache.aget("missing")
+
+        self.assertEqual(asyncio.run(run()), ("1", "1", None))
+        self.assertEqual(cache.stats.disk_hits, 1)
+
+    def test_grouper_reuses_cached_generation(self):
+        grouper = make_grouper(cache=TwoTierCache.create())
+        first = grouper.analyze_veteran_with_llama(make_profile())
+        second = grouper.analyze_veteran_with_llama(make_profile())
+        self.assertEqual(grouper.transport.calls, 1)
+        self.assertEqual(first["primary_tags"], second["primary_tags"])
+        self.assertEqual(grouper.cache.stats.memory_hits, 1)
+
+
+class ChunkTransport(FakeTransport):
+    """Streams ``chunks`` as Ollama response lines and counts how many were read"""
+
+    def __init__(self, chunks):
+        super().__init__()
+        self.chunks = chunks
+        self.sent = 0
+
+    def stream_json_lines(self, path, payload, timeout=None):
+        self._request(payload)
+        for chunk in self.chunks:
+            self.sent += 1
+            yield {"response": chunk, "done": False}
+        self.sent += 1
+        yield {"response": "", "done": True}
+
+
+class StructuredOutputTests(SimpleTestCase):
+    SCHEMA = analysis_schema(["PTSD", "Sleep issues", "Seeking therapy", "Peer support"])
+    TEXT = json.dumps(LLM_ANALYSIS)
+
+    def feed(self, text, step=7):
+        validator = IncrementalJSONValidator(self.SCHEMA)
+        statuses = [validator.feed(text[i:i + step]) for i in range(0, len(text), step)]
+        return validator, statuses
+
+    def test_complete_object_in_small_chunks(self):
+        for step in (1, 7, len(self.TEXT)):
+            with self.subTest(step=step):
+                validator, statuses = self.feed("  " + self.TEXT + ' trailing {"x"', step)
+                self.assertEqual(validator.finalize(), COMPLETE)
+                self.assertEqual(validator.result, LLM_ANALYSIS)
+                self.assertEqual(validator.text, "  " + self.TEXT)
+
+    def test_braces_and_quotes_inside_strings(self):
+        analysis = dict(LLM_ANALYSIS, reasoning='Said "I\'m {fine}, [really]" \\ twice}')
+        validator, _ = self.feed(json.dumps(analysis), step=3)
+        self.assertEqual(validator.status, COMPLETE)
+        self.assertEqual(validator.result["reasoning"], analysis["reasoning"])
+
+    def test_truncated_stream_is_invalid(self):
+        for cut in (0, 1, len(self.TEXT) // 2, len(self.TEXT) - 1):
+            with self.subTest(cut=cut):
+                validator, _ = self.feed(self.TEXT[:cut])
+                self.assertEqual(validator.status, PARTIAL)
+                self.assertEqual(validator.finalize(), INVALID)
+                self.assertIn("ended before", validator.error)
+
+    def test_invalid_output_fails_as_soon_as_possible(self):
+        cases = {
+            "not json": "expected '{'",
+            '{"risk_level": "Severe", "primary_tags": ["PTSD"]': "risk_level",
+            '{"primary_tags": ["Astrology"], ': "primary_tags[0]",
+            '{"priority_score": 25, ': "above 20",
+            '{"mood": "ok", ': "unexpected field 'mood'",
+            '{"reasoning": "a", "reasoning": "b", ': "duplicate field",
+            '{"primary_tags": [], ': "fewer than 1",
+            '{"reasoning": "a"}': "missing fields",
+            '{"reasoning": tru': None,
+        }
+        for text, error in cases.items():
+            with self.subTest(text=text):
+                validator, statuses = self.feed(text, step=1)
+                if error is None:
+                    self.assertEqual(validator.finalize(), INVALID)
+                    continue
+                self.assertEqual(validator.status, INVALID)
+                self.assertIn(error, validator.error)
+                self.assertEqual(validator.feed('"more"}'), INVALID)
+
+    def test_malformed_value(self):
+        validator, _ = self.feed('{"priority_score": 1 2, ', step=1)
+        self.assertEqual(validator.status, INVALID)
+        self.assertIn("malformed value", validator.error)
+
+    def test_runaway_output(self):
+        validator = IncrementalJSONValidator(self.SCHEMA, max_chars=50)
+        validator.feed('{"reasoning": "' + "x" * 30)
+        self.assertEqual(validator.feed("x" * 30), INVALID)
+        self.assertIn("exceeded 50", validator.error)
+
+    def structured(self, chunks):
+        transport = ChunkTransport(chunks)
+        grouper = LlamaVeteranGrouper(transport=transport,
+                                      async_transport=ThreadedAsyncTransport(transport))
+        return grouper, transport, grouper.generate_structured("prompt")
+
+    def test_grouper_stops_stream_on_invalid_field(self):
+        _, transport, result = self.structured(['{"risk_level": "Severe", ', '"reasoning"', ': "x"}'])
+        self.assertIsNone(result)
+        self.assertEqual(transport.sent, 1)
+
+    def test_grouper_returns_complete_object(self):
+        text = self.TEXT
+        grouper, transport, result = self.structured([text[:40], text[40:], "\n"])
+        self.assertEqual(result, LLM_ANALYSIS)
+        self.assertEqual(transport.sent, 4)
+        self.assertEqual(grouper.structured_outcomes[COMPLETE], 1)
+
+    def test_grouper_discards_truncated_stream(self):
+        grouper, _, result = self.structured([self.TEXT[:40]])
+        self.assertIsNone(result)
+        self.assertEqual(grouper.structured_outcomes[INVALID], 1)
+
+
+class UserListTests(TestCase):
+    def setUp(self):
+        self.users = [CustomUser.objects.create(username=f"vet{i}", email=f"vet{i}@example.com",
+                                                location="Austin", description="long " * 50)
+                      for i in range(5)]
+        self.client = APIClient()
+
+    def test_cursor_pages_in_id_order_without_count(self):
+        url, ids = "/api/v1/users/?page_size=2", []
+        with CaptureQueriesContext(connection) as queries:
+            while url:
+                body = self.client.get(url).json()
+                self.assertLessEqual(len(body["results"]), 2)
+                ids.extend(r["id"] for r in body["results"])
+                url = body["next"]
+        self.assertEqual(ids, [u.pk for u in self.users])
+        self.assertFalse([q for q in queries if "COUNT(" in q["sql"].upper()])
+        self.assertNotIn("count", body)
+
+        back = self.client.get(self.client.get("/api/v1/users/?page_size=2").json()["next"]).json()
+        self.assertEqual([r["id"] for r in self.client.get(back["previous"]).json()["results"]],
+                         [u.pk for u in self.users[:2]])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get("/api/v1/users/?cursor=bogus").status_code, 404)
+
+    def test_sparse_fields_on_list_and_detail(self):
+        with CaptureQueriesContext(connection) as queries:
+            results = self.client.get("/api/v1/users/?fields=id,username").json()["results"]
+        self.assertEqual(results[0], {"id": self.users[0].pk, "username": "vet0"})
+        select = next(q["sql"] for q in queries if "users_customuser" in q["sql"])
+        self.assertNotIn("description", select)
+
+        detail = self.client.get(f"/api/v1/users/{self.users[1].pk}/?fields=email, location").json()
+        self.assertEqual(detail, {"email": "vet1@example.com", "location": "Austin"})
+        self.assertNotIn("password", self.client.get(f"/api/v1/users/{self.users[1].pk}/").json())
+
+    def test_unknown_field_is_rejected(self):
+        response = self.client.get("/api/v1/users/?fields=id,password")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("password", response.json()["fields"])
+
+    def test_connections_newest_first_with_fields(self):
+        owner = self.users[0]
+        self.client.force_authenticate(owner)
+        for peer in self.users[1:4]:
+            self.client.post(f"/api/v1/users/{owner.pk}/connections/", {"connected_user": peer.pk})
+        body = self.client.get(f"/api/v1/users/{owner.pk}/connections/?fields=connected_user&page_size=2").json()
+        self.assertEqual(body["results"], [{"connected_user": self.users[3].pk},
+                                           {"connected_user": self.users[2].pk}])
+        rest = self.client.get(body["next"]).json()["results"]
+        self.assertEqual(rest, [{"connected_user": self.users[1].pk}])
+
+
+class ConnectionTests(TestCase):
+    def setUp(self):
+        self.users = [CustomUser.objects.create(username=f"vet{i}") for i in range(6)]
+        self.owner = self.users[0]
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def connect(self, user, *peers):
+        UserConnection.objects.bulk_create(
+            [UserConnection(user=user, connected_user=peer) for peer in peers])
+
+    def bulk(self, method, ids, user=None):
+        return getattr(self.client, method)(
+            f"/api/v1/users/{(user or self.owner).pk}/connections/bulk/",
+            {"connected_users": ids}, format="json")
+
+    def connected(self, user=None):
+        return set((user or self.owner).connections.values_list("connected_user_id", flat=True))
+
+    def test_self_connect_is_rejected(self):
+        response = self.client.post(f"/api/v1/users/{self.owner.pk}/connections/",
+                                    {"connected_user": self.owner.pk})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(f"/api/v1/users/{self.owner.pk}/connections/",
+                                    {"connected_user": self.users[1].pk})
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post(f"/api/v1/users/{self.owner.pk}/connections/",
+                                    {"connected_user": self.users[1].pk})
+        self.assertEqual(response.json(), {"detail": "Already connected"})
+
+    def test_bulk_create_reports_each_id(self):
+        self.connect(self.owner, self.users[1])
+        ids = [u.pk for u in self.users[1:4]] + [self.owner.pk, 99999]
+        with self.assertNumQueries(4):   # 用户、存在的 id、已有连接、一条批量插入
+            response = self.bulk("post", ids)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), {"created": 2, "already_connected": [self.users[1].pk],
+                                           "not_found": [99999]})
+        self.assertEqual(self.connected(), {u.pk for u in self.users[1:4]})
+
+        self.assertEqual(self.bulk("delete", [self.users[1].pk, self.users[2].pk, 99999]).json(),
+                         {"deleted": 2})
+        self.assertEqual(self.connected(), {self.users[3].pk})
+
+    def test_only_owner_or_staff_may_change_connections(self):
+        victim, peer = self.users[1], self.users[2]
+        urls = (f"/api/v1/users/{victim.pk}/connections/bulk/", f"/api/v1/users/{victim.pk}/connections/")
+        for method, url in (("post", urls[0]), ("delete", urls[0])):
+            response = getattr(self.client, method)(url, {"connected_users": [peer.pk]}, format="json")
+            self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.client.post(urls[1], {"connected_user": peer.pk}).status_code, 403)
+        self.assertEqual(self.client.delete(f"{urls[1]}{peer.pk}/").status_code, 403)
+        self.assertEqual(APIClient().post(urls[0], {"connected_users": [peer.pk]},
+                                          format="json").status_code, 401)
+        self.assertFalse(victim.connections.exists())
+
+        staff = APIClient()
+        staff.force_authenticate(CustomUser.objects.create(username="staff", is_staff=True))
+        self.assertEqual(staff.post(urls[0], {"connected_users": [peer.pk]}, format="json").status_code, 201)
+        self.assertEqual(self.connected(victim), {peer.pk})
+
+    def test_bulk_validation(self):
+        self.assertEqual(self.bulk("post", []).status_code, 400)
+        self.assertEqual(self.bulk("post", ["x"]).status_code, 400)
+        self.assertEqual(self.bulk("post", list(range(1, 1002))).status_code, 400)
+
+    def test_mutual_connections(self):
+        other = self.users[1]
+        self.connect(self.owner, self.users[2], self.users[3], self.users[4])
+        self.connect(other, self.users[4], self.users[3], self.users[5])
+        url = f"/api/v1/users/{self.owner.pk}/connections/mutual/"
+        response = self.client.get(f"{url}?with={other.pk}&fields=id")
+        self.assertEqual(response.json(), [{"id": self.users[3].pk}, {"id": self.users[4].pk}])
+        self.assertEqual(self.client.get(url).status_code, 400)
+        self.assertEqual(self.client.get(f"{url}?with=me").status_code, 400)
+
+    def test_second_degree_ranked_by_mutual_count(self):
+        a, b, c, d, e = self.users[1:]
+        self.connect(self.owner, a, b)
+        self.connect(a, c, d, self.owner, b)
+        self.connect(b, d, e)
+        url = f"/api/v1/users/{self.owner.pk}/connections/second-degree/"
+        with self.assertNumQueries(2):
+            results = self.client.get(url).json()
+        # b 已直接连接、自己被排除；d 有两个共同连接
+        self.assertEqual([(r["id"], r["mutual_count"]) for r in results],
+                         [(d.pk, 2), (c.pk, 1), (e.pk, 1)])
+        self.assertEqual(len(self.client.get(f"{url}?k=1").json()), 1)
+        self.assertEqual(self.client.get(f"{url}?k=x").status_code, 400)
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        django_cache.clear()
+        self.user = CustomUser.objects.create(username="vet", location="Austin")
+        self.peer = CustomUser.objects.create(username="peer")
+        self.url = f"/api/v1/users/{self.user.pk}/"
+        self.client = APIClient()
+
+    def test_etag_and_not_modified(self):
+        first = self.client.get(self.url)
+        etag = first["ETag"]
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first["Cache-Control"], "private, no-cache")
+        with self.assertNumQueries(0):
+            cached = self.client.get(self.url)
+            not_modified = self.client.get(self.url, HTTP_IF_NONE_MATCH=f'"other", {etag}')
+            strong = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag.removeprefix("W/"))
+        self.assertEqual(cached.json(), first.json())
+        self.assertEqual(cached["ETag"], etag)
+        self.assertEqual((not_modified.status_code, strong.status_code), (304, 304))
+        self.assertEqual(not_modified["ETag"], etag)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_variants_have_their_own_etag(self):
+        full = self.client.get(self.url)
+        sparse = self.client.get(f"{self.url}?fields=id")
+        self.assertNotEqual(full["ETag"], sparse["ETag"])
+        self.assertEqual(sparse.json(), {"id": self.user.pk})
+
+    def test_save_invalidates(self):
+        etag = self.client.get(self.url)["ETag"]
+        padded_url = f"/api/v1/users/0{self.user.pk}/"   # 同一资源，共用版本戳
+        padded_etag = self.client.get(padded_url)["ETag"]
+        self.user.location = "Denver"
+        self.user.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.json()["location"], "Denver")
+        self.assertEqual(self.client.get(padded_url, HTTP_IF_NONE_MATCH=padded_etag).status_code, 200)
+
+    def test_errors_are_not_cached(self):
+        response = self.client.get("/api/v1/users/99999/")
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.has_header("ETag"))
+
+    def test_connection_changes_invalidate(self):
+        url = f"{self.url}connections/"
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.client.force_authenticate(self.user)
+        self.client.post(url, {"connected_user": self.peer.pk})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r["connected_user"] for r in response.json()["results"]], [self.peer.pk])
+
+        etag = response["ETag"]
+        self.client.delete(f"{url}bulk/", {"connected_users": [self.peer.pk]}, format="json")
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).json()["results"], [])
+        other = CustomUser.objects.create(username="other")
+        etag = self.client.get(url)["ETag"]
+        self.client.post(f"{url}bulk/", {"connected_users": [other.pk]}, format="json")   # 不发送 post_save
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class ImporterTests(TestCase):
+    CSV = (
+        "username,full_name,email,city,age,comfort_level_peer_support,career_interests\n"
+        "alpha,Alex Doe,Alex@Example.COM,Austin,34,4,welding\n"
+        "bravo,,not-an-email,Austin,40,3,\n"
+        "charlie,Chris Roe,,Denver,old,3,\n"
+        ",No Name,,Austin,30,3,\n"
+        "alpha,Dup Doe,,Austin,30,3,\n"
+        "delta,Dee Poe,,Austin,30,3,,extra\n"
+        "echo,Eve Ray,,Remote,29,2,\n"
+    )
+
+    def run_import(self, text, fmt="csv", **kwargs):
+        stats = importer.ImportStats()
+        for _ in importer.import_rows(importer.read_rows(io.StringIO(text), fmt), stats=stats, **kwargs):
+            pass
+        return stats
+
+    def test_valid_rows_created_and_bad_rows_reported(self):
+        stats = self.run_import(self.CSV, chunk_size=2)
+        self.assertEqual((stats.read, stats.created, stats.invalid, stats.duplicates), (7, 2, 4, 1))
+        self.assertEqual(sorted(CustomUser.objects.values_list("username", flat=True)), ["alpha", "echo"])
+        alpha = CustomUser.objects.get(username="alpha")
+        self.assertEqual((alpha.first_name, alpha.last_name, alpha.email, alpha.location, alpha.job,
+                          alpha.engage, alpha.age),
+                         ("Alex", "Doe", "Alex@example.com", "Austin", "welding", 4, 34))
+        self.assertFalse(alpha.has_usable_password())
+        errors = "\n".join(stats.errors)
+        for expected in ("line 3: email", "line 4: age must be an integer", "line 5: username is required",
+                         "line 6: username 'alpha' already exists", "line 7: more values than header"):
+            self.assertIn(expected, errors)
+
+    def test_existing_users_are_duplicates(self):
+        CustomUser.objects.create(username="echo")
+        stats = self.run_import(self.CSV)
+        self.assertEqual((stats.created, stats.duplicates), (1, 2))
+
+    def test_jsonl_malformed_lines(self):
+        text = "\n".join([
+            json.dumps({"username": "alpha", "topics_of_interest": ["fishing", "chess"]}),
+            "{not json",
+            json.dumps(["beta"]),
+            "",
+            json.dumps({"username": "gamma", "age": "x"}),
+            json.dumps({"username": "delta", "age": -5}),
+        ])
+        stats = self.run_import(text, fmt="jsonl")
+        self.assertEqual((stats.read, stats.created, stats.invalid), (5, 1, 4))
+        self.assertEqual(CustomUser.objects.get(username="alpha").hobby, "fishing")
+        self.assertTrue(stats.errors[0].startswith("line 2: invalid JSON"))
+        self.assertIn("line 3: expected an object", stats.errors[1])
+
+    def test_dry_run_writes_nothing(self):
+        stats = self.run_import(self.CSV, dry_run=True, enqueue=True)
+        self.assertEqual(stats.created, 2)
+        self.assertFalse(CustomUser.objects.exists())
+        self.assertFalse(AnalysisJob.objects.exists())
+
+    def test_enqueue(self):
+        stats = self.run_import(self.CSV, enqueue=True)
+        self.assertEqual(stats.enqueued, 2)
+        self.assertEqual(set(AnalysisJob.objects.values_list("user__username", flat=True)), {"alpha", "echo"})
+
+    def test_error_list_is_capped(self):
+        stats = importer.ImportStats(max_errors=2)
+        rows = importer.read_rows(io.StringIO("username,age\n" + "a,x\n" * 5), "csv")
+        list(importer.import_rows(rows, stats=stats))
+        self.assertEqual((stats.invalid, len(stats.errors)), (5, 2))
+
+    def test_command(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as f:
+            f.write(self.CSV)
+        self.addCleanup(os.remove, f.name)
+        out, err = io.StringIO(), io.StringIO()
+        call_command("import_veterans", f.name, "--chunk-size", "3", stdout=out, stderr=err)
+        self.assertIn("Created 2 users", out.getvalue())
+        self.assertIn("7 rows read, 2 valid, 4 invalid, 1 duplicates", out.getvalue())
+        self.assertIn("line 4: age must be an integer", err.getvalue())
+        with self.assertRaises(CommandError):
+            call_command("import_veterans", f.name, "--chunk-size", "0")
+        with self.assertRaises(CommandError):
+            call_command("import_veterans", "roster.xlsx")
+        with self.assertRaises(CommandError):
+            call_command("import_veterans", "/nonexistent/roster.csv")
+
+
+class SimilarityTests(TestCase):
+    def setUp(self):
+        similarity._index = None
+        self.addCleanup(setattr, similarity, "_index", None)
+        make = CustomUser.objects.create
+        self.welder = make(username="welder", job="welder", hobby="fishing", location="Austin", wellness=7)
+        self.twin = make(username="twin", job="welder", hobby="fishing", location="Austin", wellness=7)
+        self.near = make(username="near", job="welder", hobby="chess", location="Austin", wellness=2)
+        self.far = make(username="far", job="nurse", hobby="painting", location="Boston", wellness=2)
+        self.client = APIClient()
+
+    def test_top_k_most_similar_first(self):
+        index = similarity.get_index()
+        ranked = index.top_k(self.welder.pk, 10)
+        self.assertEqual([pk for pk, _ in ranked], [self.twin.pk, self.near.pk, self.far.pk])
+        self.assertAlmostEqual(ranked[0][1], 1.0, places=5)
+        self.assertEqual(len(index.top_k(self.welder.pk, 2, exclude=[self.twin.pk])), 2)
+        self.assertEqual(index.top_k(99999, 5), [])
+
+    def test_stored_analysis_tags_are_used(self):
+        Analysis.store(self.twin.pk, {"primary_tags": ["PTSD", "Homeless", "Substance use"],
+                                      "risk_level": "Critical"})
+        index = similarity.SimilarityIndex()
+        a, b = index.encode_many([self.welder, self.twin])
+        self.assertLess(float(a @ b), 0.99)
+        tags = index._tags([self.welder, self.twin])
+        self.assertEqual(tags[1], ["PTSD", "Homeless", "Substance use"])
+
+    def test_signals_keep_rows_consistent(self):
+        index = similarity.get_index()
+        self.far.job, self.far.hobby, self.far.location = "welder", "fishing", "Austin"
+        self.far.wellness = 7
+        self.far.save()
+        self.assertAlmostEqual(index.top_k(self.welder.pk, 1)[0][1], 1.0, places=5)
+
+        self.twin.is_active = False
+        self.twin.save()
+        self.near.delete()
+        newcomer = CustomUser.objects.create(username="new", job="welder", location="Austin")
+        self.assertEqual({pk for pk, _ in index.top_k(self.welder.pk, 10)}, {self.far.pk, newcomer.pk})
+        live = {int(pk) for pk in index._ids if pk >= 0}
+        self.assertEqual(live, set(index._rows))
+        self.assertTrue(all(index._ids[row] == pk for pk, row in index._rows.items()))
+        self.assertEqual(len(index._rows) + len(index._free), len(index._matrix))
+
+    def test_rebuild_replays_changes_made_during_build(self):
+        current = similarity.get_index()
+        stale = list(CustomUser.objects.all())
+
+        def build():
+            # 构建读取数据库之后，signals 还在改旧索引
+            self.far.job, self.far.hobby, self.far.location = "welder", "fishing", "Austin"
+            self.far.wellness = 7
+            self.far.save()
+            self.near.delete()
+            index = similarity.SimilarityIndex()
+            index.build(stale)
+            return index
+
+        similarity._rebuilding.set()
+        with mock.patch.object(similarity, "_build_index", build), \
+                mock.patch.object(similarity, "connection") as db:
+            similarity._rebuild_in_background()
+        rebuilt = similarity.get_index(build=False)
+        self.assertIsNot(rebuilt, current)
+        self.assertFalse(similarity._rebuilding.is_set())
+        db.close.assert_called_once_with()
+        ranked = dict(rebuilt.top_k(self.welder.pk, 10))
+        self.assertNotIn(self.near.pk, ranked)
+        self.assertAlmostEqual(ranked[self.far.pk], 1.0, places=5)
+
+        current.remove(self.twin.pk)   # 旧索引的后续改动转给新索引
+        self.assertNotIn(self.twin.pk, dict(rebuilt.top_k(self.welder.pk, 10)))
+
+    def test_failed_rebuild_keeps_current_index(self):
+        current = similarity.get_index()
+        with mock.patch.object(similarity, "_build_index", side_effect=RuntimeError("db down")), \
+                mock.patch.object(similarity, "connection") as db, \
+                self.assertLogs("users.similarity", "ERROR"):
+            similarity._rebuild_in_background()
+        self.assertIs(similarity.get_index(build=False), current)
+        self.assertIsNone(current._changes)
+        db.close.assert_called_once_with()
+
+    def test_suggestions_exclude_connections_both_ways(self):
+        UserConnection.objects.create(user=self.welder, connected_user=self.twin)
+        UserConnection.objects.create(user=self.far, connected_user=self.welder)
+        results = self.client.get(f"/api/v1/users/{self.welder.pk}/suggestions/").json()
+        self.assertEqual([r["id"] for r in results], [self.near.pk])
+        self.assertIn("similarity", results[0])
+
+    def test_suggestions_k_bounds(self):
+        url = f"/api/v1/users/{self.welder.pk}/suggestions/"
+        self.assertEqual(len(self.client.get(f"{url}?k=0").json()), 1)
+        self.assertEqual(len(self.client.get(f"{url}?k=2").json()), 2)
+        self.assertEqual(len(self.client.get(f"{url}?k=1000").json()), 3)
+        with mock.patch.object(similarity.SimilarityIndex, "top_k", return_value=[]) as top_k:
+            self.client.get(f"{url}?k=1000")
+        self.assertEqual(top_k.call_args[0][1], 50)
+        self.assertEqual(self.client.get(f"{url}?k=x").status_code, 400)
+
+
+class ProfileMappingTests(TestCase):
+    def test_user_fields_reach_the_profile(self):
+        user = CustomUser(username="vet", job="welder", hobby="fishing", location="Austin", engage=4,
+                          age=41, mental_health=2, wellness=8, description="  Night shifts  ")
+        profile = veteran_profile_for(user)
+        self.assertEqual(profile.age, 41)
+        self.assertEqual(profile.topics_of_interest, ["fishing", "Night shifts"])
+        self.assertEqual(profile.looking_for, ["Mental health counseling"])
+        self.assertTrue(profile.mood_tracker_optin and profile.daily_wellness_checkins)
+        self.assertEqual(profile.comfort_level_peer_support, 4)
+
+        empty = veteran_profile_for(CustomUser(username="new"))
+        self.assertEqual((empty.age, empty.looking_for, empty.topics_of_interest), (0, None, None))
+        self.assertFalse(empty.mood_tracker_optin or empty.daily_wellness_checkins)
+
+    def test_description_with_crisis_wording_reaches_crisis_route(self):
+        user = CustomUser.objects.create(username="vet", hobby="fishing",
+                                         description="Lost my job and I feel hopeless most days")
+        grouper = make_grouper()
+        self.assertEqual(grouper.pretriage_engine.triage([veteran_profile_for(user)])[0].route,
+                         ROUTE_CRISIS)
+        with mock.patch("users.grouping.get_grouper", return_value=grouper):
+            analysis = quick_analysis_for(user)
+        self.assertTrue(analysis["intervention_needed"])
+        self.assertEqual(analysis["risk_level"], "Critical")
+
+    def test_low_ratings_are_in_the_prompt(self):
+        user = CustomUser(username="vet", age=30, mental_health=1, wellness=1, description="cannot sleep")
+        prompt, _ = make_grouper()._build_analysis_prompts(veteran_profile_for(user))
+        for text in ("Age: 30", "Mental health counseling, Wellness support", "cannot sleep", "mood tracker"):
+            self.assertIn(text, prompt)
+
+
+class EmotionTests(SimpleTestCase):
+    def test_classifier_loads_once_under_concurrent_first_calls(self):
+        loads = []
+
+        def load(*args, **kwargs):
+            time.sleep(0.05)   # 加载期间其余线程都在等待
+            loads.append(args)
+            return object()
+
+        with mock.patch.object(emotion_model, "_emotion_classifier", None), \
+                mock.patch.object(emotion_model, "BACKEND", "onnx"), \
+                mock.patch("models.emotion_onnx.OnnxEmotionClassifier", side_effect=load):
+            with ThreadPoolExecutor(8) as pool:
+                classifiers = list(pool.map(lambda _: emotion_model.get_emotion_classifier(), range(8)))
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(len({id(c) for c in classifiers}), 1)
+
+    def test_failures_are_logged_not_reported_as_calm(self):
+        failing = mock.Mock(side_effect=RuntimeError("boom"))
+        with mock.patch.object(emotion_model, "get_sidecar_client", return_value=None), \
+                mock.patch.object(emotion_model, "_batcher", failing), \
+                mock.patch.object(emotion_model, "_classify_batch", failing):
+            with self.assertLogs("models.emotion_model", "ERROR"):
+                self.assertIsNone(emotion_model.predict_emotion("I feel fine"))
+            with self.assertLogs("models.emotion_model", "ERROR"):
+                self.assertEqual(emotion_model.predict_emotions(["a", "b", "c"], batch_size=2),
+                                 [None, None, None])
+
+    def test_configuration_errors_are_raised(self):
+        with mock.patch.object(emotion_model, "get_sidecar_client", return_value=None), \
+                mock.patch.object(emotion_model, "_batcher", side_effect=FileNotFoundError("model.onnx")):
+            with self.assertRaises(FileNotFoundError):
+                emotion_model.predict_emotion("text")
+
+
+
+@skipUnless(all(importlib.util.find_spec(name) for name in ("onnx", "onnxruntime", "tokenizers")),
+            "needs onnx, onnxruntime and tokenizers")
+class OnnxEmotionTests(SimpleTestCase):
+    """``OnnxEmotionClassifier`` on a tiny model: logits are the sum of per-token label scores"""
+    LABELS = ["joy", "sadness", "anger"]
+    VOCAB = {"[PAD]": 0, "[UNK]": 1, "great": 2, "miss": 3, "furious": 4}
+
+    def setUp(self):
+        import onnx
+        from onnx import TensorProto, helper, numpy_helper
+        from tokenizers import Tokenizer, models, pre_tokenizers
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.model_dir = tmp.name
+
+        scores = np.zeros((len(self.VOCAB), len(self.LABELS)), dtype=np.float32)
+        for token, label in (("great", 0), ("miss", 1), ("furious", 2)):
+            scores[self.VOCAB[token], label] = 1.0
+        graph = helper.make_graph(
+            [
+                helper.make_node("Gather", ["scores", "input_ids"], ["token_scores"]),
+                helper.make_node("Cast", ["attention_mask"], ["mask"], to=TensorProto.FLOAT),
+                helper.make_node("Unsqueeze", ["mask", "axis"], ["mask3"]),
+                helper.make_node("Mul", ["token_scores", "mask3"], ["masked"]),
+                helper.make_node("ReduceSum", ["masked", "seq_axis"], ["logits"], keepdims=0),
+            ],
+            "tiny-emotion",
+            [helper.make_tensor_value_info(name, TensorProto.INT64, ["batch", "sequence"])
+             for name in ("input_ids", "attention_mask")],
+            [helper.make_tensor_value_info("logits", TensorProto.FLOAT, ["batch", len(self.LABELS)])],
+            [numpy_helper.from_array(scores, "scores"),
+             numpy_helper.from_array(np.array([2], dtype=np.int64), "axis"),
+             numpy_helper.from_array(np.array([1], dtype=np.int64), "seq_axis")],
+        )
+        model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 17)])
+        model.ir_version = 8
+        onnx.save(model, os.path.join(self.model_dir, emotion_onnx.FP32_FILE))
+
+        tokenizer = Tokenizer(models.WordLevel(self.VOCAB, unk_token="[UNK]"))
+        tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+        tokenizer.save(os.path.join(self.model_dir, "tokenizer.json"))
+        with open(os.path.join(self.model_dir, "config.json"), "w") as f:
+            json.dump({"id2label": dict(enumerate(self.LABELS)), "pad_token_id": 0}, f)
+
+    def classifier(self):
+        return emotion_onnx.OnnxEmotionClassifier(self.model_dir, quantized=False)
+
+    def labels(self, results):
+        return [result[0]["label"] for result in results]
+
+    def test_pipeline_shaped_results(self):
+        results = self.classifier()(["great great miss", "I miss them", "furious"])
+        self.assertEqual(self.labels(results), ["joy", "sadness", "anger"])
+        self.assertAlmostEqual(results[0][0]["score"], np.exp(2) / (np.exp(2) + np.exp(1) + 1), places=5)
+        self.assertEqual(self.labels(self.classifier()("so great")), ["joy"])
+
+    def test_batches_keep_input_order(self):
+        classifier = self.classifier()
+        texts = ["great", "miss", "furious", "miss miss", "great furious furious"]
+        with mock.patch.object(classifier.session, "run", wraps=classifier.session.run) as run:
+            results = classifier(texts, batch_size=2)
+        self.assertEqual(run.call_count, 3)
+        self.assertEqual(self.labels(results), ["joy", "sadness", "anger", "sadness", "anger"])
+        # 填充位置被 attention_mask 屏蔽，不影响结果
+        self.assertEqual(results, classifier(texts, batch_size=1))
+
+    def test_truncation(self):
+        classifier = self.classifier()
+        text = "miss miss " + "great " * 3
+        with mock.patch.object(emotion_onnx, "MAX_LENGTH", 2):
+            self.assertEqual(self.labels(classifier([text])), ["sadness"])
+            self.assertEqual(self.labels(classifier([text], truncation=False)), ["joy"])
+
+    def test_falls_back_to_fp32_without_an_int8_model(self):
+        with self.assertLogs("models.emotion_onnx", "WARNING"):
+            classifier = emotion_onnx.OnnxEmotionClassifier(self.model_dir, quantized=True)
+        self.assertEqual(self.labels(classifier(["great"])), ["joy"])
+
+    def test_missing_model_raises(self):
+        os.remove(os.path.join(self.model_dir, emotion_onnx.FP32_FILE))
+        for quantized in (True, False):
+            with self.assertRaises(FileNotFoundError):
+                emotion_onnx.OnnxEmotionClassifier(self.model_dir, quantized=quantized)
+
+
+class MicroBatcherTests(SimpleTestCase):
+    def make(self, batch_fn=None, **kwargs):
+        self.batches = []
+
+        def double(items):
+            self.batches.append(list(items))
+            return [item * 2 for item in items]
+
+        batcher = MicroBatcher(batch_fn or double, **kwargs)
+        self.addCleanup(batcher.close)
+        return batcher
+
+    def test_flushes_a_full_batch_without_waiting(self):
+        batcher = self.make(max_batch_size=4, max_wait_ms=60_000)
+        futures = [batcher.submit(i) for i in range(4)]
+        self.assertEqual([f.result(timeout=5) for f in futures], [0, 2, 4, 6])
+        self.assertEqual(self.batches, [[0, 1, 2, 3]])
+
+    def test_flushes_a_partial_batch_after_the_wait(self):
+        batcher = self.make(max_batch_size=100, max_wait_ms=50)
+        started = time.monotonic()
+        futures = [batcher.submit(i) for i in range(3)]
+        self.assertEqual([f.result(timeout=5) for f in futures], [0, 2, 4])
+        self.assertGreaterEqual(time.monotonic() - started, 0.04)
+        self.assertEqual(self.batches, [[0, 1, 2]])
+
+    def test_results_match_callers_across_batches(self):
+        batcher = self.make(max_batch_size=3, max_wait_ms=1, workers=2)
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(batcher, range(50)))
+        self.assertEqual(results, [i * 2 for i in range(50)])
+        self.assertTrue(all(len(batch) <= 3 for batch in self.batches))
+        self.assertEqual(batcher.items_processed, 50)
+
+    def test_errors_reach_every_waiter(self):
+        error = RuntimeError("boom")
+        batcher = self.make(mock.Mock(side_effect=error), max_batch_size=3, max_wait_ms=60_000)
+        futures = [batcher.submit(i) for i in range(3)]
+        for future in futures:
+            self.assertIs(future.exception(timeout=5), error)
+
+    def test_wrong_result_count_fails_the_batch(self):
+        batcher = self.make(lambda items: items[:1], max_batch_size=2, max_wait_ms=60_000)
+        futures = [batcher.submit(i) for i in range(2)]
+        for future in futures:
+            self.assertIsInstance(future.exception(timeout=5), RuntimeError)
+
+
+class SidecarTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.socket_path = os.path.join(tmp.name, "emotion.sock")
+        classify = mock.patch.object(emotion_model, "_classify_batch",
+                                     side_effect=lambda texts: ["sad" if "miss" in t else "happy" for t in texts])
+        classify.start()
+        self.addCleanup(classify.stop)
+
+    def serve(self):
+        server = EmotionSidecarServer(self.socket_path, batch_wait_ms=1)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def sidecar_client(self):
+        client = SidecarClient(self.socket_path, timeout=5)
+        self.addCleanup(client.close)
+        return client
+
+    def test_round_trip(self):
+        self.serve()
+        client = self.sidecar_client()
+        self.assertEqual(client.classify(["great day", "I miss my unit"]), ["happy", "sad"])
+        self.assertEqual(client.health()["status"], "ok")
+        with self.assertRaisesRegex(SidecarError, "texts must be a list"):
+            client.request({"op": "classify", "texts": "not a list"})
+
+    def test_unreachable_sidecar_raises_sidecar_error(self):
+        with self.assertRaisesRegex(SidecarError, "unavailable"):
+            self.sidecar_client().classify(["hello"])
+
+    def test_reconnects_after_a_sidecar_restart(self):
+        client = self.sidecar_client()
+        server = self.serve()
+        self.assertEqual(client.classify(["hello"]), ["happy"])
+        server.shutdown()
+        server.server_close()
+        self.serve()
+        self.assertEqual(client.classify(["hello"]), ["happy"])
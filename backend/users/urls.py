@@ -1,11 +1,17 @@
 from django.urls import path
-from .views import RegisterView
+from .views import RegisterView, TriageView
 from rest_framework.routers import DefaultRouter
-from .views import UserViewSet
+from .views import AnalysisJobViewSet, UserViewSet
+from .async_views import AnalyzeView, JobEventsView, OutreachView
 
 router = DefaultRouter()
 router.register(r"users", UserViewSet, basename="user")
+router.register(r"jobs", AnalysisJobViewSet, basename="analysis-job")
 
 urlpatterns = [
     path("register/", RegisterView.as_view(), name="register"),  # ✅ POST /api/register/
+    path("triage/", TriageView.as_view(), name="triage"),
+    path("users/<int:pk>/analyze/", AnalyzeView.as_view(), name="user-analyze"),
+    path("users/<int:pk>/outreach/", OutreachView.as_view(), name="user-outreach"),
+    path("jobs/<int:pk>/events/", JobEventsView.as_view(), name="analysis-job-events"),
 ] + router.urls
@@ -1,37 +1,84 @@
-from rest_framework import viewsets, status
+import json
+from datetime import datetime
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Q
+from django.http import StreamingHttpResponse
+from django.utils.dateparse import parse_datetime
+from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
+from rest_framework.pagination import CursorPagination
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
-from .models import CustomUser, UserConnection
-from .serializers import UserSerializer, ConnectionSerializer
+from . import cache
+from .grouping import analysis_for, get_grouper, veteran_profile_for
+from .jobs import enqueue_analysis, latest_job
+from .models import Analysis, AnalysisJob, CustomUser, UserConnection
+from .renderers import EventStreamRenderer, sse_event
+from .serializers import (
+    AnalysisJobSerializer, BulkConnectionSerializer, ConnectionSerializer, TriageSerializer,
+    UserSerializer,
+)
+from .similarity import get_index
+
+MAX_SUGGESTIONS = 50
+MAX_SECOND_DEGREE = 50
+
+
+class UserCursorPagination(CursorPagination):
+    """Keyset pagination on the primary key: every page is an index range scan"""
+    ordering = "id"
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 200
+
+
+class ConnectionCursorPagination(UserCursorPagination):
+    ordering = "-id"   # 与 created_at 同序（最新在前），但走主键/外键索引
+
 
 class UserViewSet(viewsets.ModelViewSet):
     queryset = CustomUser.objects.all()
     serializer_class = UserSerializer
+    pagination_class = UserCursorPagination
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+        if self.action in ("list", "retrieve"):
+            qs = UserSerializer.only_requested(qs, self.request)
+        return qs
+
+    def retrieve(self, request, *args, **kwargs):
+        return cache.cached_response(request, cache.USER, kwargs["pk"],
+                                     lambda: super(UserViewSet, self).retrieve(request, *args, **kwargs))
 
     @action(
         detail=True,
         methods=["post", "get", "delete"],
-        url_path="connections(?:/(?P<connected_pk>[^/.]+))?",
+        url_path=r"connections(?:/(?P<connected_pk>\d+))?",
     )
     def connections(self, request, pk=None, connected_pk=None):
+        if request.method == "GET":
+            return cache.cached_response(request, cache.CONNECTIONS, pk,
+                                         lambda: self._list_connections(request))
         user = self.get_object()
+        if request.user != user and not request.user.is_staff:
+            return Response(status=status.HTTP_403_FORBIDDEN)
 
         # ---------- POST ----------
         if request.method == "POST":
-            if user.pk == request.data.get("connected_user"):
-                return Response({"detail": "Cannot connect user to self"},
-                                status=status.HTTP_400_BAD_REQUEST)
-
             ser = ConnectionSerializer(data=request.data)
             ser.is_valid(raise_exception=True)
-            ser.save(user=user)
+            if ser.validated_data["connected_user"].pk == user.pk:
+                return Response({"detail": "Cannot connect user to self"},
+                                status=status.HTTP_400_BAD_REQUEST)
+            try:
+                with transaction.atomic():
+                    ser.save(user=user)
+            except IntegrityError:
+                return Response({"detail": "Already connected"}, status=status.HTTP_400_BAD_REQUEST)
             return Response(ser.data, status=status.HTTP_201_CREATED)
 
-        # ---------- GET ----------
-        if request.method == "GET":
-            qs = user.connections.select_related("connected_user")
-            return Response(ConnectionSerializer(qs, many=True).data)
-
         # ---------- DELETE ----------
         if request.method == "DELETE":
             deleted, _ = user.connections.filter(connected_user_id=connected_pk).delete()
@@ -39,11 +86,274 @@ class UserViewSet(viewsets.ModelViewSet):
                 return Response(status=status.HTTP_404_NOT_FOUND)
             return Response(status=status.HTTP_204_NO_CONTENT)
 
+    def _list_connections(self, request):
+        user = self.get_object()
+        # user_id 需保留：related manager 会读取它
+        qs = ConnectionSerializer.only_requested(user.connections.all(), request, "user")
+        paginator = ConnectionCursorPagination()
+        page = paginator.paginate_queryset(qs, request, view=self)
+        data = ConnectionSerializer(page, many=True, context=self.get_serializer_context()).data
+        return paginator.get_paginated_response(data)
+
+    @action(detail=True, methods=["post", "delete"], url_path="connections/bulk")
+    def connections_bulk(self, request, pk=None):
+        """POST/DELETE /api/v1/users/{id}/connections/bulk/ — body {"connected_users": [ids]}"""
+        user = self.get_object()
+        if request.user != user and not request.user.is_staff:
+            return Response(status=status.HTTP_403_FORBIDDEN)
+        ser = BulkConnectionSerializer(data=request.data)
+        ser.is_valid(raise_exception=True)
+        ids = set(ser.validated_data["connected_users"]) - {user.pk}
+
+        if request.method == "DELETE":
+            deleted, _ = user.connections.filter(connected_user_id__in=ids).delete()
+            return Response({"deleted": deleted})
+
+        existing = set(CustomUser.objects.filter(pk__in=ids).values_list("pk", flat=True))
+        already = set(user.connections.filter(connected_user_id__in=existing)
+                      .values_list("connected_user_id", flat=True))
+        UserConnection.objects.bulk_create(
+            [UserConnection(user=user, connected_user_id=peer_id) for peer_id in existing - already],
+            ignore_conflicts=True,   # 并发请求已创建的连接直接跳过
+        )
+        cache.invalidate(cache.CONNECTIONS, user.pk)   # bulk_create 不发送 post_save
+        return Response({
+            "created": len(existing - already),
+            "already_connected": sorted(already),
+            "not_found": sorted(ids - existing),
+        }, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=["get"], url_path="connections/mutual")
+    def mutual_connections(self, request, pk=None):
+        """GET /api/v1/users/{id}/connections/mutual/?with={other_id} — users both have connected to"""
+        user = self.get_object()
+        try:
+            other_id = int(request.query_params["with"])
+        except (KeyError, ValueError):
+            return Response({"detail": "with must be a user id"}, status=status.HTTP_400_BAD_REQUEST)
+
+        qs = (CustomUser.objects
+              .filter(connected_to__user=user)
+              .filter(connected_to__user_id=other_id)
+              .order_by("id"))
+        qs = UserSerializer.only_requested(qs, request)
+        return Response(UserSerializer(qs, many=True, context=self.get_serializer_context()).data)
+
+    @action(detail=True, methods=["get"], url_path="connections/second-degree")
+    def second_degree(self, request, pk=None):
+        """GET /api/v1/users/{id}/connections/second-degree/?k=20 — friends of friends not yet connected
+
+        Ranked by how many of the user's connections link to them, in one query.
+        """
+        user = self.get_object()
+        try:
+            k = min(max(int(request.query_params.get("k", 20)), 1), MAX_SECOND_DEGREE)
+        except ValueError:
+            return Response({"detail": "k must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+
+        qs = (CustomUser.objects
+              .filter(connected_to__user__connected_to__user=user)
+              .exclude(pk=user.pk)
+              .exclude(connected_to__user=user)
+              .annotate(mutual_count=Count("connected_to"))
+              .order_by("-mutual_count", "id"))
+        qs = UserSerializer.only_requested(qs, request)[:k]
+        results = []
+        for peer in qs:
+            data = UserSerializer(peer, context=self.get_serializer_context()).data
+            data["mutual_count"] = peer.mutual_count
+            results.append(data)
+        return Response(results)
+
+    @action(detail=True, methods=["get"])
+    def suggestions(self, request, pk=None):
+        """GET /api/v1/users/{id}/suggestions/?k=10 — most similar veterans not yet connected"""
+        user = self.get_object()
+        try:
+            k = min(max(int(request.query_params.get("k", 10)), 1), MAX_SUGGESTIONS)
+        except ValueError:
+            return Response({"detail": "k must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+
+        connected = set(user.connections.values_list("connected_user_id", flat=True))
+        connected.update(user.connected_to.values_list("user_id", flat=True))
+        ranked = get_index().top_k(user.pk, k, exclude=connected)
+
+        peers = CustomUser.objects.in_bulk([pk for pk, _ in ranked])
+        results = []
+        for peer_id, score in ranked:
+            if peer_id in peers:
+                data = UserSerializer(peers[peer_id]).data
+                data["similarity"] = round(score, 4)
+                results.append(data)
+        return Response(results)
+
+    @action(
+        detail=True,
+        methods=["get"],
+        url_path="outreach/stream",
+        renderer_classes=[EventStreamRenderer, JSONRenderer],
+        permission_classes=[permissions.IsAuthenticated],
+    )
+    def outreach_stream(self, request, pk=None):
+        """GET /api/v1/users/{id}/outreach/stream/ — outreach message as SSE tokens"""
+        user = self.get_object()
+        if request.user != user and not request.user.is_staff:
+            return Response(status=status.HTTP_403_FORBIDDEN)
+        profile = veteran_profile_for(user)
+        analysis = analysis_for(user)
+        tokens = get_grouper().stream_personalized_outreach(profile, analysis)
+
+        def events():
+            for token in tokens:
+                yield sse_event({"token": token})
+            yield sse_event({}, event="done")
+
+        response = StreamingHttpResponse(events(), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"   # 关闭 nginx 缓冲
+        return response
+
+    @action(
+        detail=True,
+        methods=["get", "post"],
+        url_path="analysis-job",
+        permission_classes=[permissions.IsAuthenticated],
+    )
+    def analysis_job(self, request, pk=None):
+        """GET: latest analysis job for the user; POST: queue a fresh analysis"""
+        user = self.get_object()
+        if request.user != user and not request.user.is_staff:
+            return Response(status=status.HTTP_403_FORBIDDEN)
+
+        if request.method == "POST":
+            job = enqueue_analysis(user.pk)
+            return Response(AnalysisJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+        job = latest_job(user.pk)
+        if job is None:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        return Response(AnalysisJobSerializer(job).data)
+
 
-from rest_framework import generics, permissions
+class AnalysisJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """Status of background analysis jobs; users only see their own"""
+    queryset = AnalysisJob.objects.all()
+    serializer_class = AnalysisJobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+        if not self.request.user.is_staff:
+            qs = qs.filter(user=self.request.user)
+        return qs
+
+
+from rest_framework import generics
+from rest_framework.exceptions import NotFound, ValidationError
 from .serializers import RegisterSerializer, UserSerializer
 
 class RegisterView(generics.CreateAPIView):
     queryset = CustomUser.objects.all()
     serializer_class = RegisterSerializer
     permission_classes = [permissions.AllowAny]   # 注册不需要登录
+
+
+class TriageCursorPagination(UserCursorPagination):
+    """
+    Keyset pagination in ``analysis_triage_idx`` order
+
+    DRF's cursor only compares the first ordering column and steps over
+    ties with an OFFSET, and priority scores tie a lot. This cursor holds
+    every ordering column (the primary key last, so it is unique), and
+    each page is a range scan of the index.
+    """
+    ordering = ("-calculated_priority_score", "-priority_score", "-analyzed_at", "pk")
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+        reverse = bool(self.cursor and self.cursor.reverse)
+        position = self.cursor.position if self.cursor else None
+
+        ordering = [self._flip(field) for field in self.ordering] if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self._beyond(position, ordering))
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        following = (self._get_position_from_instance(results[-1], self.ordering)
+                     if len(results) > self.page_size else None)
+
+        if reverse:
+            self.page.reverse()
+            self.next_position, self.previous_position = position, following
+        else:
+            self.next_position, self.previous_position = following, position
+        self.has_next = self.next_position is not None
+        self.has_previous = self.previous_position is not None
+        self.display_page_controls = self.has_next or self.has_previous
+        return self.page
+
+    @staticmethod
+    def _flip(field: str) -> str:
+        return field[1:] if field.startswith("-") else f"-{field}"
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = [getattr(instance, field.lstrip("-")) for field in self.ordering]
+        return json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+
+    def _beyond(self, position: str, ordering) -> Q:
+        """Rows after ``position`` in ``ordering``: (a, b, ...) compared as a tuple"""
+        try:
+            score, model_score, analyzed_at, pk = json.loads(position)
+            values = [int(score), int(model_score), parse_datetime(analyzed_at), int(pk)]
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if values[2] is None:
+            raise NotFound(self.invalid_cursor_message)
+
+        condition, equal = Q(), {}
+        for field, value in zip(ordering, values):
+            name = field.lstrip("-")
+            condition |= Q(**equal, **{f"{name}__{'lt' if field.startswith('-') else 'gt'}": value})
+            equal[name] = value
+        # 首列的范围条件让数据库直接定位到索引中的位置
+        first = ordering[0]
+        bound = {f"{first.lstrip('-')}__{'lte' if first.startswith('-') else 'gte'}": values[0]}
+        return Q(**bound) & condition
+
+
+class TriageView(generics.ListAPIView):
+    """GET /api/v1/triage/?risk_level=Critical,High&intervention_needed=true&min_score=10
+
+    Highest-priority veterans first, read from stored analyses via the
+    triage index; nothing is re-analyzed or sorted in Python.
+    """
+    serializer_class = TriageSerializer
+    pagination_class = TriageCursorPagination
+    permission_classes = [permissions.IsAdminUser]   # 仅限个案工作人员
+
+    def get_queryset(self):
+        qs = Analysis.objects.select_related("user").filter(user__is_active=True)
+        params = self.request.query_params
+
+        if params.get("risk_level"):
+            levels = [level.strip().capitalize() for level in params["risk_level"].split(",")]
+            unknown = set(levels) - set(Analysis.RISK_LEVELS)
+            if unknown:
+                raise ValidationError({"risk_level": f"Unknown risk level(s): {', '.join(sorted(unknown))}"})
+            qs = qs.filter(risk_level__in=levels)
+
+        if params.get("intervention_needed") is not None:
+            qs = qs.filter(intervention_needed=params["intervention_needed"].lower() in ("1", "true", "yes"))
+
+        if params.get("min_score"):
+            try:
+                qs = qs.filter(calculated_priority_score__gte=int(params["min_score"]))
+            except ValueError:
+                raise ValidationError({"min_score": "min_score must be an integer"})
+
+        return qs   # 排序由 TriageCursorPagination 按索引列给出
+